@@ -0,0 +1,94 @@
+import hashlib
+import re
+import unicodedata
+
+from retriever import tokenize
+
+# 質問の末尾の疑問符・句点など、意味に影響しない記号
+TRAILING_PUNCTUATION_PATTERN = re.compile(r'[\s?!。．.、,]+$')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_question(question):
+    """表記の揺れ（全角・半角、大文字・小文字、空白、末尾の記号）を揃えた質問を返す"""
+    text = unicodedata.normalize('NFKC', question).lower().strip()
+    text = WHITESPACE_PATTERN.sub(' ', text)
+    return TRAILING_PUNCTUATION_PATTERN.sub('', text)
+
+
+def question_key(normalized_question):
+    return hashlib.sha256(normalized_question.encode('utf-8')).hexdigest()
+
+
+def site_content_hash(pages):
+    """サイトを構成するページのURLとコンテンツから、サイトの内容を表すハッシュを計算する"""
+    digest = hashlib.sha256()
+    for page in pages:
+        digest.update((page.get("url") or "").encode('utf-8'))
+        digest.update(b'\0')
+        digest.update((page.get("content") or "").encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def question_similarity(a, b):
+    """検索用のトークン（日本語は文字バイグラム）の集合のJaccard係数で質問の類似度を計算する"""
+    tokens_a = set(tokenize(a))
+    tokens_b = set(tokenize(b))
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+
+class AnswerCache:
+    """サイトの内容と質問に対する回答のキャッシュ（保存先はDBManager）
+    
+    サイトの内容のハッシュと正規化した質問をキーとし、有効期限（ttl秒）と
+    件数の上限（max_entries、最後に使われた日時が古いものから削除）を持つ。
+    similarity_thresholdが0より大きい場合、完全に一致する質問がなければ
+    同じサイトの質問のうち類似度がしきい値以上のものの回答を使用する。
+    """
+    def __init__(self, db_manager, ttl=86400, max_entries=10000, similarity_threshold=0, max_candidates=500):
+        self.db_manager = db_manager
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.max_candidates = max_candidates
+    
+    def get(self, content_hash, question):
+        """キャッシュされた回答を返す（ない場合はNone）"""
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        
+        entry = self.db_manager.get_cached_answer(content_hash, question_key(normalized))
+        if entry is None and self.similarity_threshold > 0:
+            entry = self._find_similar(content_hash, normalized)
+        if entry is None:
+            return None
+        
+        self.db_manager.touch_cached_answer(entry["id"])
+        return entry["answer"]
+    
+    def _find_similar(self, content_hash, normalized):
+        """同じサイトで最近使われた質問から、最も類似度の高いものを探す"""
+        best, best_score = None, self.similarity_threshold
+        for candidate in self.db_manager.get_cached_questions(content_hash, self.max_candidates):
+            score = question_similarity(normalized, candidate["question"])
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+    
+    def put(self, content_hash, question, answer):
+        """回答を保存する"""
+        normalized = normalize_question(question)
+        if not normalized or not answer:
+            return False
+        return self.db_manager.save_cached_answer(
+            content_hash,
+            question_key(normalized),
+            normalized,
+            answer,
+            self.ttl,
+            self.max_entries
+        )
@@ -1,13 +1,45 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from chatbot import GeminiChatbot
-from config import API_HOST, API_PORT
+from typing import Optional
+from chatbot import GeminiChatbot, SITE_FLIGHTS, ANSWER_FLIGHTS
+from config import (
+    API_HOST,
+    API_PORT,
+    WORKER_THREADS,
+    MAX_PENDING_TASKS,
+    INITIALIZE_TIMEOUT,
+    ASK_TIMEOUT,
+    MAX_SESSIONS,
+    SESSION_IDLE_TIMEOUT,
+    SESSION_MEMORY_LIMIT_MB,
+    SHARED_SITE_CACHE_SIZE,
+    CRAWL_JOB_WORKERS,
+    CRAWL_JOB_HISTORY,
+    CACHE_SWEEP_INTERVAL,
+    CACHE_VACUUM_FREE_RATIO,
+    TIMING_HEADER_ENABLED,
+)
 import uvicorn
-from db_manager import DBManager
+from db_manager import DBManager, CacheSweeper
+from session_manager import SessionManager, SiteRegistry, is_valid_session_id
+from crawl_jobs import CrawlJobManager, CRAWL_MODES
+from scraper import shutdown_parse_pool
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from concurrent.futures import ThreadPoolExecutor
+from logging_setup import setup_logging
+from metrics import REGISTRY, HTTP_REQUEST_SECONDS, start_request_timings, format_server_timing
+import asyncio
+import contextvars
+import functools
+import time
 import os
+import json
+import uuid
+
+# ログの出力先とレベルを設定
+setup_logging()
 
 app = FastAPI(title="ウェブサイト情報チャットボットAPI")
 
@@ -18,18 +50,148 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Session-ID", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """リクエストの処理時間を記録し、設定で有効な場合は処理時間の内訳をServer-Timingヘッダーで返す
+    
+    内訳（fetch / parse / db / model / retrieve）は並行して実行された処理の時間の合計。
+    ストリーミングのレスポンスでは最初の断片を返すまでの内訳になる。
+    """
+    timings = start_request_timings()
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    
+    # パスはルートのテンプレート（/crawl/jobs/{job_id} など）で集計する
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(
+        elapsed,
+        method=request.method,
+        path=getattr(route, "path", "unmatched"),
+        status=response.status_code
+    )
+    if TIMING_HEADER_ENABLED:
+        response.headers["Server-Timing"] = format_server_timing(timings, elapsed)
+    return response
+
 # 静的ファイル提供の設定
 # カレントディレクトリの静的ファイルを提供
 app.mount("/static", StaticFiles(directory="."), name="static")
 
-# グローバルチャットボットインスタンス
-chatbot = GeminiChatbot(use_cache=True)
+# セッションごとのチャットボット（読み込み済みのサイトはセッション間で共有する）
+SESSION_HEADER = "X-Session-ID"
+SESSION_COOKIE = "session_id"
+
+site_registry = SiteRegistry(max_idle_sites=SHARED_SITE_CACHE_SIZE)
+sessions = SessionManager(
+    lambda: GeminiChatbot(use_cache=True, site_registry=site_registry),
+    max_sessions=MAX_SESSIONS,
+    idle_timeout=SESSION_IDLE_TIMEOUT,
+    max_memory_mb=SESSION_MEMORY_LIMIT_MB
+)
+
+def get_session_id(request: Request, response: Response):
+    """ヘッダーまたはCookieからセッションIDを取得する（なければ新しく発行する）"""
+    session_id = request.headers.get(SESSION_HEADER) or request.cookies.get(SESSION_COOKIE)
+    if not is_valid_session_id(session_id):
+        session_id = uuid.uuid4().hex
+    
+    response.headers[SESSION_HEADER] = session_id
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return session_id
+
+def get_chatbot(session_id: str = Depends(get_session_id)):
+    """セッションのチャットボットを取得する"""
+    return sessions.get(session_id)
 
 # データベースマネージャー
 db_manager = DBManager()
 
+# 期限切れキャッシュの定期的な削除とデータベースの縮小
+cache_sweeper = CacheSweeper(db_manager, interval=CACHE_SWEEP_INTERVAL, min_free_ratio=CACHE_VACUUM_FREE_RATIO)
+
+# バックグラウンドでクロールを実行するジョブ（ワーカー数でサーバー全体のクロール数を制限する）
+crawl_jobs = CrawlJobManager(max_workers=CRAWL_JOB_WORKERS, max_finished_jobs=CRAWL_JOB_HISTORY)
+
+# スクレイピングやモデル呼び出しなどの同期処理を実行するワーカースレッド
+# （イベントループを塞がないようにし、受け付ける処理数を上限で制限する）
+executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="chatbot-worker")
+max_work_slots = WORKER_THREADS + MAX_PENDING_TASKS
+active_work = 0  # 実行中・待機中の処理数（イベントループのスレッドからのみ更新する）
+
+def _acquire_work_slot():
+    """処理枠を確保する（空きがなければ503を返す）"""
+    global active_work
+    if active_work >= max_work_slots:
+        raise HTTPException(status_code=503, detail="サーバーが混雑しています。しばらくしてから再度お試しください")
+    active_work += 1
+
+def _release_work_slot(*_):
+    """処理枠を解放する"""
+    global active_work
+    active_work -= 1
+
+async def run_blocking(func, *args, timeout=None, **kwargs):
+    """同期処理をワーカースレッドで実行する（時間切れの場合は504を返す）"""
+    _acquire_work_slot()
+    loop = asyncio.get_running_loop()
+    # 処理時間の内訳を記録できるように、リクエストのコンテキストをワーカースレッドに引き継ぐ
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
+    # タイムアウト後もスレッドは処理を続けるため、処理枠は完了時に解放する
+    future.add_done_callback(_release_work_slot)
+    
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="処理がタイムアウトしました")
+
+async def stream_blocking(iterator, timeout=None):
+    """同期イテレーターをワーカースレッドで1要素ずつ進める非同期ジェネレーター
+    
+    時間切れ・中断の場合も、ワーカースレッドで実行中の処理が終わってからイテレーターを閉じて処理枠を解放する
+    """
+    _acquire_work_slot()
+    loop = asyncio.get_running_loop()
+    finished = object()
+    context = contextvars.copy_context()
+    future = None
+    
+    def close(*_):
+        try:
+            if future is not None and not future.cancelled():
+                future.exception()  # 時間切れ後に発生した例外を取得済みにする
+            if hasattr(iterator, "close"):
+                iterator.close()
+        finally:
+            _release_work_slot()
+    
+    try:
+        while True:
+            future = loop.run_in_executor(executor, context.run, next, iterator, finished)
+            item = await asyncio.wait_for(asyncio.shield(future), timeout)
+            if item is finished:
+                break
+            yield item
+    finally:
+        # 実行中のnextがあれば、その完了を待ってから閉じる（実行中のジェネレーターは閉じられない）
+        if future is None or future.done():
+            close()
+        else:
+            future.add_done_callback(close)
+
+async def _first_or_none(tokens):
+    """非同期ジェネレーターの最初の要素を取得する（混雑・タイムアウトはレスポンス開始前にエラーにする）"""
+    try:
+        return await tokens.__anext__()
+    except StopAsyncIteration:
+        return None
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="処理がタイムアウトしました")
+
 # リクエストモデル
 class URLRequest(BaseModel):
     url: str
@@ -38,6 +200,14 @@ class URLRequest(BaseModel):
     max_depth: int = 2
     use_cache: bool = True
     force_refresh: bool = False
+    progressive: Optional[bool] = None  # 最初のページの取得後に応答し、残りはバックグラウンドで取り込む（未指定の場合はPROGRESSIVE_INIT）
+
+class CrawlRequest(BaseModel):
+    url: str
+    max_pages: int = 10
+    max_depth: int = 2
+    force_refresh: bool = False
+    mode: str = "links"  # links: リンクをたどる / sitemap: サイトマップのページを取り込む
 
 class QuestionRequest(BaseModel):
     question: str
@@ -47,6 +217,8 @@ class ChatResponse(BaseModel):
     answer: str
     pages_scraped: int = 0
     from_cache: bool = False
+    answer_cache: Optional[str] = None  # 回答キャッシュの状態（hit / miss / shared、使用しない場合はnull）
+    coverage: Optional[dict] = None  # 質問に使えるサイトの範囲（pages_scraped / max_pages / complete / ratio）
 
 class CacheStatsResponse(BaseModel):
     sites_count: int = 0
@@ -77,82 +249,137 @@ async def get_chat():
     return FileResponse("chat.html")
 
 @app.post("/initialize", response_model=ChatResponse)
-async def initialize_chatbot(request: URLRequest = Body(...)):
+async def initialize_chatbot(request: URLRequest = Body(...), chatbot: GeminiChatbot = Depends(get_chatbot)):
     """チャットボットを指定されたURLで初期化する"""
     if not request.url:
         raise HTTPException(status_code=400, detail="URLが指定されていません")
     
-    # キャッシュ強制更新の場合、古いデータを削除
+    # キャッシュ強制更新の場合、期限切れデータを削除した上でサイト単位のキャッシュを使わずに再クロールする
+    # （各ページはETag/Last-Modifiedで再検証されるため、変更のないページは再ダウンロードされない）
     if request.force_refresh and request.use_cache:
-        # 実際のDBマネージャーでは特定のURLのデータを削除するメソッドを実装する必要がある
-        # ここでは単純化のため、期限切れデータの削除を行う
-        db_manager.delete_expired_data()
+        await run_blocking(db_manager.delete_expired_data)
     
-    success, message = chatbot.initialize_with_url(
+    success, message = await run_blocking(
+        chatbot.initialize_with_url,
         request.url, 
         request.include_subpages, 
         request.max_pages, 
-        request.max_depth
+        request.max_depth,
+        force_refresh=request.force_refresh,
+        progressive=request.progressive,
+        timeout=INITIALIZE_TIMEOUT
     )
     
     if not success:
         raise HTTPException(status_code=500, detail=message)
     
     # 取得したページ数を取得
-    pages_scraped = len(chatbot.scraper.visited_urls) if request.include_subpages else 1
+    pages_scraped = chatbot.get_pages_count() if request.include_subpages else 1
     
     # キャッシュから読み込まれたかどうかを判定
     from_cache = "キャッシュから読み込み" in message
-        
-    return ChatResponse(answer=message, pages_scraped=pages_scraped, from_cache=from_cache)
+    
+    return ChatResponse(answer=message, pages_scraped=pages_scraped, from_cache=from_cache, coverage=chatbot.get_coverage())
 
 @app.post("/ask", response_model=ChatResponse)
-async def ask_question(request: QuestionRequest = Body(...)):
+async def ask_question(request: QuestionRequest = Body(...), chatbot: GeminiChatbot = Depends(get_chatbot)):
     """チャットボットに質問する"""
     if not request.question:
         raise HTTPException(status_code=400, detail="質問が指定されていません")
-        
-    answer = chatbot.ask(request.question)
+    
+    answer, answer_cache = await run_blocking(chatbot.ask_with_status, request.question, timeout=ASK_TIMEOUT)
     
     # 取得したページ数を取得
-    pages_scraped = len(chatbot.scraper.visited_urls) if hasattr(chatbot.scraper, 'visited_urls') else 0
+    pages_scraped = chatbot.get_pages_count()
+    
+    return ChatResponse(
+        answer=answer,
+        pages_scraped=pages_scraped,
+        answer_cache=answer_cache,
+        coverage=chatbot.get_coverage()
+    )
+
+@app.post("/ask/stream")
+async def ask_question_stream(
+    request: QuestionRequest = Body(...),
+    session_id: str = Depends(get_session_id),
+    chatbot: GeminiChatbot = Depends(get_chatbot)
+):
+    """チャットボットに質問し、回答をServer-Sent Eventsで逐次返す"""
+    if not request.question:
+        raise HTTPException(status_code=400, detail="質問が指定されていません")
+    
+    # 処理枠を確保できない場合はストリームを開始する前に503を返す
+    status = {}
+    tokens = stream_blocking(chatbot.ask_stream(request.question, status), timeout=ASK_TIMEOUT)
+    first_token = await _first_or_none(tokens)
+    
+    async def event_stream():
+        try:
+            if first_token is not None:
+                yield f"data: {json.dumps({'token': first_token}, ensure_ascii=False)}\n\n"
+            async for text in tokens:
+                yield f"data: {json.dumps({'token': text}, ensure_ascii=False)}\n\n"
+        except asyncio.TimeoutError:
+            yield f"event: error\ndata: {json.dumps({'detail': '処理がタイムアウトしました'}, ensure_ascii=False)}\n\n"
+            return
+        
+        pages_scraped = chatbot.get_pages_count()
+        done = {
+            'pages_scraped': pages_scraped,
+            'answer_cache': status.get('answer_cache'),
+            'coverage': chatbot.get_coverage()
+        }
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
     
-    return ChatResponse(answer=answer, pages_scraped=pages_scraped)
+    response = StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # StreamingResponseを直接返す場合は依存関数で設定したヘッダー・Cookieが反映されないため明示的に設定する
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", SESSION_HEADER: session_id}
+    )
+    response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite="lax")
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus形式のメトリクスを取得する"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/history")
-async def get_history():
+def get_history(chatbot: GeminiChatbot = Depends(get_chatbot)):
     """チャット履歴を取得する"""
     return chatbot.get_chat_history()
 
 @app.get("/cache/stats", response_model=CacheStatsResponse)
-async def get_cache_stats():
+def get_cache_stats():
     """キャッシュの統計情報を取得する"""
     stats = db_manager.get_database_stats()
     return CacheStatsResponse(**stats)
 
 @app.post("/cache/clear")
-async def clear_expired_cache():
+def clear_expired_cache():
     """期限切れのキャッシュを削除する"""
     deleted_count = db_manager.delete_expired_data()
     return {"deleted_count": deleted_count}
 
 @app.get("/cache/urls")
-async def get_cached_urls():
+def get_cached_urls():
     """キャッシュに保存されているURLの一覧を取得する"""
     urls = db_manager.get_all_urls()
     return {"urls": urls, "count": len(urls)}
 
 @app.get("/cache/sites", response_model=list[CachedSiteInfo])
-async def get_cached_sites():
+def get_cached_sites():
     """キャッシュに保存されているサイト情報の詳細一覧を取得する"""
     sites = db_manager.get_all_sites_info()
     return sites
 
 @app.post("/initialize/cached/{site_id}", response_model=ChatResponse)
-async def initialize_from_cached(site_id: int):
+async def initialize_from_cached(site_id: int, chatbot: GeminiChatbot = Depends(get_chatbot)):
     """キャッシュされたサイトIDを使用してチャットボットを初期化する"""
     # サイトIDからURLを取得
-    site_info = db_manager.get_site_info_by_id(site_id)
+    site_info = await run_blocking(db_manager.get_site_info_by_id, site_id)
     
     if not site_info:
         raise HTTPException(status_code=404, detail="指定されたIDのサイトが見つかりません")
@@ -160,13 +387,18 @@ async def initialize_from_cached(site_id: int):
     url = site_info["url"]
     
     # URLを使用してチャットボットを初期化
-    success, message = chatbot.initialize_with_url(url, include_subpages=True)
+    success, message = await run_blocking(
+        chatbot.initialize_with_url,
+        url,
+        include_subpages=True,
+        timeout=INITIALIZE_TIMEOUT
+    )
     
     if not success:
         raise HTTPException(status_code=500, detail=message)
     
     # 取得したページ数を取得
-    pages_scraped = len(chatbot.scraper.visited_urls)
+    pages_scraped = chatbot.get_pages_count()
     
     return ChatResponse(
         answer=f"キャッシュされたサイト「{site_info['title']}」を読み込みました",
@@ -174,6 +406,65 @@ async def initialize_from_cached(site_id: int):
         from_cache=True
     )
 
+@app.get("/sessions/stats")
+def get_sessions_stats():
+    """セッション数と共有サイトを含むメモリ使用量の見積もりを取得する"""
+    stats = sessions.stats()
+    stats["shared_sites_count"] = len(site_registry)
+    stats["shared_sites_memory_kb"] = site_registry.memory_usage() / 1024
+    stats["sites_loading"] = SITE_FLIGHTS.in_flight()
+    stats["answers_generating"] = ANSWER_FLIGHTS.in_flight()
+    return stats
+
+@app.post("/crawl")
+def start_crawl(request: CrawlRequest = Body(...)):
+    """バックグラウンドでのクロールを開始し、ジョブIDを返す"""
+    if not request.url:
+        raise HTTPException(status_code=400, detail="URLが指定されていません")
+    if request.mode not in CRAWL_MODES:
+        raise HTTPException(status_code=400, detail=f"modeには{', '.join(CRAWL_MODES)}のいずれかを指定してください")
+    
+    job = crawl_jobs.submit(
+        request.url,
+        max_pages=request.max_pages,
+        max_depth=request.max_depth,
+        force_refresh=request.force_refresh,
+        mode=request.mode
+    )
+    return job.to_dict()
+
+@app.get("/crawl")
+def list_crawl_jobs():
+    """クロールジョブの一覧と進捗を取得する"""
+    jobs = [job.to_dict() for job in crawl_jobs.list()]
+    return {"jobs": jobs, **crawl_jobs.stats()}
+
+@app.get("/crawl/{job_id}")
+def get_crawl_job(job_id: str):
+    """クロールジョブの進捗を取得する"""
+    job = crawl_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="指定されたジョブが見つかりません")
+    return job.to_dict()
+
+@app.post("/crawl/{job_id}/cancel")
+def cancel_crawl_job(job_id: str):
+    """クロールジョブを中断する"""
+    job = crawl_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="指定されたジョブが見つかりません")
+    return job.to_dict()
+
+@app.on_event("startup")
+def start_cache_sweeper():
+    cache_sweeper.start()
+
+@app.on_event("shutdown")
+def shutdown_background_work():
+    crawl_jobs.shutdown()
+    cache_sweeper.stop()
+    shutdown_parse_pool()
+
 # サーバー起動
 if __name__ == "__main__":
     uvicorn.run("app:app", host=API_HOST, port=API_PORT, reload=True) 
\ No newline at end of file
@@ -0,0 +1,192 @@
+import functools
+import hashlib
+import re
+
+from history import estimate_tokens
+
+# ページの内容をブロック（段落）に分ける区切り
+BLOCK_SEPARATOR = re.compile(r'\n{2,}')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# SimHashの計算に使う文字シングルの長さ
+SHINGLE_SIZE = 4
+SIMHASH_BITS = 64
+# 類似ブロックの判定を行うブロックの最小の長さ（短いブロックは完全一致のみで判定する）
+NEAR_DUPLICATE_MIN_CHARS = 80
+
+# 1バイトの各ビットを32ビットずつの区画に広げた値（SimHashのビットごとの集計を区画ごとの加算で行うため）
+_LANE_BITS = 32
+_LANE_MASK = (1 << _LANE_BITS) - 1
+_SPREAD_BYTE = [
+    sum(1 << (bit * _LANE_BITS) for bit in range(8) if value >> bit & 1)
+    for value in range(256)
+]
+
+
+def normalize_block(block):
+    """ブロックの比較に使う文字列（空白の違いを無視する）"""
+    return WHITESPACE_PATTERN.sub(" ", block).strip().lower()
+
+
+def _shingles(text):
+    if len(text) <= SHINGLE_SIZE:
+        return {text}
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+@functools.lru_cache(maxsize=65536)
+def _shingle_hash(shingle):
+    # 組み込みのhashはプロセスごとに値が変わる（PYTHONHASHSEED）ため、プロセスをまたいで同じ値になるハッシュを使う
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=SIMHASH_BITS // 8).digest(), 'big')
+
+
+def simhash(text):
+    """正規化したテキストの文字シングルから64ビットのSimHashを計算する（プロセスをまたいで同じ値になる）"""
+    hashes = {_shingle_hash(shingle) for shingle in _shingles(text)}
+    
+    # ハッシュの各バイトのビットを区画に広げて足し合わせ、ビットごとに1の数を数える
+    # （区画は32ビットのため、シングルの数が2**32未満なら桁あふれしない）
+    totals = [0] * (SIMHASH_BITS // 8)
+    for value in hashes:
+        for index in range(len(totals)):
+            totals[index] += _SPREAD_BYTE[(value >> (index * 8)) & 0xFF]
+    
+    threshold = len(hashes) / 2
+    fingerprint = 0
+    for index, total in enumerate(totals):
+        for bit in range(8):
+            if (total >> (bit * _LANE_BITS)) & _LANE_MASK > threshold:
+                fingerprint |= 1 << (index * 8 + bit)
+    return fingerprint
+
+
+class NearDuplicateIndex:
+    """SimHashのハミング距離がmax_distance以内のブロックを探すインデックス
+    
+    64ビットをmax_distance + 1個の帯に分け、いずれかの帯が一致するものだけを比較する
+    （距離がmax_distance以内なら、少なくとも1つの帯は完全に一致する）
+    """
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = -(-SIMHASH_BITS // self.bands)
+        self.buckets = [{} for _ in range(self.bands)]
+    
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(self.bands)]
+    
+    def contains(self, fingerprint):
+        for bucket, key in zip(self.buckets, self._band_keys(fingerprint)):
+            for candidate in bucket.get(key, ()):
+                if bin(candidate ^ fingerprint).count("1") <= self.max_distance:
+                    return True
+        return False
+    
+    def add(self, fingerprint):
+        for bucket, key in zip(self.buckets, self._band_keys(fingerprint)):
+            bucket.setdefault(key, []).append(fingerprint)
+
+
+class SiteAssembler:
+    """ページを優先度の順（先頭がメインページ）に受け取り、重複を除いてトークン数の予算に収まるように組み立てる
+    
+    - 先に受け取ったページに同じブロック（ヘッダー・ナビゲーションなど）があれば取り除く
+    - 長いブロックはSimHashのハミング距離がmax_distance以内のものも重複とみなす（負の値で無効）
+    - token_budgetを超えたページは、収まる範囲のブロックまでで打ち切る（0で無制限）
+    - 重複を除いて内容がなくなったページは含めない
+    
+    クロール中に取得したページを順に加えることもできる（段階的な初期化）
+    """
+    def __init__(self, token_budget=0, max_distance=3):
+        self.token_budget = token_budget
+        self.seen_blocks = set()
+        self.near_duplicates = NearDuplicateIndex(max_distance) if max_distance >= 0 else None
+        self.pages = []  # 組み立てたページ
+        self.pages_received = 0
+        self.tokens = 0
+        self.original_tokens = 0
+        self.removed_blocks = 0
+        self.budget_exceeded = False
+    
+    def add(self, pages):
+        """ページを加え、そのうち組み立てたページ（内容が残ったもの）を返す"""
+        added = []
+        for page in pages:
+            page = self._assemble_page(page)
+            if page is not None:
+                self.pages.append(page)
+                added.append(page)
+        return added
+    
+    def _assemble_page(self, page):
+        content = page.get("content") or ""
+        self.pages_received += 1
+        self.original_tokens += estimate_tokens(content)
+        if self.budget_exceeded:
+            return None
+        
+        blocks = []
+        page_tokens = 0
+        page_seen = set()
+        page_fingerprints = []
+        for block in BLOCK_SEPARATOR.split(content):
+            block = block.strip()
+            normalized = normalize_block(block)
+            if not normalized:
+                continue
+            if normalized in self.seen_blocks:
+                self.removed_blocks += 1
+                continue
+            
+            fingerprint = None
+            if self.near_duplicates is not None and len(normalized) >= NEAR_DUPLICATE_MIN_CHARS:
+                fingerprint = simhash(normalized)
+                if self.near_duplicates.contains(fingerprint):
+                    self.removed_blocks += 1
+                    continue
+            
+            tokens = estimate_tokens(block)
+            if self.token_budget and self.tokens + page_tokens + tokens > self.token_budget:
+                self.budget_exceeded = True
+                break
+            
+            blocks.append(block)
+            page_tokens += tokens
+            page_seen.add(normalized)
+            if fingerprint is not None:
+                page_fingerprints.append(fingerprint)
+        
+        # 重複の判定は後のページにのみ適用する（同じページ内の繰り返しは残す）
+        self.seen_blocks.update(page_seen)
+        for fingerprint in page_fingerprints:
+            self.near_duplicates.add(fingerprint)
+        
+        if not blocks:
+            return None
+        self.tokens += page_tokens
+        return dict(page, content="\n\n".join(blocks), tokens=page_tokens)
+    
+    def stats(self):
+        return {
+            "tokens": self.tokens,
+            "original_tokens": self.original_tokens,
+            "removed_blocks": self.removed_blocks,
+            "dropped_pages": self.pages_received - len(self.pages)
+        }
+
+
+def select_within_budget(chunks, token_budget=0):
+    """関連度の順に並んだチャンクを、合計のトークン数が予算に収まる範囲で先頭から選ぶ（最初のチャンクは常に含める）"""
+    if not token_budget:
+        return list(chunks)
+    
+    selected = []
+    total = 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk["text"])
+        if selected and total + tokens > token_budget:
+            break
+        selected.append(chunk)
+        total += tokens
+    return selected
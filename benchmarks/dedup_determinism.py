@@ -0,0 +1,95 @@
+"""重複の除去の結果が、プロセスのハッシュのシード（PYTHONHASHSEED）によらず同じになることを確認する
+
+同じ内容のサイト（類似した段落を含む）を、PYTHONHASHSEEDを変えた別々のプロセスで組み立て、
+取り除いたブロック数とサイトの内容のハッシュ（回答キャッシュのキー）を比較する。
+異なる結果になった場合は終了コード1を返す。
+
+使い方:
+    python benchmarks/dedup_determinism.py
+    python benchmarks/dedup_determinism.py --pages 100 --seeds 1 2 3 4 5
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+
+# リポジトリのルートからモジュールを読み込む
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from site_fixture import WORDS
+
+
+def make_pages(count, seed=0):
+    """共通のヘッダーと、少しずつ語を入れ替えた類似の段落を含むページを生成する"""
+    rng = random.Random(seed)
+    base_paragraphs = [
+        " ".join(rng.choice(WORDS) for _ in range(60))
+        for _ in range(20)
+    ]
+    
+    pages = []
+    for index in range(count):
+        paragraphs = ["ベンチマークサイト ホーム 料金 お問い合わせ"]
+        for paragraph in rng.sample(base_paragraphs, 5):
+            words = paragraph.split(" ")
+            for _ in range(rng.randint(0, 3)):
+                words[rng.randrange(len(words))] = rng.choice(WORDS)
+            paragraphs.append(" ".join(words))
+        paragraphs.append(f"ページ {index} の固有の内容")
+        pages.append({
+            "url": f"https://example.com/pages/{index}.html",
+            "title": f"ページ {index}",
+            "content": "\n\n".join(paragraphs),
+        })
+    return pages
+
+
+def assemble(pages_count, max_distance):
+    """このプロセスでページを組み立て、結果を返す"""
+    from assembler import SiteAssembler
+    from answer_cache import site_content_hash
+    
+    assembler = SiteAssembler(max_distance=max_distance)
+    pages = assembler.add(make_pages(pages_count))
+    return dict(assembler.stats(), content_hash=site_content_hash(pages))
+
+
+def run_with_seed(hash_seed, args):
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed))
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child",
+         "--pages", str(args.pages), "--max-distance", str(args.max_distance)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重複の除去の結果がハッシュのシードによらず同じになることを確認する")
+    parser.add_argument("--pages", type=int, default=50, help="組み立てるページ数")
+    parser.add_argument("--max-distance", type=int, default=3, help="類似ブロックとみなすSimHashのハミング距離")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1, 2, 3, 4, 5], help="比較するPYTHONHASHSEED")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.child:
+        print(json.dumps(assemble(args.pages, args.max_distance)))
+        return
+    
+    results = {seed: run_with_seed(seed, args) for seed in args.seeds}
+    for seed, result in results.items():
+        print(f"PYTHONHASHSEED={seed}: 取り除いたブロック {result['removed_blocks']}, "
+              f"トークン数 {result['tokens']}, ハッシュ {result['content_hash'][:16]}")
+    
+    if len({json.dumps(result, sort_keys=True) for result in results.values()}) > 1:
+        print("結果がハッシュのシードによって異なります")
+        sys.exit(1)
+    print("すべてのシードで同じ結果になりました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""HTMLからの本文抽出の速度と出力を、従来の抽出処理と比較するベンチマーク
+
+使い方:
+    python benchmarks/extraction.py --save https://example.com https://example.com/about
+    python benchmarks/extraction.py --corpus benchmarks/corpus --repeat 5 --json
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+from urllib.parse import urlparse
+
+# リポジトリのルートからモジュールを読み込む
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from extractor import extract_page_fast, extract_page_legacy, fast_extraction_available
+from retriever import tokenize
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+EXTRACTORS = {
+    "legacy": extract_page_legacy,
+    "fast": extract_page_fast,
+}
+
+
+def save_pages(urls, corpus_dir):
+    """URLのHTMLを取得してコーパスとして保存する"""
+    from scraper import WebScraper
+    
+    os.makedirs(corpus_dir, exist_ok=True)
+    scraper = WebScraper(use_cache=False)
+    for url in urls:
+        html_content = scraper.fetch_content(url)
+        if not html_content:
+            print(f"取得に失敗しました: {url}")
+            continue
+        parsed = urlparse(url)
+        name = re.sub(r'[^A-Za-z0-9_-]+', '_', f"{parsed.netloc}{parsed.path}").strip('_') or "index"
+        path = os.path.join(corpus_dir, f"{name}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(html_content)
+        print(f"保存しました: {url} -> {path}")
+
+
+def load_corpus(corpus_dir):
+    """コーパスのHTMLファイルを(ファイル名, HTML)のリストとして読み込む"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.htm*"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def duplicate_ratio(content):
+    """本文のうち、同じページ内で重複している段落の割合（文字数ベース）"""
+    paragraphs = [paragraph.strip() for paragraph in re.split(r'\n{2,}', content) if paragraph.strip()]
+    total = sum(len(paragraph) for paragraph in paragraphs)
+    seen = set()
+    duplicated = 0
+    for paragraph in paragraphs:
+        if paragraph in seen:
+            duplicated += len(paragraph)
+        seen.add(paragraph)
+    return duplicated / total if total else 0.0
+
+
+def token_coverage(reference, content):
+    """referenceに含まれるトークンの種類のうち、contentにも含まれる割合"""
+    reference_tokens = set(tokenize(reference))
+    if not reference_tokens:
+        return 1.0
+    return len(reference_tokens & set(tokenize(content))) / len(reference_tokens)
+
+
+def run_extractor(extract, pages, repeat):
+    """抽出処理をrepeat回繰り返して時間を計測し、最後の出力を返す"""
+    outputs = {}
+    elapsed = 0.0
+    for _ in range(repeat):
+        for name, html_content in pages:
+            started = time.perf_counter()
+            page = extract(html_content, f"https://benchmark.local/{name}")
+            elapsed += time.perf_counter() - started
+            outputs[name] = page
+    return elapsed, outputs
+
+
+def benchmark(pages, repeat):
+    total_bytes = sum(len(html_content.encode("utf-8")) for _, html_content in pages)
+    results = {}
+    outputs = {}
+    for extractor_name, extract in EXTRACTORS.items():
+        elapsed, outputs[extractor_name] = run_extractor(extract, pages, repeat)
+        contents = [page["content"] for page in outputs[extractor_name].values()]
+        results[extractor_name] = {
+            "pages_per_second": len(pages) * repeat / elapsed if elapsed else None,
+            "mb_per_second": total_bytes * repeat / elapsed / 1024 / 1024 if elapsed else None,
+            "ms_per_page": elapsed * 1000 / (len(pages) * repeat),
+            "avg_content_chars": sum(len(content) for content in contents) / len(contents),
+            "avg_duplicate_ratio": sum(duplicate_ratio(content) for content in contents) / len(contents),
+        }
+    
+    # 従来の出力に含まれる語のうち、新しい出力に残っている割合（取りこぼしの確認用）
+    coverage = {
+        name: token_coverage(outputs["legacy"][name]["content"], outputs["fast"][name]["content"])
+        for name, _ in pages
+    }
+    results["fast"]["legacy_token_coverage"] = sum(coverage.values()) / len(coverage)
+    results["fast"]["speedup"] = results["legacy"]["ms_per_page"] / results["fast"]["ms_per_page"]
+    
+    return {
+        "pages": len(pages),
+        "corpus_kb": total_bytes / 1024,
+        "repeat": repeat,
+        "extractors": results,
+        "per_page_legacy_token_coverage": coverage,
+    }
+
+
+def print_report(report):
+    print(f"コーパス: {report['pages']}ページ ({report['corpus_kb']:.1f} KB) x {report['repeat']}回")
+    for name, result in report["extractors"].items():
+        print(f"\n[{name}]")
+        print(f"  処理速度: {result['pages_per_second']:.1f} ページ/秒 ({result['mb_per_second']:.2f} MB/秒)")
+        print(f"  1ページあたり: {result['ms_per_page']:.2f} ms")
+        print(f"  本文の平均文字数: {result['avg_content_chars']:.0f}")
+        print(f"  重複段落の割合: {result['avg_duplicate_ratio'] * 100:.1f}%")
+        if "speedup" in result:
+            print(f"  従来比の速度: {result['speedup']:.1f}倍")
+            print(f"  従来の出力の語の網羅率: {result['legacy_token_coverage'] * 100:.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本文抽出のベンチマーク")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="HTMLファイルを置いたディレクトリ")
+    parser.add_argument("--save", nargs="+", metavar="URL", help="指定したURLのHTMLをコーパスに保存する")
+    parser.add_argument("--repeat", type=int, default=3, help="計測の繰り返し回数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    args = parser.parse_args()
+    
+    if args.save:
+        save_pages(args.save, args.corpus)
+    
+    if not fast_extraction_available():
+        print("lxmlがインストールされていないため比較できません")
+        return 1
+    
+    pages = load_corpus(args.corpus)
+    if not pages:
+        print(f"コーパスにHTMLファイルがありません: {args.corpus}")
+        return 1
+    
+    report = benchmark(pages, args.repeat)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""ベンチマーク用のモデルのスタブ（Gemini APIを呼び出さずに、指定した遅延と生成速度で回答を返す）
+
+GeminiChatbot(model=FakeModel(...)) のように渡して使用する。
+"""
+import threading
+import time
+
+from history import estimate_tokens
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamResponse:
+    """生成速度に合わせて回答を断片ごとに返すストリーミングの応答"""
+    def __init__(self, model, tokens):
+        self.model = model
+        self.tokens = tokens
+        self.text = ""
+    
+    def __iter__(self):
+        time.sleep(self.model.latency)
+        for start in range(0, len(self.tokens), self.model.chunk_tokens):
+            chunk = "".join(self.tokens[start:start + self.model.chunk_tokens])
+            time.sleep(self.model.generation_time(self.model.chunk_tokens))
+            self.text += chunk
+            yield FakeResponse(chunk)
+
+
+class FakeChat:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+    
+    def send_message(self, content, stream=False):
+        prompt_tokens = sum(
+            estimate_tokens(part) for message in self.history for part in message["parts"]
+        ) + estimate_tokens(content)
+        self.model.record_call(prompt_tokens)
+        
+        tokens = self.model.answer_tokens()
+        answer = "".join(tokens)
+        self.history.append({"role": "user", "parts": [content]})
+        self.history.append({"role": "model", "parts": [answer]})
+        
+        if stream:
+            return FakeStreamResponse(self.model, tokens)
+        time.sleep(self.model.latency + self.model.generation_time(len(tokens)))
+        return FakeResponse(answer)
+
+
+class FakeModel:
+    """最初のトークンまでの遅延（latency_ms）と生成速度（tokens_per_second）を指定できるモデルのスタブ
+    
+    呼び出し回数と送信されたプロンプトのおおよそのトークン数を記録する。
+    """
+    def __init__(self, latency_ms=500, tokens_per_second=50, answer_length=200, chunk_tokens=8):
+        self.latency = latency_ms / 1000
+        self.tokens_per_second = tokens_per_second
+        self.answer_length = answer_length
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.calls = 0
+        self.prompt_tokens = []
+        self.lock = threading.Lock()
+    
+    def start_chat(self, history=None):
+        return FakeChat(self, history)
+    
+    def generation_time(self, tokens):
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0
+    
+    def answer_tokens(self):
+        return [f"回答{i % 10} " for i in range(self.answer_length)]
+    
+    def record_call(self, prompt_tokens):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens.append(prompt_tokens)
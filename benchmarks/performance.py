@@ -0,0 +1,405 @@
+"""ローカルのサイトとモデルのスタブを使った性能ベンチマーク（インターネットとGemini APIを使用しない）
+
+計測する項目:
+    crawl  クロールの速度（ページ/秒）
+    parse  HTMLの解析時間（ミリ秒/ページ）
+    cache  キャッシュ（SQLite）の読み書きの時間
+    ask    /initialize と /ask の応答時間（p50 / p99）、/ask/stream の最初の断片までの時間と全体の時間
+    memory プロセスの最大メモリ使用量
+
+使い方:
+    python benchmarks/performance.py
+    python benchmarks/performance.py --pages 500 --latency-ms 20 --output bench.json
+    python benchmarks/performance.py --baseline bench.json --tolerance 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# リポジトリのルートからモジュールを読み込む
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+# 回答キャッシュを使うとモデルを呼び出さずに回答するため、明示的に有効にしない限り無効にして計測する
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+from site_fixture import SiteFixture, WORDS
+from fake_model import FakeModel
+from scraper import WebScraper, shutdown_parse_pool
+from db_manager import DBManager
+
+PHASES = ["crawl", "parse", "cache", "ask"]
+
+# 比較する指標と、値が大きいほど良いかどうか
+COMPARED_METRICS = {
+    ("crawl", "pages_per_second"): True,
+    ("parse", "ms_per_page"): False,
+    ("cache", "write_ms_per_page"): False,
+    ("cache", "read_ms_per_page"): False,
+    ("cache", "site_read_ms"): False,
+    ("ask", "initialize_ms"): False,
+    ("ask", "p50_ms"): False,
+    ("ask", "p99_ms"): False,
+    ("ask", "stream_first_chunk_p50_ms"): False,
+    ("ask", "stream_total_p50_ms"): False,
+    ("memory", "peak_mb"): False,
+}
+
+
+def percentile(values, p):
+    """最近傍順位法によるパーセンタイル"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_memory_mb():
+    """プロセスの最大常駐メモリ（MB、取得できない場合はNone）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # LinuxはKB、macOSはバイト単位
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def bench_crawl(fixture, args):
+    scraper = WebScraper(url=fixture.url, use_cache=False, host_delay=args.host_delay)
+    started = time.perf_counter()
+    result = scraper.scrape_with_subpages(fixture.url, max_pages=args.pages, max_depth=args.max_depth)
+    elapsed = time.perf_counter() - started
+    pages = len(result.get("pages") or []) if result else 0
+    return {
+        "pages": pages,
+        "seconds": elapsed,
+        "pages_per_second": pages / elapsed if elapsed else None,
+        "async": scraper.use_async,
+        "requests_served": fixture.requests_count,
+    }
+
+
+def bench_parse(fixture, args):
+    scraper = WebScraper(url=fixture.url, use_cache=False)
+    pages = [(url, fixture.render_page(i)) for i, url in enumerate(fixture.page_urls()[:args.parse_pages])]
+    # robots.txtの取得を計測に含めないように、先に一度解析する
+    scraper.process_page(pages[0][1], pages[0][0])
+    
+    elapsed = 0.0
+    for _ in range(args.repeat):
+        for url, html_content in pages:
+            started = time.perf_counter()
+            scraper.process_page(html_content, url)
+            elapsed += time.perf_counter() - started
+    
+    count = len(pages) * args.repeat
+    return {
+        "pages": len(pages),
+        "repeat": args.repeat,
+        "extractor": scraper.extractor,
+        "avg_html_kb": sum(len(html_content.encode("utf-8")) for _, html_content in pages) / len(pages) / 1024,
+        "ms_per_page": elapsed * 1000 / count,
+    }
+
+
+def bench_cache(fixture, args, workdir):
+    db_manager = DBManager(db_path=os.path.join(workdir, "cache_benchmark.db"))
+    scraper = WebScraper(url=fixture.url, use_cache=False)
+    pages = []
+    for i, url in enumerate(fixture.page_urls()[:args.parse_pages]):
+        page = scraper.process_page(fixture.render_page(i), url)
+        pages.append((url, page))
+    
+    started = time.perf_counter()
+    for url, page in pages:
+        db_manager.save_page(url, page["title"], page["content"], page["links"])
+    write_elapsed = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    for url, _ in pages:
+        db_manager.get_page(url)
+    read_elapsed = time.perf_counter() - started
+    
+    page_urls = [url for url, _ in pages]
+    started = time.perf_counter()
+    db_manager.save_scraped_data(fixture.url, "ベンチマークサイト", None, page_urls, page_urls=page_urls)
+    site_write_elapsed = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    db_manager.get_scraped_data(fixture.url)
+    site_read_elapsed = time.perf_counter() - started
+    db_manager.close()
+    
+    return {
+        "pages": len(pages),
+        "compression": db_manager.compression,
+        "write_ms_per_page": write_elapsed * 1000 / len(pages),
+        "read_ms_per_page": read_elapsed * 1000 / len(pages),
+        "site_write_ms": site_write_elapsed * 1000,
+        "site_read_ms": site_read_elapsed * 1000,
+    }
+
+
+def make_questions(count):
+    """回答キャッシュを有効にした場合にも一致しにくい、語の組み合わせが異なる質問を作る"""
+    questions = []
+    for i in range(count):
+        first = WORDS[i % len(WORDS)]
+        second = WORDS[(i * 7 + 3) % len(WORDS)]
+        questions.append(f"{first}と{second}の関係について教えてください（{i}）")
+    return questions
+
+
+class _LocalServer:
+    """アプリをuvicornでローカルに起動する
+    
+    TestClientはレスポンス全体を受け取ってから返すため、ストリーミングの最初の断片までの時間を計れない
+    """
+    def __init__(self, app):
+        import uvicorn
+        
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self.thread = None
+    
+    @property
+    def url(self):
+        host, port = self.socket.getsockname()
+        return f"http://{host}:{port}"
+    
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("ベンチマーク用のサーバーを起動できませんでした")
+            time.sleep(0.01)
+        return self
+    
+    def __exit__(self, *_):
+        self.server.should_exit = True
+        self.thread.join()
+        self.socket.close()
+
+
+def bench_ask(fixture, args):
+    import httpx
+    from chatbot import GeminiChatbot
+    import app as api
+    
+    model = FakeModel(
+        latency_ms=args.model_latency_ms,
+        tokens_per_second=args.model_tokens_per_second,
+        answer_length=args.answer_tokens
+    )
+    api.sessions.factory = lambda: GeminiChatbot(use_cache=True, site_registry=api.site_registry, model=model)
+    headers = {api.SESSION_HEADER: "benchmark"}
+    
+    with _LocalServer(api.app) as server, httpx.Client(base_url=server.url, timeout=None) as client:
+        started = time.perf_counter()
+        response = client.post("/initialize", headers=headers, json={
+            "url": fixture.url,
+            "max_pages": args.ask_site_pages,
+            "max_depth": args.max_depth,
+        })
+        initialize_elapsed = time.perf_counter() - started
+        response.raise_for_status()
+        
+        latencies = []
+        for question in make_questions(args.questions):
+            started = time.perf_counter()
+            client.post("/ask", headers=headers, json={"question": question}).raise_for_status()
+            latencies.append((time.perf_counter() - started) * 1000)
+        
+        first_chunks = []
+        stream_totals = []
+        for question in make_questions(args.stream_questions):
+            started = time.perf_counter()
+            with client.stream("POST", "/ask/stream", headers=headers, json={"question": question}) as stream:
+                stream.raise_for_status()
+                first = None
+                for _ in stream.iter_raw():
+                    if first is None:
+                        first = (time.perf_counter() - started) * 1000
+            first_chunks.append(first)
+            stream_totals.append((time.perf_counter() - started) * 1000)
+    
+    return {
+        "site_pages": response.json().get("pages_scraped"),
+        "initialize_ms": initialize_elapsed * 1000,
+        "questions": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None,
+        "stream_first_chunk_p50_ms": percentile(first_chunks, 50),
+        "stream_total_p50_ms": percentile(stream_totals, 50),
+        "model_calls": model.calls,
+        "avg_prompt_tokens": sum(model.prompt_tokens) / len(model.prompt_tokens) if model.prompt_tokens else None,
+        "max_prompt_tokens": max(model.prompt_tokens) if model.prompt_tokens else None,
+    }
+
+
+def run(args):
+    phases = args.only or PHASES
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "pages": args.pages,
+            "page_kb": args.page_kb,
+            "fan_out": args.fan_out,
+            "latency_ms": args.latency_ms,
+            "host_delay": args.host_delay,
+            "model_latency_ms": args.model_latency_ms,
+            "model_tokens_per_second": args.model_tokens_per_second,
+        },
+    }
+    
+    # キャッシュのデータベースは一時ディレクトリに作成する
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            with SiteFixture(
+                pages=args.pages,
+                page_kb=args.page_kb,
+                fan_out=args.fan_out,
+                latency_ms=args.latency_ms,
+                crawl_delay=args.crawl_delay,
+                disallow=args.disallow
+            ) as fixture:
+                if "crawl" in phases:
+                    report["crawl"] = bench_crawl(fixture, args)
+                if "parse" in phases:
+                    report["parse"] = bench_parse(fixture, args)
+                if "cache" in phases:
+                    report["cache"] = bench_cache(fixture, args, workdir)
+                if "ask" in phases:
+                    report["ask"] = bench_ask(fixture, args)
+        finally:
+            shutdown_parse_pool()
+            os.chdir(original_dir)
+    
+    report["memory"] = {"peak_mb": peak_memory_mb()}
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """基準の結果と比較し、tolerance（割合）を超えて悪化した指標のリストを返す"""
+    regressions = []
+    for (phase, metric), higher_is_better in COMPARED_METRICS.items():
+        current = (report.get(phase) or {}).get(metric)
+        previous = (baseline.get(phase) or {}).get(metric)
+        if not current or not previous:
+            continue
+        change = (previous - current) / previous if higher_is_better else (current - previous) / previous
+        if change > tolerance:
+            regressions.append({
+                "metric": f"{phase}.{metric}",
+                "baseline": previous,
+                "current": current,
+                "change": change,
+            })
+    return regressions
+
+
+def _format(value, unit=""):
+    return "-" if value is None else f"{value:.2f}{unit}"
+
+
+def print_report(report):
+    settings = report["settings"]
+    print(f"サイト: {settings['pages']}ページ ({settings['page_kb']} KB/ページ, リンク{settings['fan_out']}個/ページ, "
+          f"遅延{settings['latency_ms']} ms)")
+    if "crawl" in report:
+        crawl = report["crawl"]
+        print(f"\n[crawl] {crawl['pages']}ページ / {crawl['seconds']:.2f}秒")
+        print(f"  クロール速度: {_format(crawl['pages_per_second'], ' ページ/秒')}")
+    if "parse" in report:
+        parse = report["parse"]
+        print(f"\n[parse] {parse['pages']}ページ x {parse['repeat']}回 (平均 {parse['avg_html_kb']:.1f} KB, {parse['extractor']})")
+        print(f"  1ページあたり: {_format(parse['ms_per_page'], ' ms')}")
+    if "cache" in report:
+        cache = report["cache"]
+        print(f"\n[cache] {cache['pages']}ページ (圧縮: {cache['compression']})")
+        print(f"  書き込み: {_format(cache['write_ms_per_page'], ' ms/ページ')}")
+        print(f"  読み込み: {_format(cache['read_ms_per_page'], ' ms/ページ')}")
+        print(f"  サイトの保存/読み込み: {_format(cache['site_write_ms'], ' ms')} / {_format(cache['site_read_ms'], ' ms')}")
+    if "ask" in report:
+        ask = report["ask"]
+        print(f"\n[ask] {ask['questions']}問 (サイト {ask['site_pages']}ページ, モデル呼び出し {ask['model_calls']}回)")
+        print(f"  /initialize: {_format(ask['initialize_ms'], ' ms')}")
+        print(f"  /ask p50 / p99: {_format(ask['p50_ms'], ' ms')} / {_format(ask['p99_ms'], ' ms')}")
+        print(f"  /ask/stream 最初の断片 / 全体 p50: {_format(ask['stream_first_chunk_p50_ms'], ' ms')} / "
+              f"{_format(ask.get('stream_total_p50_ms'), ' ms')}")
+        print(f"  プロンプトの平均/最大トークン数: {_format(ask['avg_prompt_tokens'])} / {ask['max_prompt_tokens']}")
+    print(f"\n[memory] 最大メモリ使用量: {_format(report['memory']['peak_mb'], ' MB')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのサイトとモデルのスタブを使った性能ベンチマーク")
+    parser.add_argument("--only", nargs="+", choices=PHASES, help="計測する項目")
+    parser.add_argument("--pages", type=int, default=100, help="サイトのページ数（クロールするページ数）")
+    parser.add_argument("--page-kb", type=int, default=20, help="1ページの本文のおおよそのサイズ（KB）")
+    parser.add_argument("--fan-out", type=int, default=10, help="1ページあたりのリンク数")
+    parser.add_argument("--latency-ms", type=float, default=0, help="サイトの応答の遅延（ミリ秒）")
+    parser.add_argument("--crawl-delay", type=int, default=None, help="robots.txtのCrawl-delay（秒）")
+    parser.add_argument("--disallow", nargs="*", default=[], help="robots.txtで禁止するパスの接頭辞")
+    parser.add_argument("--max-depth", type=int, default=3, help="クロールする最大深さ")
+    parser.add_argument("--host-delay", type=float, default=None, help="同じホストへのリクエスト間隔（秒、省略時は設定値）")
+    parser.add_argument("--parse-pages", type=int, default=50, help="解析・キャッシュの計測に使うページ数")
+    parser.add_argument("--repeat", type=int, default=3, help="解析の計測の繰り返し回数")
+    parser.add_argument("--ask-site-pages", type=int, default=20, help="/initializeで読み込むページ数")
+    parser.add_argument("--questions", type=int, default=50, help="/askに送る質問数")
+    parser.add_argument("--stream-questions", type=int, default=10, help="/ask/streamに送る質問数")
+    parser.add_argument("--model-latency-ms", type=float, default=200, help="モデルの最初のトークンまでの遅延（ミリ秒）")
+    parser.add_argument("--model-tokens-per-second", type=float, default=200, help="モデルの生成速度（トークン/秒）")
+    parser.add_argument("--answer-tokens", type=int, default=50, help="モデルの回答のトークン数")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    parser.add_argument("--output", help="結果のJSONを保存するファイル")
+    parser.add_argument("--baseline", help="比較する基準の結果のJSONファイル")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="悪化とみなす基準からの変化の割合")
+    args = parser.parse_args()
+    
+    if args.host_delay is None:
+        from config import CRAWL_HOST_DELAY
+        args.host_delay = CRAWL_HOST_DELAY
+    
+    report = run(args)
+    
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        exit_code = 1 if report["regressions"] else 0
+    
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+        for regression in report.get("regressions", []):
+            print(f"悪化: {regression['metric']} {regression['baseline']:.2f} -> {regression['current']:.2f} "
+                  f"({regression['change'] * 100:+.1f}%)")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""ベンチマーク用のサイトをローカルのHTTPサーバーで配信するフィクスチャ
+
+ページ数・ページのサイズ・1ページあたりのリンク数・応答の遅延・robots.txtを指定して、
+決まった内容のサイトを生成する（同じ設定なら毎回同じ内容になる）。
+
+使い方:
+    python benchmarks/site_fixture.py --pages 200 --page-kb 20 --latency-ms 20
+"""
+import argparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = [
+    "ウェブサイト", "チャットボット", "サービス", "料金", "プラン", "お問い合わせ", "サポート",
+    "機能", "設定", "アカウント", "データ", "セキュリティ", "ドキュメント", "ガイド", "利用規約",
+    "product", "pricing", "support", "feature", "account", "document", "guide", "release",
+]
+
+
+class SiteFixture:
+    """生成したサイトを配信するローカルのHTTPサーバー
+    
+    /robots.txt、/sitemap.xml と /（トップページ）、/pages/<番号>.html を配信する。
+    各ページは fan_out 個のほかのページへのリンクと、page_kb キロバイト程度の本文を持つ。
+    disallow に指定したパスの接頭辞は robots.txt で禁止する。
+    """
+    def __init__(self, pages=100, page_kb=20, fan_out=10, latency_ms=0, crawl_delay=None, disallow=None,
+                 host="127.0.0.1", port=0, seed=0):
+        self.pages = pages
+        self.page_kb = page_kb
+        self.fan_out = fan_out
+        self.latency = latency_ms / 1000
+        self.crawl_delay = crawl_delay
+        self.disallow = list(disallow or [])
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.requests_count = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+        self._cache = {}
+    
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.server.server_address[1]}/"
+    
+    def page_path(self, index):
+        return "/" if index == 0 else f"/pages/{index}.html"
+    
+    def page_urls(self):
+        return [self.url.rstrip("/") + self.page_path(i) for i in range(self.pages)]
+    
+    def links(self, index):
+        """ページからリンクするページの番号（次のページと、サイト全体から選んだページ）"""
+        if self.pages <= 1:
+            return []
+        rng = random.Random(self.seed * 100003 + index + 1)
+        others = [i for i in range(self.pages) if i != index]
+        links = [(index + 1) % self.pages]
+        links += rng.sample(others, min(len(others), self.fan_out - 1)) if self.fan_out > 1 else []
+        return links
+    
+    def render_page(self, index):
+        """ページのHTMLを生成する"""
+        html_content = self._cache.get(index)
+        if html_content is not None:
+            return html_content
+        
+        rng = random.Random(self.seed * 100003 + index)
+        paragraphs = []
+        size = 0
+        while size < self.page_kb * 1024:
+            sentence = "".join(rng.choice(WORDS) + ("。" if rng.random() < 0.2 else " ") for _ in range(40))
+            paragraphs.append(f"<p>{sentence}</p>")
+            size += len(paragraphs[-1].encode("utf-8"))
+        
+        nav = "".join(f'<li><a href="{self.page_path(i)}">ページ{i}</a></li>' for i in range(min(self.pages, 5)))
+        links = "".join(f'<li><a href="{self.page_path(i)}">関連ページ{i}</a></li>' for i in self.links(index))
+        html_content = f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="utf-8">
+<title>ベンチマークページ {index}</title>
+<meta name="description" content="ベンチマーク用に生成したページ {index}">
+</head>
+<body>
+<header><h1>ベンチマークサイト</h1><nav><ul>{nav}</ul></nav></header>
+<main>
+<article>
+<h2>ページ {index}</h2>
+{"".join(paragraphs)}
+<ul>{links}</ul>
+</article>
+</main>
+<footer><p>Copyright Benchmark Site</p></footer>
+</body>
+</html>
+"""
+        self._cache[index] = html_content
+        return html_content
+    
+    def robots_txt(self):
+        lines = ["User-agent: *"]
+        lines += [f"Disallow: {path}" for path in self.disallow]
+        if self.crawl_delay:
+            lines.append(f"Crawl-delay: {self.crawl_delay}")
+        lines.append(f"Sitemap: {self.url}sitemap.xml")
+        return "\n".join(lines) + "\n"
+    
+    def sitemap_xml(self):
+        urls = "".join(f"<url><loc>{url}</loc></url>" for url in self.page_urls())
+        return f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+    
+    def resolve(self, path):
+        """パスに対する(ステータスコード, Content-Type, 本文)を返す"""
+        path = path.split("?", 1)[0].split("#", 1)[0]
+        if path == "/robots.txt":
+            return 200, "text/plain; charset=utf-8", self.robots_txt()
+        if path == "/sitemap.xml":
+            return 200, "application/xml; charset=utf-8", self.sitemap_xml()
+        if path == "/":
+            return 200, "text/html; charset=utf-8", self.render_page(0)
+        if path.startswith("/pages/") and path.endswith(".html"):
+            number = path[len("/pages/"):-len(".html")]
+            if number.isdigit() and 0 < int(number) < self.pages:
+                return 200, "text/html; charset=utf-8", self.render_page(int(number))
+        return 404, "text/plain; charset=utf-8", "Not Found"
+    
+    def start(self):
+        fixture = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            
+            def do_GET(self):
+                with fixture.lock:
+                    fixture.requests_count += 1
+                if fixture.latency:
+                    time.sleep(fixture.latency)
+                status, content_type, body = fixture.resolve(self.path)
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *_):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用のサイトを配信する")
+    parser.add_argument("--pages", type=int, default=100, help="ページ数")
+    parser.add_argument("--page-kb", type=int, default=20, help="1ページの本文のおおよそのサイズ（KB）")
+    parser.add_argument("--fan-out", type=int, default=10, help="1ページあたりのリンク数")
+    parser.add_argument("--latency-ms", type=float, default=0, help="応答の遅延（ミリ秒）")
+    parser.add_argument("--crawl-delay", type=int, default=None, help="robots.txtのCrawl-delay（秒）")
+    parser.add_argument("--disallow", nargs="*", default=[], help="robots.txtで禁止するパスの接頭辞")
+    parser.add_argument("--port", type=int, default=8000, help="待ち受けるポート")
+    args = parser.parse_args()
+    
+    fixture = SiteFixture(
+        pages=args.pages,
+        page_kb=args.page_kb,
+        fan_out=args.fan_out,
+        latency_ms=args.latency_ms,
+        crawl_delay=args.crawl_delay,
+        disallow=args.disallow,
+        port=args.port
+    ).start()
+    print(f"配信しています: {fixture.url} （終了するには Ctrl+C）")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fixture.stop()
+
+
+if __name__ == "__main__":
+    main()
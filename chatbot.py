@@ -1,118 +1,562 @@
 import google.generativeai as genai
-from config import GOOGLE_API_KEY, GEMINI_MODEL_NAME
+from config import (
+    GOOGLE_API_KEY,
+    GEMINI_MODEL_NAME,
+    RAG_TOP_K,
+    RAG_CHUNK_SIZE,
+    RAG_CHUNK_OVERLAP,
+    RAG_USE_EMBEDDINGS,
+    RAG_CONTEXT_TOKEN_BUDGET,
+    SITE_TOKEN_BUDGET,
+    SITE_DEDUP_DISTANCE,
+    PROGRESSIVE_INIT,
+    PROGRESSIVE_INIT_MIN_PAGES,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_SIMILARITY,
+)
 from scraper import WebScraper
+from retriever import Retriever, HashingEmbedder
+from assembler import SiteAssembler, select_within_budget
+from session_manager import SharedSite
+from answer_cache import AnswerCache, site_content_hash, normalize_question, question_key
+from history import ConversationHistory, estimate_tokens
+from singleflight import SingleFlight
+from url_filter import canonicalize_url
+from metrics import MODEL_SECONDS, MODEL_TOKENS, MODEL_PROMPT_TOKENS, CACHE_REQUESTS, record_timing
 import json
+import logging
+import threading
+import functools
+import time
+
+logger = logging.getLogger(__name__)
+
+# 会話の文脈でシステムプロンプトへの応答として扱う発言（初期化時にモデルを呼び出さずに会話の文脈に置く）
+PRIMING_ACKNOWLEDGEMENT = "承知しました。参考情報の内容に基づいて回答します。"
+
+# プロセス全体で、同じサイトの読み込みと同じ質問への回答の生成が同時に行われたときに1回にまとめる
+SITE_FLIGHTS = SingleFlight("site")
+ANSWER_FLIGHTS = SingleFlight("answer")
+
+
+def build_system_prompt(title, url, pages_count, loading=False):
+    """サイトの情報から会話の最初に置くシステムプロンプトを作成する（サイトの内容は質問ごとに関連する抜粋のみを送る）"""
+    loading_note = ""
+    if loading:
+        loading_note = "（サイトを読み込み中のため、参考情報はこれまでに取得したページから検索されます。" \
+                       "参考情報に見つからない情報は、まだ読み込まれていない可能性があることも伝えてください）\n"
+    return f"""
+あなたは次のウェブページの内容に基づいて質問に答えるアシスタントです。
+ウェブページのタイトル: {title}
+ウェブページのURL: {url}
+取得したページ数: {pages_count}
+{loading_note}
+質問ごとに、ウェブページから検索した関連する抜粋を「参考情報」として示します。
+参考情報の内容のみを使用して質問に答えてください。
+ウェブページに記載されていない情報については、「ウェブページにその情報は記載されていません」と答えてください。
+回答は簡潔かつ正確に行ってください。
+
+回答はマークダウン形式で提供してください。以下のマークダウン記法を活用してください：
+- 見出しには `#`, `##`, `###` などを使用
+- 箇条書きには `-` または `*` を使用
+- 強調には `**太字**` や `*斜体*` を使用
+- コードブロックには ``` で囲む
+- 表が必要な場合はマークダウンの表記法を使用
+- 引用には `>` を使用
+
+回答は構造化し、読みやすく整形してください。
+"""
+
+def _synchronized(method):
+    """インスタンスのロックを保持したままメソッドを実行するデコレーター"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class GeminiChatbot:
-    def __init__(self, use_cache=True, cache_expire_days=7):
-        # Google Gemini APIの初期化
-        genai.configure(api_key=GOOGLE_API_KEY)
-        
-        # モデルの設定
-        self.model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+    def __init__(self, use_cache=True, cache_expire_days=7, site_registry=None, model=None):
+        # モデルの設定（modelを渡した場合はGemini APIの代わりに使用する。start_chatを持つオブジェクト）
+        if model is None:
+            # Google Gemini APIの初期化
+            genai.configure(api_key=GOOGLE_API_KEY)
+            model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        self.model = model
         
         # スクレイパーの初期化（キャッシュ設定を渡す）
         self.scraper = WebScraper(use_cache=use_cache, cache_expire_days=cache_expire_days)
         
-        # 会話履歴
-        self.chat_history = []
+        # 会話履歴（直近のやり取りと古いやり取りの要約を持ち、セッションごとに上限がある）
+        self.conversation = ConversationHistory()
         
         # チャットインスタンス
         self.chat = None
         
+        # 質問ごとに関連するチャンクを検索するためのインデックス
+        self.retriever = None
+        self.top_k = RAG_TOP_K
+        
+        # 読み込み済みのサイト情報（site_registryを指定した場合は他のセッションと共有される）
+        self.site = None
+        self.site_registry = site_registry
+        
         # キャッシュ設定
         self.use_cache = use_cache
         self.cache_expire_days = cache_expire_days
         
-    def initialize_with_url(self, url, include_subpages=True, max_pages=10, max_depth=2):
-        """指定したURLでスクレイパーを初期化する"""
+        # 同じサイトの内容に対する同じ質問（と類似の質問）の回答を再利用するキャッシュ
+        self.answer_cache = None
+        if use_cache and ANSWER_CACHE_ENABLED and self.scraper.db_manager:
+            self.answer_cache = AnswerCache(
+                self.scraper.db_manager,
+                ttl=ANSWER_CACHE_TTL,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                similarity_threshold=ANSWER_CACHE_SIMILARITY
+            )
+        
+        # ワーカースレッドから同時に呼ばれても会話の状態が混ざらないようにするロック
+        # （ask_streamは回答の断片を返している間は保持しない）
+        self.lock = threading.Lock()
+        
+    @_synchronized
+    def initialize_with_url(self, url, include_subpages=True, max_pages=10, max_depth=2, force_refresh=False,
+                            progressive=None):
+        """指定したURLでスクレイパーを初期化する
+        
+        progressive=Trueの場合は最初のページを取り込んだ時点で質問できるようにし、
+        残りのページはバックグラウンドでクロールして取り込む（Noneの場合はPROGRESSIVE_INITに従う）
+        """
+        if progressive is None:
+            progressive = PROGRESSIVE_INIT
+        progressive = progressive and include_subpages
+        
         try:
-            # スクレイパーの初期化
-            self.scraper = WebScraper(url=url, use_cache=self.use_cache, cache_expire_days=7, respect_robots_txt=True)
-            
             # URLが有効かどうかを確認
             if not url.startswith(('http://', 'https://')):
                 return False, "エラー: 有効なURLを入力してください（http://またはhttps://で始まるURL）"
             
-            # ウェブサイトからコンテンツを取得
-            print(f"ウェブサイト {url} からコンテンツを取得しています...")
+            # 他のセッションで読み込み済みのサイトがあれば、スクレイピングせずに共有する
+            site_key = (canonicalize_url(url), include_subpages)
+            site = self._get_registered_site(site_key) if not force_refresh else None
+            if site:
+                logger.info("読み込み済みのサイト情報を共有します: %s", url)
             
-            if include_subpages:
-                # サブページも含めて取得
-                print(f"サブページも含めてスクレイピングします（最大{max_pages}ページ、深さ{max_depth}まで）...")
-                scraped_data = self.scraper.scrape_with_subpages(url, max_pages=max_pages, max_depth=max_depth)
-                pages_count = len(self.scraper.visited_urls)
-                print(f"合計 {pages_count} ページの情報を取得しました。")
-            else:
-                # メインページのみ取得
-                scraped_data = self.scraper.scrape(url)
-                pages_count = 1
+            if site is None:
+                # 同じサイトを同じ条件で読み込み中のリクエストがあれば、その結果を待って共有する
+                flight_key = (site_key, max_pages, max_depth, force_refresh)
+                site, shared = SITE_FLIGHTS.do(
+                    flight_key,
+                    lambda: self._load_and_register_site(
+                        site_key, url, include_subpages, max_pages, max_depth, force_refresh, progressive
+                    )
+                )
+                if site is None:
+                    return False, "ウェブサイトからの情報取得に失敗しました。"
+                if shared:
+                    logger.info("同時に読み込まれたサイト情報を共有します: %s", url)
             
-            if not scraped_data:
-                return False, "ウェブサイトからの情報取得に失敗しました。"
+            # 段階的な初期化を指定していない場合は、読み込み中のサイトの完了を待つ
+            if not progressive:
+                site.completed.wait()
             
-            # システムプロンプトを作成
-            system_prompt = f"""
-あなたは次のウェブページの内容に基づいて質問に答えるアシスタントです。
-ウェブページのタイトル: {scraped_data['title']}
-ウェブページのURL: {scraped_data['url']}
-取得したページ数: {pages_count}
-
-ウェブページの内容を以下に示します:
-{scraped_data['content']}
-
-このウェブページの情報のみを使用して質問に答えてください。
-ウェブページに記載されていない情報については、「ウェブページにその情報は記載されていません」と答えてください。
-回答は簡潔かつ正確に行ってください。
-
-回答はマークダウン形式で提供してください。以下のマークダウン記法を活用してください：
-- 見出しには `#`, `##`, `###` などを使用
-- 箇条書きには `-` または `*` を使用
-- 強調には `**太字**` や `*斜体*` を使用
-- コードブロックには ``` で囲む
-- 表が必要な場合はマークダウンの表記法を使用
-- 引用には `>` を使用
-
-回答は構造化し、読みやすく整形してください。
-"""
+            self.site = site
+            self.retriever = site.retriever
             
             # 会話を初期化
-            self.chat = self.model.start_chat(history=[])
-            
-            # システムプロンプトを送信
-            print("チャットボットを初期化しています...")
-            self.chat.send_message(system_prompt)
+            # システムプロンプトは個別に送信せず、会話の文脈として最初の質問と一緒に送る
+            # （初期化時のモデルの呼び出しを省き、読み込み済みのサイトではすぐに質問できるようにする）
+            logger.info("チャットボットを初期化しています: %s", url)
+            self.conversation.clear()
+            self.chat = self.model.start_chat(history=self._context_history())
             
-            # 会話履歴をクリア
-            self.chat_history = []
+            if not site.complete:
+                return True, (
+                    f"{site.pages_count}ページの情報を取得しました（読み込み中: 最大{site.max_pages}ページまで"
+                    "バックグラウンドで取得しています）。チャットボットの準備ができました。"
+                )
             
             # キャッシュ情報を表示
-            cache_status = "キャッシュから読み込み" if self.use_cache and any(url in str(self.scraper.visited_urls) for url in self.scraper.visited_urls) else "新規取得"
+            cache_status = "キャッシュから読み込み" if self.use_cache and site.from_cache else "新規取得"
             
-            return True, f"{pages_count}ページの情報を取得しました（{cache_status}）。チャットボットの準備ができました。"
+            return True, f"{site.pages_count}ページの情報を取得しました（{cache_status}）。チャットボットの準備ができました。"
         except Exception as e:
             return False, f"エラーが発生しました: {str(e)}"
     
+    def _get_registered_site(self, site_key):
+        return self.site_registry.get(site_key) if self.site_registry is not None else None
+    
+    def _load_and_register_site(self, site_key, url, include_subpages, max_pages, max_depth, force_refresh,
+                                progressive=False):
+        """サイトを読み込み、他のセッションと共有できるように登録する（段階的な初期化では読み込み中のまま登録する）"""
+        # 直前に他のリクエストが読み込みを終えていれば、それを使う
+        site = self._get_registered_site(site_key) if not force_refresh else None
+        if site is not None:
+            return site
+        
+        if progressive:
+            site = self._load_site_progressive(url, max_pages, max_depth, force_refresh)
+        else:
+            site = self._load_site(url, include_subpages, max_pages, max_depth, force_refresh)
+        if site is not None and self.site_registry is not None:
+            self.site_registry.put(site_key, site)
+        return site
+    
+    def _context_history(self):
+        """システムプロンプトを送信済みの状態の会話の文脈を作成する（古いやり取りは要約として含める）"""
+        return self.conversation.contents(self.site.system_prompt, PRIMING_ACKNOWLEDGEMENT)
+    
+    def _prepare_chat(self, prompt):
+        """送信するプロンプトを加えてもトークン数の予算に収まるように会話の文脈を整える（おおよそのトークン数を返す）"""
+        tokens = self.conversation.fit(self.site.system_prompt, PRIMING_ACKNOWLEDGEMENT, prompt)
+        self.chat.history = self._context_history()
+        return tokens
+    
+    def _observe_model_call(self, mode, elapsed, prompt_tokens, answer):
+        """モデルの呼び出しにかかった時間とトークン数を記録する"""
+        MODEL_SECONDS.observe(elapsed, mode=mode)
+        record_timing("model", elapsed)
+        MODEL_PROMPT_TOKENS.observe(prompt_tokens)
+        MODEL_TOKENS.inc(prompt_tokens, kind="prompt")
+        MODEL_TOKENS.inc(estimate_tokens(answer), kind="completion")
+    
+    def _load_site(self, url, include_subpages, max_pages, max_depth, force_refresh):
+        """ウェブサイトをスクレイピングし、検索インデックスとシステムプロンプトを準備する"""
+        # スクレイパーの初期化
+        self.scraper = WebScraper(url=url, use_cache=self.use_cache, cache_expire_days=7, respect_robots_txt=True)
+        
+        # ウェブサイトからコンテンツを取得
+        logger.info("ウェブサイト %s からコンテンツを取得しています", url)
+        
+        if include_subpages:
+            # サブページも含めて取得
+            logger.info("サブページも含めてスクレイピングします（最大%dページ、深さ%dまで）", max_pages, max_depth)
+            scraped_data = self.scraper.scrape_with_subpages(
+                url,
+                max_pages=max_pages,
+                max_depth=max_depth,
+                force_refresh=force_refresh
+            )
+            pages_count = len(self.scraper.visited_urls)
+            logger.info("合計 %d ページの情報を取得しました", pages_count)
+        else:
+            # メインページのみ取得
+            scraped_data = self.scraper.scrape(url)
+            pages_count = 1
+        
+        if not scraped_data:
+            return None
+        
+        return self._build_site(scraped_data, pages_count, self.scraper.from_cache)
+    
+    def _build_site(self, scraped_data, pages_count, from_cache):
+        """取得したサイトのデータから共有するサイト情報を作成する"""
+        # ページ間で重複するブロック（ヘッダー・ナビゲーションなど）を除き、優先度の順にトークン数の予算に収める
+        assembler = SiteAssembler(token_budget=SITE_TOKEN_BUDGET, max_distance=SITE_DEDUP_DISTANCE)
+        pages = assembler.add(scraped_data.get('pages') or [scraped_data])
+        self._log_assembly(assembler)
+        
+        return SharedSite(
+            url=scraped_data['url'],
+            title=scraped_data['title'],
+            pages_count=pages_count,
+            retriever=self._create_retriever(pages),
+            system_prompt=build_system_prompt(scraped_data['title'], scraped_data['url'], pages_count),
+            from_cache=from_cache,
+            content_hash=site_content_hash(pages)
+        )
+    
+    def _load_site_progressive(self, url, max_pages, max_depth, force_refresh):
+        """最初のページを取り込んだ時点でサイト情報を返し、残りのページはバックグラウンドで取り込む
+        
+        取り込んだページ数がPROGRESSIVE_INIT_MIN_PAGESに達するか、クロールが終わるまで待つ
+        """
+        scraper = WebScraper(url=url, use_cache=self.use_cache, cache_expire_days=7, respect_robots_txt=True)
+        self.scraper = scraper
+        assembler = SiteAssembler(token_budget=SITE_TOKEN_BUDGET, max_distance=SITE_DEDUP_DISTANCE)
+        state = {"site": None, "pages_fetched": 0}
+        ready = threading.Event()
+        
+        def on_page(page):
+            pages = assembler.add([page])
+            state["pages_fetched"] += 1
+            site = state["site"]
+            if site is None:
+                # 最初に渡されるのはメインページ
+                state["site"] = SharedSite(
+                    url=page['url'],
+                    title=page['title'],
+                    pages_count=1,
+                    retriever=self._create_retriever(pages),
+                    system_prompt=build_system_prompt(page['title'], page['url'], 1, loading=True),
+                    complete=False,
+                    max_pages=max_pages
+                )
+            elif pages:
+                site.add_pages(pages, state["pages_fetched"])
+            else:
+                site.pages_count = state["pages_fetched"]
+            if state["pages_fetched"] >= PROGRESSIVE_INIT_MIN_PAGES:
+                ready.set()
+        
+        def crawl():
+            try:
+                scraped_data = scraper.scrape_with_subpages(
+                    url,
+                    max_pages=max_pages,
+                    max_depth=max_depth,
+                    force_refresh=force_refresh,
+                    on_page=on_page
+                )
+                site = state["site"]
+                if site is None:
+                    # キャッシュから読み込んだ場合はページごとに渡されないため、まとめて作成する
+                    if scraped_data:
+                        state["site"] = self._build_site(scraped_data, len(scraper.visited_urls), scraper.from_cache)
+                    return
+                
+                if not scraped_data:
+                    self._log_assembly(assembler)
+                    pages_count = state["pages_fetched"]
+                    site.finish(pages_count, build_system_prompt(site.title, site.url, pages_count), None)
+                    return
+                
+                # ページを取得した順（重複の判定の順）は実行ごとに異なるため、クロールの順に組み立て直す
+                # （段階的でない読み込みと同じ内容・ハッシュになり、回答キャッシュを共有できる）
+                pages_count = len(scraper.visited_urls)
+                final = SiteAssembler(token_budget=SITE_TOKEN_BUDGET, max_distance=SITE_DEDUP_DISTANCE)
+                pages = final.add(scraped_data.get('pages') or [scraped_data])
+                self._log_assembly(final)
+                logger.info("バックグラウンドでのクロールが完了しました: %s (%dページ)", url, pages_count)
+                site.finish(
+                    pages_count,
+                    build_system_prompt(site.title, site.url, pages_count),
+                    site_content_hash(pages),
+                    retriever=self._create_retriever(pages)
+                )
+            except Exception:
+                logger.exception("バックグラウンドでのクロールに失敗しました: %s", url)
+                if state["site"] is not None and not state["site"].complete:
+                    site = state["site"]
+                    site.finish(site.pages_count, build_system_prompt(site.title, site.url, site.pages_count), None)
+            finally:
+                ready.set()
+        
+        logger.info("ウェブサイト %s を段階的に読み込みます（最大%dページ、深さ%dまで）", url, max_pages, max_depth)
+        threading.Thread(target=crawl, name="progressive-crawl", daemon=True).start()
+        ready.wait()
+        return state["site"]
+    
+    def _create_retriever(self, pages):
+        """ページをチャンクに分割して検索用のインデックスを作成する"""
+        retriever = Retriever(
+            chunk_size=RAG_CHUNK_SIZE,
+            chunk_overlap=RAG_CHUNK_OVERLAP,
+            embedder=HashingEmbedder() if RAG_USE_EMBEDDINGS else None
+        ).build(pages)
+        logger.info("%d個のチャンクから検索インデックスを作成しました", len(retriever.chunks))
+        return retriever
+    
+    def _log_assembly(self, assembler):
+        stats = assembler.stats()
+        logger.info(
+            "サイトの内容を組み立てました: %dトークン -> %dトークン（重複ブロック%d個、除外したページ%d件）",
+            stats["original_tokens"], stats["tokens"], stats["removed_blocks"], stats["dropped_pages"]
+        )
+    
     def ask(self, question):
         """質問を受け取り、回答を返す"""
+        return self.ask_with_status(question)[0]
+    
+    @_synchronized
+    def ask_with_status(self, question):
+        """質問を受け取り、(回答, 回答キャッシュの状態)を返す
+        
+        回答キャッシュの状態は "hit" / "miss" / "shared"（同時に送られた同じ質問の回答を共有した場合）
+        （回答キャッシュを使用しない場合はNone）
+        """
         if not self.chat:
-            return "チャットボットがまだ初期化されていません。URLを指定してください。"
+            return "チャットボットがまだ初期化されていません。URLを指定してください。", None
             
         try:
-            # 質問を送信して回答を取得
-            response = self.chat.send_message(question)
+            # 同じサイトの内容に対する回答がキャッシュにあれば、モデルを呼び出さずに返す
+            cached_answer = self._get_cached_answer(question)
+            if cached_answer is not None:
+                self._record_turn(question, cached_answer)
+                return cached_answer, "hit"
+            
+            # 他のセッションが同じ質問の回答を生成中であれば、その回答を待って共有する
+            flight_key = self._answer_flight_key(question)
+            if flight_key is None:
+                answer, shared = self._generate_answer(question), False
+            else:
+                answer, shared = ANSWER_FLIGHTS.do(flight_key, lambda: self._generate_answer(question))
             
-            # 会話履歴に追加
-            self.chat_history.append({"role": "user", "content": question})
-            self.chat_history.append({"role": "assistant", "content": response.text})
+            self._record_turn(question, answer)
             
-            return response.text
+            return answer, self._answer_cache_status("shared" if shared else "miss")
         except Exception as e:
-            return f"エラーが発生しました: {str(e)}"
+            return f"エラーが発生しました: {str(e)}", self._answer_cache_status("miss")
+    
+    def _generate_answer(self, question):
+        """関連するチャンクを添えて質問を送信し、回答を取得して回答キャッシュに保存する"""
+        prompt = self._build_prompt(question)
+        prompt_tokens = self._prepare_chat(prompt)
+        started = time.perf_counter()
+        response = self.chat.send_message(prompt)
+        self._observe_model_call("sync", time.perf_counter() - started, prompt_tokens, response.text)
+        
+        self._save_answer(question, response.text)
+        return response.text
+    
+    def ask_stream(self, question, status=None):
+        """質問を受け取り、生成された回答を断片ごとに返すジェネレーター
+        
+        statusに辞書を渡した場合は、回答キャッシュの状態を "answer_cache" に設定する
+        （他のセッションが同じ質問の回答を生成中の場合は、その完了を待って回答全体を一度に返す）
+        会話の文脈の準備と記録のときだけロックを保持し、回答を返している間は保持しない
+        """
+        if status is None:
+            status = {}
+        status["answer_cache"] = self._answer_cache_status("miss")
+        
+        if not self.chat:
+            yield "チャットボットがまだ初期化されていません。URLを指定してください。"
+            return
+            
+        try:
+            call = None
+            flight_key = None
+            with self.lock:
+                answer = self._get_cached_answer(question)
+                if answer is not None:
+                    self._record_turn(question, answer)
+                    status["answer_cache"] = "hit"
+                else:
+                    flight_key = self._answer_flight_key(question)
+                    if flight_key:
+                        call, answer = ANSWER_FLIGHTS.join(flight_key)
+                        if call is None:
+                            self._record_turn(question, answer)
+                            status["answer_cache"] = "shared"
+                
+                generate = answer is None
+                if generate:
+                    # 送信する会話の文脈をこの時点の状態で作成する（ストリーミング中に会話が更新されても影響しない）
+                    try:
+                        prompt = self._build_prompt(question)
+                        prompt_tokens = self._prepare_chat(prompt)
+                        chat = self.model.start_chat(history=self._context_history())
+                        content_hash = self.site.content_hash if self._can_reuse_answer() else None
+                    except BaseException as e:
+                        if call is not None:
+                            ANSWER_FLIGHTS.finish(flight_key, call, error=e)
+                        raise
+            
+            if not generate:
+                yield answer
+                return
+            
+            answer = ""
+            error = None
+            try:
+                # ストリーミングで送信し、モデルが生成したそばから返す
+                started = time.perf_counter()
+                response = chat.send_message(prompt, stream=True)
+                
+                for chunk in response:
+                    text = chunk.text
+                    if text:
+                        answer += text
+                        yield text
+                
+                # 断片を返している間の待ち時間も含む
+                self._observe_model_call("stream", time.perf_counter() - started, prompt_tokens, answer)
+                if content_hash:
+                    self.answer_cache.put(content_hash, question, answer)
+                with self.lock:
+                    self._record_turn(question, answer)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                if call is not None:
+                    ANSWER_FLIGHTS.finish(flight_key, call, answer, error)
+        except Exception as e:
+            yield f"エラーが発生しました: {str(e)}"
+    
+    def _answer_cache_status(self, status):
+        return status if self.answer_cache and self.site and self.site.content_hash else None
+    
+    def _can_reuse_answer(self):
+        """回答キャッシュを使用できるかどうか
+        
+        回答は会話の文脈に依存するため、前のやり取りがない（会話の最初の）質問の回答のみを読み書きする
+        """
+        return bool(self._answer_cache_status("miss")) and self.conversation.is_empty()
+    
+    def _get_cached_answer(self, question):
+        """読み込み済みのサイトの内容に対するキャッシュされた回答を取得する"""
+        if not self._can_reuse_answer():
+            return None
+        answer = self.answer_cache.get(self.site.content_hash, question)
+        CACHE_REQUESTS.inc(cache="answer", result="miss" if answer is None else "hit")
+        return answer
+    
+    def _answer_flight_key(self, question):
+        """同時に送られた同じ質問をまとめるキー（回答キャッシュを使用しない場合はNone）
+        
+        共有する回答は最初のセッションの会話の文脈で生成されるため、前のやり取りがない質問のみをまとめる
+        """
+        if not self._can_reuse_answer():
+            return None
+        normalized = normalize_question(question)
+        return (self.site.content_hash, question_key(normalized)) if normalized else None
+    
+    def _save_answer(self, question, answer):
+        """回答をキャッシュに保存する（会話の文脈に記録する前に呼び出すこと）"""
+        if self._can_reuse_answer():
+            self.answer_cache.put(self.site.content_hash, question, answer)
+    
+    def _record_turn(self, question, answer):
+        """回答した質問を会話の文脈と会話履歴に記録する（キャッシュから返した回答も同じように記録する）"""
+        self.conversation.add(question, answer)
+        
+        # 会話の文脈には抜粋を残さず質問だけを残す（送信するプロンプトのサイズを一定に保つ）
+        self.chat.history = self._context_history()
+    
+    def _build_prompt(self, question):
+        """質問に関連するチャンクを検索し、参考情報付きのプロンプトを作成する"""
+        started = time.perf_counter()
+        chunks = self.site.search(question, self.top_k) if self.site else []
+        chunks = select_within_budget(chunks, RAG_CONTEXT_TOKEN_BUDGET)
+        record_timing("retrieve", time.perf_counter() - started)
+        if not chunks:
+            return question
+        
+        context = "\n\n".join(
+            f"[{i}] {chunk['title']} ({chunk['url']})\n{chunk['text']}"
+            for i, chunk in enumerate(chunks, 1)
+        )
+        return f"参考情報:\n{context}\n\n質問: {question}"
     
     def get_chat_history(self):
-        """会話履歴を取得する"""
-        return self.chat_history
+        """会話履歴を取得する（直近のHISTORY_MAX_STORED_TURNS回のやり取り）"""
+        return self.conversation.get_messages()
+    
+    def get_pages_count(self):
+        """読み込み済みのサイトのページ数を取得する"""
+        return self.site.pages_count if self.site else 0
+    
+    def get_coverage(self):
+        """質問に使えるサイトの範囲を取得する（読み込み中のサイトではクロールの進捗に応じて増える）"""
+        return self.site.coverage() if self.site else None
+    
+    def estimate_memory(self):
+        """このチャットボット固有のおおよそのメモリ使用量（バイト）を見積もる（共有サイトは含まない）"""
+        return self.conversation.estimate_bytes()
         
     def get_cache_stats(self):
         """キャッシュの統計情報を取得する"""
@@ -131,9 +575,11 @@ class GeminiChatbot:
 if __name__ == "__main__":
     import os
     from dotenv import load_dotenv
+    from logging_setup import setup_logging
     
     # .envファイルから環境変数を読み込む
     load_dotenv()
+    setup_logging()
     
     # キャッシュを使用するかどうか
     print("キャッシュを使用しますか？ (y/n): ")
@@ -15,4 +15,87 @@ API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8000"))
 
 # モデル設定
-GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-pro") 
\ No newline at end of file
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-pro") 
+# クロール設定
+CRAWL_ASYNC = os.getenv("CRAWL_ASYNC", "true").lower() == "true"
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "10"))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv("CRAWL_PER_HOST_CONCURRENCY", "4"))
+CRAWL_HOST_DELAY = float(os.getenv("CRAWL_HOST_DELAY", "0.1"))
+HTML_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "fast").lower()
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", str(os.cpu_count() or 1)))
+PARSE_POOL_MIN_PAGES = int(os.getenv("PARSE_POOL_MIN_PAGES", "20"))
+# クロール対象とするURLのパスのglobパターン（カンマ区切り、例: /docs/*）
+CRAWL_INCLUDE_PATTERNS = [p.strip() for p in os.getenv("CRAWL_INCLUDE_PATTERNS", "").split(",") if p.strip()]
+CRAWL_EXCLUDE_PATTERNS = [p.strip() for p in os.getenv("CRAWL_EXCLUDE_PATTERNS", "").split(",") if p.strip()]
+
+CRAWL_USE_SITEMAP = os.getenv("CRAWL_USE_SITEMAP", "false").lower() == "true"
+
+# robots.txt設定
+ROBOTS_CACHE_TTL = int(os.getenv("ROBOTS_CACHE_TTL", "86400"))
+ROBOTS_ERROR_TTL = int(os.getenv("ROBOTS_ERROR_TTL", "600"))
+ROBOTS_TIMEOUT = float(os.getenv("ROBOTS_TIMEOUT", "10"))
+ROBOTS_MAX_CRAWL_DELAY = float(os.getenv("ROBOTS_MAX_CRAWL_DELAY", "30"))
+
+# HTTP接続設定
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+
+# 検索拡張（RAG）設定
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "5"))
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "800"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "100"))
+RAG_USE_EMBEDDINGS = os.getenv("RAG_USE_EMBEDDINGS", "false").lower() == "true"
+RAG_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "3000"))  # 1回の質問に添える抜粋のトークン数の上限（0で無制限）
+
+# サイトの内容の組み立て設定
+SITE_TOKEN_BUDGET = int(os.getenv("SITE_TOKEN_BUDGET", "200000"))  # 検索インデックスに含めるサイトの内容のトークン数の上限（0で無制限）
+SITE_DEDUP_DISTANCE = int(os.getenv("SITE_DEDUP_DISTANCE", "3"))  # 類似ブロックとみなすSimHashのハミング距離（-1で完全一致のみ）
+
+# 回答キャッシュ設定
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000"))
+# 類似した質問の回答を使用する類似度のしきい値（0で無効）
+# 語の集合の類似度のため、1語だけ違う長い質問（「iOS」と「Android」など）も同じとみなすことがある
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+# 段階的な初期化設定
+PROGRESSIVE_INIT = os.getenv("PROGRESSIVE_INIT", "false").lower() == "true"  # 最初のページを取り込んだ時点で質問できるようにし、残りはバックグラウンドで取り込む
+PROGRESSIVE_INIT_MIN_PAGES = int(os.getenv("PROGRESSIVE_INIT_MIN_PAGES", "1"))  # 初期化を完了するまでに取り込むページ数
+
+# 会話履歴設定
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "6"))  # そのまま会話の文脈に残す直近のやり取りの数
+HISTORY_MAX_STORED_TURNS = int(os.getenv("HISTORY_MAX_STORED_TURNS", "50"))  # /historyで返すやり取りの数
+HISTORY_SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "2000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))  # 1回の送信でモデルに渡すトークン数の目安
+
+# リクエスト処理設定
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "8"))
+MAX_PENDING_TASKS = int(os.getenv("MAX_PENDING_TASKS", "32"))
+INITIALIZE_TIMEOUT = float(os.getenv("INITIALIZE_TIMEOUT", "300"))
+ASK_TIMEOUT = float(os.getenv("ASK_TIMEOUT", "120"))
+
+# セッション設定
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "100"))
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", "1800"))
+SESSION_MEMORY_LIMIT_MB = int(os.getenv("SESSION_MEMORY_LIMIT_MB", "256"))
+SHARED_SITE_CACHE_SIZE = int(os.getenv("SHARED_SITE_CACHE_SIZE", "8"))
+
+# バックグラウンドクロール設定
+CRAWL_JOB_WORKERS = int(os.getenv("CRAWL_JOB_WORKERS", "2"))
+CRAWL_JOB_HISTORY = int(os.getenv("CRAWL_JOB_HISTORY", "100"))
+
+# ログ・メトリクス設定
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()  # text / json
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER_ENABLED", "false").lower() == "true"  # Server-Timingヘッダーで処理時間の内訳を返す
+
+# データベース設定
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+DB_CACHE_SIZE_MB = int(os.getenv("DB_CACHE_SIZE_MB", "16"))
+DB_MMAP_SIZE_MB = int(os.getenv("DB_MMAP_SIZE_MB", "128"))
+DB_MAX_RETRIES = int(os.getenv("DB_MAX_RETRIES", "3"))
+CACHE_SWEEP_INTERVAL = int(os.getenv("CACHE_SWEEP_INTERVAL", "3600"))
+CACHE_VACUUM_FREE_RATIO = float(os.getenv("CACHE_VACUUM_FREE_RATIO", "0.2"))
+CACHE_COMPRESSION = os.getenv("CACHE_COMPRESSION", "zlib").lower()
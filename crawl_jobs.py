@@ -0,0 +1,181 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from scraper import WebScraper
+
+# ジョブの状態
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (STATUS_COMPLETED, STATUS_FAILED, STATUS_CANCELLED)
+
+# クロールの方法（links: リンクをたどる / sitemap: サイトマップのページを取り込む）
+MODE_LINKS = "links"
+MODE_SITEMAP = "sitemap"
+CRAWL_MODES = (MODE_LINKS, MODE_SITEMAP)
+
+
+class CrawlJob:
+    """バックグラウンドで実行されるクロールジョブ"""
+    def __init__(self, url, max_pages=10, max_depth=2, force_refresh=False, mode=MODE_LINKS):
+        self.id = uuid.uuid4().hex
+        self.url = url
+        self.mode = mode
+        self.max_pages = max_pages
+        self.max_depth = max_depth
+        self.force_refresh = force_refresh
+        self.status = STATUS_QUEUED
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.cancel_event = threading.Event()
+        self.scraper = None
+    
+    def to_dict(self):
+        """APIのレスポンス用に進捗を含むジョブ情報を返す"""
+        stats = self.scraper.crawl_stats if self.scraper else {}
+        elapsed = None
+        if self.started_at:
+            elapsed = ((self.finished_at or datetime.now()) - self.started_at).total_seconds()
+        
+        return {
+            "job_id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "mode": self.mode,
+            "max_pages": self.max_pages,
+            "max_depth": self.max_depth,
+            "pages_fetched": stats.get("pages_fetched", 0),
+            "pages_skipped": stats.get("pages_skipped", 0),
+            "queue_depth": stats.get("queue_depth", 0),
+            "bytes_downloaded": stats.get("bytes_downloaded", 0),
+            "errors": stats.get("errors", 0),
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "elapsed_seconds": elapsed,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class CrawlJobManager:
+    """固定数のワーカーでクロールジョブを実行し、進捗を保持する"""
+    def __init__(self, max_workers=2, max_finished_jobs=100, use_cache=True, cache_expire_days=7):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="crawl-worker")
+        self.max_finished_jobs = max_finished_jobs
+        self.use_cache = use_cache
+        self.cache_expire_days = cache_expire_days
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def submit(self, url, max_pages=10, max_depth=2, force_refresh=False, mode=MODE_LINKS):
+        """クロールジョブを登録し、ワーカーの空きを待って実行する"""
+        job = CrawlJob(url, max_pages, max_depth, force_refresh, mode)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self.executor.submit(self._run, job)
+        return job
+    
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+    
+    def list(self):
+        with self.lock:
+            return list(reversed(self.jobs.values()))
+    
+    def cancel(self, job_id):
+        """ジョブの中断を要求する（実行前のジョブは実行されない）"""
+        job = self.get(job_id)
+        if job and job.status not in FINISHED_STATUSES:
+            job.cancel_event.set()
+        return job
+    
+    def _run(self, job):
+        if job.cancel_event.is_set():
+            job.status = STATUS_CANCELLED
+            job.finished_at = datetime.now()
+            return
+        
+        job.status = STATUS_RUNNING
+        job.started_at = datetime.now()
+        try:
+            job.scraper = WebScraper(
+                url=job.url,
+                use_cache=self.use_cache,
+                cache_expire_days=self.cache_expire_days
+            )
+            if job.mode == MODE_SITEMAP:
+                data = job.scraper.ingest_sitemap(
+                    job.url,
+                    max_pages=job.max_pages,
+                    force_refresh=job.force_refresh,
+                    cancel_event=job.cancel_event
+                )
+            else:
+                data = job.scraper.scrape_with_subpages(
+                    job.url,
+                    max_pages=job.max_pages,
+                    max_depth=job.max_depth,
+                    force_refresh=job.force_refresh,
+                    cancel_event=job.cancel_event
+                )
+            
+            if job.cancel_event.is_set():
+                job.status = STATUS_CANCELLED
+            elif data and job.mode == MODE_SITEMAP:
+                job.status = STATUS_COMPLETED
+                job.result = {
+                    "title": data["title"],
+                    "pages_count": data["pages_count"],
+                    "pages_fetched": data["pages_fetched"],
+                    "pages_skipped": data["pages_skipped"],
+                    "pages_failed": data["pages_failed"],
+                    "from_cache": False
+                }
+            elif data:
+                job.status = STATUS_COMPLETED
+                job.result = {
+                    "title": data["title"],
+                    "pages_count": len(job.scraper.visited_urls),
+                    "from_cache": job.scraper.from_cache
+                }
+            else:
+                job.status = STATUS_FAILED
+                job.error = "ウェブサイトからの情報取得に失敗しました。"
+        except Exception as e:
+            job.status = STATUS_FAILED
+            job.error = f"エラーが発生しました: {str(e)}"
+        finally:
+            job.finished_at = datetime.now()
+    
+    def _prune(self):
+        """完了したジョブのうち古いものを削除する"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATUSES]
+        for job_id in finished[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job_id]
+    
+    def stats(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return {
+            "queued": sum(1 for job in jobs if job.status == STATUS_QUEUED),
+            "running": sum(1 for job in jobs if job.status == STATUS_RUNNING)
+        }
+    
+    def shutdown(self):
+        """実行中のジョブに中断を要求してワーカーを停止する"""
+        with self.lock:
+            for job in self.jobs.values():
+                job.cancel_event.set()
+        self.executor.shutdown(wait=False)
@@ -1,18 +1,209 @@
 import sqlite3
 import json
+import functools
+import logging
 import os
 import time
+import hashlib
+import threading
+import zlib
 from datetime import datetime, timedelta
+from config import (
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_MB,
+    DB_MMAP_SIZE_MB,
+    DB_MAX_RETRIES,
+    CACHE_COMPRESSION,
+)
+from metrics import DB_QUERY_SECONDS
+
+try:
+    import zstandard
+except ImportError:  # zstandardがない環境ではzlibで圧縮する
+    zstandard = None
+
+# 保存するコンテンツの形式（content_formatカラムの値。NULLは圧縮導入前の行）
+CONTENT_FORMAT_TEXT = 0
+CONTENT_FORMAT_ZLIB = 1
+CONTENT_FORMAT_ZSTD = 2
+
+# スキーマのマイグレーション（PRAGMA user_version に適用済みのバージョンを記録する）
+MIGRATIONS = [
+    # 1: 有効期限・一覧表示の並び順・ページの参照元での検索用のインデックス
+    # （visited_urlsのsite_idでの検索は UNIQUE(site_id, url) のインデックスで行える）
+    [
+        'CREATE INDEX IF NOT EXISTS idx_scraped_sites_expire_time ON scraped_sites(expire_time)',
+        'CREATE INDEX IF NOT EXISTS idx_scraped_sites_last_scraped ON scraped_sites(last_scraped)',
+        'CREATE INDEX IF NOT EXISTS idx_pages_expire_time ON pages(expire_time)',
+        'CREATE INDEX IF NOT EXISTS idx_site_pages_page_id ON site_pages(page_id)',
+    ],
+    # 2: 外部キー制約が無効だった間に残った、削除済みサイトの行を削除する
+    [
+        'DELETE FROM visited_urls WHERE site_id NOT IN (SELECT id FROM scraped_sites)',
+        'DELETE FROM site_pages WHERE site_id NOT IN (SELECT id FROM scraped_sites)',
+        'DELETE FROM site_pages WHERE page_id NOT IN (SELECT id FROM pages)',
+    ],
+    # 3: 圧縮して保存したコンテンツの形式
+    [
+        'ALTER TABLE pages ADD COLUMN content_format INTEGER',
+        'ALTER TABLE scraped_sites ADD COLUMN content_format INTEGER',
+    ],
+    # 4: オリジン（スキーム://ホスト）ごとのrobots.txt（取得に失敗した場合はcontentがNULL）
+    [
+        '''CREATE TABLE IF NOT EXISTS robots_txt (
+            origin TEXT PRIMARY KEY,
+            status_code INTEGER,
+            content TEXT,
+            fetched_at TIMESTAMP,
+            expire_time TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_robots_txt_expire_time ON robots_txt(expire_time)',
+    ],
+    # 5: サイトの内容と正規化した質問をキーとする回答のキャッシュ
+    [
+        '''CREATE TABLE IF NOT EXISTS answer_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content_hash TEXT,
+            question_key TEXT,
+            question TEXT,
+            answer TEXT,
+            hits INTEGER DEFAULT 0,
+            created_at TIMESTAMP,
+            last_used_at TIMESTAMP,
+            expire_time TIMESTAMP,
+            UNIQUE(content_hash, question_key)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_answer_cache_last_used_at ON answer_cache(last_used_at)',
+        'CREATE INDEX IF NOT EXISTS idx_answer_cache_expire_time ON answer_cache(expire_time)',
+    ],
+]
+
+
+def compress_content(text, compression="zlib"):
+    """コンテンツを圧縮し、(形式, 保存する値)を返す"""
+    if text is None:
+        return CONTENT_FORMAT_TEXT, None
+    
+    data = text.encode("utf-8")
+    if compression == "zstd" and zstandard:
+        return CONTENT_FORMAT_ZSTD, zstandard.ZstdCompressor(level=10).compress(data)
+    if compression in ("zstd", "zlib"):
+        return CONTENT_FORMAT_ZLIB, zlib.compress(data, 6)
+    return CONTENT_FORMAT_TEXT, text
+
+
+def decompress_content(content_format, value):
+    """保存された値を形式に応じて展開し、テキストを返す"""
+    if value is None or not content_format:
+        return value
+    if content_format == CONTENT_FORMAT_ZLIB:
+        return zlib.decompress(value).decode("utf-8")
+    if content_format == CONTENT_FORMAT_ZSTD:
+        if not zstandard:
+            raise RuntimeError("zstdで圧縮されたデータの展開にはzstandardが必要です")
+        return zstandard.ZstdDecompressor().decompress(value).decode("utf-8")
+    raise ValueError(f"不明なコンテンツ形式です: {content_format}")
+
+logger = logging.getLogger(__name__)
+
+# スレッドごとに再利用するデータベース接続（DBファイルのパス -> 接続）
+# 同じスレッドで作成されたDBManager同士でも接続を共有する
+_local = threading.local()
+
+# スキーマの初期化が済んだDBファイルのパス
+_initialized_paths = set()
+_init_lock = threading.Lock()
+
+
+def _is_busy_error(error):
+    """ロック競合によるエラーかどうかを判断する"""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+def _timed_query(method):
+    """データベースの操作にかかった時間をメソッド名ごとに記録するデコレーター"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with DB_QUERY_SECONDS.time(stage="db", operation=method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class DBManager:
-    def __init__(self, db_path="scraping_data.db"):
+    def __init__(self, db_path="scraping_data.db", busy_timeout=DB_BUSY_TIMEOUT, cache_size_mb=DB_CACHE_SIZE_MB,
+                 mmap_size_mb=DB_MMAP_SIZE_MB, max_retries=DB_MAX_RETRIES, compression=CACHE_COMPRESSION):
         """DBManagerの初期化"""
         self.db_path = db_path
-        self._init_db()
+        self.busy_timeout = busy_timeout
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        self.max_retries = max_retries
+        self.compression = compression  # コンテンツの圧縮方式（zstd / zlib / none）
+        
+        # スキーマの作成はプロセス内でDBファイルごとに一度だけ行う
+        with _init_lock:
+            if self.db_path not in _initialized_paths:
+                self._init_db()
+                _initialized_paths.add(self.db_path)
+    
+    def _get_connection(self):
+        """現在のスレッド用のデータベース接続を取得する（なければ作成する）
+        
+        接続を使い回すことで、接続ごとのプリペアドステートメントのキャッシュも再利用される
+        """
+        connections = getattr(_local, "connections", None)
+        if connections is None:
+            connections = _local.connections = {}
         
+        conn = connections.get(self.db_path)
+        if conn is None:
+            # 書き込みトランザクションは開始時に書き込みロックを取得し（IMMEDIATE）、
+            # ロック中は busy_timeout の間だけ待機する
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout,
+                isolation_level="IMMEDIATE",
+                cached_statements=256
+            )
+            # 削除で空いた領域を少しずつ解放できるようにする
+            # （WALへの切り替えでファイルが作成される前に設定する。既存のデータベースには次のVACUUMで反映される）
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('PRAGMA journal_mode=WAL')
+            # WALモードではNORMALでもデータベースの破損は起きない（電源断時に直近のコミットが失われうるのみ）
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA cache_size={-self.cache_size_mb * 1024}')
+            conn.execute(f'PRAGMA mmap_size={self.mmap_size_mb * 1024 * 1024}')
+            conn.execute('PRAGMA temp_store=MEMORY')
+            # ON DELETE CASCADEを有効にする（接続ごとの設定）
+            conn.execute('PRAGMA foreign_keys=ON')
+            # チェックポイント後にWALファイルを切り詰め、肥大化したままにしない
+            conn.execute(f'PRAGMA journal_size_limit={64 * 1024 * 1024}')
+            connections[self.db_path] = conn
+        return conn
+    
+    def _write(self, operation):
+        """書き込みをトランザクションで実行する（ロック競合時はバックオフして再試行する）"""
+        conn = self._get_connection()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with conn:
+                    return operation(conn.cursor())
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e) or attempt == self.max_retries:
+                    raise
+                time.sleep(0.05 * 2 ** attempt)
+    
+    def close(self):
+        """現在のスレッドの接続を閉じる"""
+        connections = getattr(_local, "connections", {})
+        conn = connections.pop(self.db_path, None)
+        if conn is not None:
+            conn.close()
+    
     def _init_db(self):
         """データベースの初期化"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._get_connection()
         cursor = conn.cursor()
         
         # スクレイピングデータを保存するテーブル
@@ -39,56 +230,123 @@ class DBManager:
         )
         ''')
         
+        # ページ単位のデータ（条件付きGET用のETag/Last-Modifiedを含む）を保存するテーブル
+        # 同じURLのページは複数のサイトから共有される
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT UNIQUE,
+            title TEXT,
+            content TEXT,
+            links TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at TIMESTAMP,
+            content_hash TEXT,
+            expire_time TIMESTAMP
+        )
+        ''')
+        self._add_missing_columns(cursor, 'pages', {
+            'content_hash': 'TEXT',
+            'expire_time': 'TIMESTAMP'
+        })
+        
+        # サイトを構成するページとその順序を保存するテーブル
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS site_pages (
+            site_id INTEGER,
+            page_id INTEGER,
+            position INTEGER,
+            FOREIGN KEY (site_id) REFERENCES scraped_sites(id) ON DELETE CASCADE,
+            FOREIGN KEY (page_id) REFERENCES pages(id) ON DELETE CASCADE,
+            PRIMARY KEY (site_id, page_id)
+        )
+        ''')
+        
         conn.commit()
-        conn.close()
+        self._migrate(conn)
     
-    def save_scraped_data(self, url, title, content, visited_urls, expire_days=7):
-        """スクレイピングしたデータを保存する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    def _migrate(self, conn):
+        """未適用のマイグレーションを順に適用する"""
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for target_version, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            def write(cursor):
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version={target_version}')
+            self._write(write)
+            logger.info("データベースのマイグレーションを適用しました: バージョン%d", target_version)
+    
+    def _add_missing_columns(self, cursor, table, columns):
+        """既存のテーブルに不足しているカラムを追加する"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, column_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+    
+    @_timed_query
+    def save_scraped_data(self, url, title, content, visited_urls, expire_days=7, page_urls=None):
+        """スクレイピングしたデータを保存する
+
+        page_urls（サイトを構成するページURLの順序付きリスト）を指定した場合は、
+        結合済みのcontentは保存せず、読み込み時にページ単位のデータから組み立てる
+        """
         now = datetime.now()
         expire_time = now + timedelta(days=expire_days)
+        content_format, stored_content = compress_content(None if page_urls is not None else content, self.compression)
         
-        try:
-            # メインのスクレイピングデータを保存
+        def write(cursor):
+            # メインのスクレイピングデータを保存（再クロール時もサイトIDを維持する）
             cursor.execute('''
-            INSERT OR REPLACE INTO scraped_sites 
-            (url, title, content, pages_count, last_scraped, expire_time) 
-            VALUES (?, ?, ?, ?, ?, ?)
-            ''', (url, title, content, len(visited_urls), now, expire_time))
-            
-            site_id = cursor.lastrowid
+            INSERT INTO scraped_sites 
+            (url, title, content, content_format, pages_count, last_scraped, expire_time) 
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                title = excluded.title,
+                content = excluded.content,
+                content_format = excluded.content_format,
+                pages_count = excluded.pages_count,
+                last_scraped = excluded.last_scraped,
+                expire_time = excluded.expire_time
+            ''', (url, title, stored_content, content_format, len(visited_urls), now, expire_time))
+            
+            cursor.execute('SELECT id FROM scraped_sites WHERE url = ?', (url,))
+            site_id = cursor.fetchone()[0]
             
             # 既存の訪問済みURLを削除
             cursor.execute('DELETE FROM visited_urls WHERE site_id = ?', (site_id,))
             
             # 訪問済みURLを保存
-            for visited_url in visited_urls:
-                cursor.execute('''
-                INSERT INTO visited_urls (site_id, url) VALUES (?, ?)
-                ''', (site_id, visited_url))
-            
-            conn.commit()
+            cursor.executemany('''
+            INSERT INTO visited_urls (site_id, url) VALUES (?, ?)
+            ''', [(site_id, visited_url) for visited_url in visited_urls])
+            
+            # サイトを構成するページを順序付きで関連付ける
+            cursor.execute('DELETE FROM site_pages WHERE site_id = ?', (site_id,))
+            if page_urls:
+                cursor.executemany('''
+                INSERT OR IGNORE INTO site_pages (site_id, page_id, position)
+                SELECT ?, id, ? FROM pages WHERE url = ?
+                ''', [(site_id, position, page_url) for position, page_url in enumerate(page_urls)])
+        
+        try:
+            self._write(write)
             return True
             
         except Exception as e:
-            print(f"データベース保存エラー: {e}")
-            conn.rollback()
+            logger.error("データベース保存エラー: %s", e)
             return False
-            
-        finally:
-            conn.close()
     
+    @_timed_query
     def get_scraped_data(self, url):
         """URLに対応するスクレイピングデータを取得する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._get_connection().cursor()
         
         try:
             # メインのスクレイピングデータを取得
             cursor.execute('''
-            SELECT id, title, content, pages_count, last_scraped, expire_time 
+            SELECT id, title, content, content_format, pages_count, last_scraped, expire_time 
             FROM scraped_sites 
             WHERE url = ?
             ''', (url,))
@@ -98,37 +356,358 @@ class DBManager:
             if not result:
                 return None
                 
-            site_id, title, content, pages_count, last_scraped, expire_time = result
+            site_id, title, content, content_format, pages_count, last_scraped, expire_time = result
             
             # 有効期限をチェック
             if datetime.now() > datetime.fromisoformat(expire_time):
-                print(f"データの有効期限が切れています: {url}")
+                logger.debug("データの有効期限が切れています: %s", url)
                 return None
             
             # 訪問済みURLを取得
             cursor.execute('SELECT url FROM visited_urls WHERE site_id = ?', (site_id,))
             visited_urls = [row[0] for row in cursor.fetchall()]
             
+            # サイトを構成するページを取得
+            cursor.execute('''
+            SELECT p.url, p.title, p.content, p.content_format
+            FROM site_pages sp
+            JOIN pages p ON p.id = sp.page_id
+            WHERE sp.site_id = ?
+            ORDER BY sp.position
+            ''', (site_id,))
+            pages = [
+                {"url": page_url, "title": page_title, "content": decompress_content(page_format, page_content)}
+                for page_url, page_title, page_content, page_format in cursor.fetchall()
+            ]
+            
             return {
                 "url": url,
                 "title": title,
-                "content": content,
+                "content": decompress_content(content_format, content),
                 "pages_count": pages_count,
                 "last_scraped": last_scraped,
-                "visited_urls": visited_urls
+                "visited_urls": visited_urls,
+                "pages": pages
             }
             
         except Exception as e:
-            print(f"データベース取得エラー: {e}")
+            logger.error("データベース取得エラー: %s", e)
             return None
+    
+    @_timed_query
+    def save_page(self, url, title, content, links, etag=None, last_modified=None, expire_days=7):
+        """ページ単位のデータと再検証用のヘッダー値を保存する"""
+        now = datetime.now()
+        expire_time = now + timedelta(days=expire_days)
+        content_hash = hashlib.sha256((content or "").encode("utf-8")).hexdigest()
+        content_format, stored_content = compress_content(content, self.compression)
+        
+        def write(cursor):
+            cursor.execute('''
+            INSERT INTO pages
+            (url, title, content, content_format, links, etag, last_modified, fetched_at, content_hash, expire_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET
+                title = excluded.title,
+                content = excluded.content,
+                content_format = excluded.content_format,
+                links = excluded.links,
+                etag = excluded.etag,
+                last_modified = excluded.last_modified,
+                fetched_at = excluded.fetched_at,
+                content_hash = excluded.content_hash,
+                expire_time = excluded.expire_time
+            ''', (url, title, stored_content, content_format, json.dumps(links), etag, last_modified, now,
+                  content_hash, expire_time))
+        
+        try:
+            self._write(write)
+            return True
             
-        finally:
-            conn.close()
+        except Exception as e:
+            logger.error("ページ保存エラー: %s", e)
+            return False
+    
+    @_timed_query
+    def get_page(self, url, include_content=True):
+        """URLに対応するページ単位のデータを取得する
+        
+        include_content=Falseの場合はコンテンツを読み込まない（必要になった時点でget_page_contentで取得する）
+        """
+        cursor = self._get_connection().cursor()
+        
+        try:
+            cursor.execute(f'''
+            SELECT title, {"content, content_format" if include_content else "NULL, NULL"},
+                links, etag, last_modified, fetched_at, content_hash, expire_time
+            FROM pages
+            WHERE url = ?
+            ''', (url,))
+            
+            result = cursor.fetchone()
+            
+            if not result:
+                return None
+                
+            title, content, content_format, links, etag, last_modified, fetched_at, content_hash, expire_time = result
+            
+            # 有効期限のない古い行は期限切れとして扱い、再検証させる
+            expired = not expire_time or datetime.now() > datetime.fromisoformat(expire_time)
+            
+            page = {
+                "url": url,
+                "title": title,
+                "links": json.loads(links) if links else [],
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": fetched_at,
+                "content_hash": content_hash,
+                "expired": expired
+            }
+            if include_content:
+                page["content"] = decompress_content(content_format, content)
+            return page
+            
+        except Exception as e:
+            logger.error("ページ取得エラー: %s", e)
+            return None
+    
+    @_timed_query
+    def get_page_content(self, url):
+        """URLに対応するページのコンテンツのみを取得する"""
+        cursor = self._get_connection().cursor()
+        
+        try:
+            cursor.execute('SELECT content, content_format FROM pages WHERE url = ?', (url,))
+            result = cursor.fetchone()
+            
+            if not result:
+                return None
+            
+            content, content_format = result
+            return decompress_content(content_format, content)
+            
+        except Exception as e:
+            logger.error("ページ取得エラー: %s", e)
+            return None
+    
+    @_timed_query
+    def touch_page(self, url, etag=None, last_modified=None, expire_days=7):
+        """304 Not Modifiedを受け取ったページの取得日時・有効期限（と新しい検証子）を更新する"""
+        now = datetime.now()
+        expire_time = now + timedelta(days=expire_days)
+        
+        def write(cursor):
+            cursor.execute('''
+            UPDATE pages
+            SET fetched_at = ?,
+                expire_time = ?,
+                etag = COALESCE(?, etag),
+                last_modified = COALESCE(?, last_modified)
+            WHERE url = ?
+            ''', (now, expire_time, etag, last_modified, url))
+            return cursor.rowcount > 0
+        
+        try:
+            return self._write(write)
+            
+        except Exception as e:
+            logger.error("ページ更新エラー: %s", e)
+            return False
+    
+    @_timed_query
+    def get_pages_fetched_at(self, urls):
+        """URLごとのページの取得日時を返す（キャッシュにないURLは含まない）"""
+        cursor = self._get_connection().cursor()
+        fetched_at = {}
+        urls = list(urls)
+        
+        try:
+            # SQLiteのパラメータ数の上限を超えないよう分割して検索する
+            for start in range(0, len(urls), 500):
+                batch = urls[start:start + 500]
+                cursor.execute(f'''
+                SELECT url, fetched_at FROM pages
+                WHERE url IN ({",".join("?" * len(batch))})
+                ''', batch)
+                for url, value in cursor.fetchall():
+                    if value:
+                        fetched_at[url] = datetime.fromisoformat(value)
+            return fetched_at
+            
+        except Exception as e:
+            logger.error("ページ取得エラー: %s", e)
+            return {}
+    
+    @_timed_query
+    def touch_pages(self, urls, expire_days=7):
+        """変更されていないことを確認したページの取得日時・有効期限をまとめて更新する"""
+        now = datetime.now()
+        expire_time = now + timedelta(days=expire_days)
+        
+        def write(cursor):
+            cursor.executemany('''
+            UPDATE pages SET fetched_at = ?, expire_time = ? WHERE url = ?
+            ''', [(now, expire_time, url) for url in urls])
+            return cursor.rowcount
+        
+        try:
+            return self._write(write)
+            
+        except Exception as e:
+            logger.error("ページ更新エラー: %s", e)
+            return 0
+    
+    @_timed_query
+    def save_robots_txt(self, origin, status_code, content, expire_seconds):
+        """オリジンのrobots.txtを保存する（取得に失敗した場合もstatus_codeとともに保存する）"""
+        now = datetime.now()
+        expire_time = now + timedelta(seconds=expire_seconds)
+        
+        def write(cursor):
+            cursor.execute('''
+            INSERT INTO robots_txt (origin, status_code, content, fetched_at, expire_time)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(origin) DO UPDATE SET
+                status_code = excluded.status_code,
+                content = excluded.content,
+                fetched_at = excluded.fetched_at,
+                expire_time = excluded.expire_time
+            ''', (origin, status_code, content, now, expire_time))
+        
+        try:
+            self._write(write)
+            return True
+            
+        except Exception as e:
+            logger.error("robots.txt保存エラー: %s", e)
+            return False
+    
+    @_timed_query
+    def get_robots_txt(self, origin):
+        """有効期限内のrobots.txtを取得する（ない場合はNone）"""
+        cursor = self._get_connection().cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT status_code, content, expire_time
+            FROM robots_txt
+            WHERE origin = ? AND expire_time > ?
+            ''', (origin, datetime.now()))
+            
+            result = cursor.fetchone()
+            
+            if not result:
+                return None
+            
+            status_code, content, expire_time = result
+            return {
+                "origin": origin,
+                "status_code": status_code,
+                "content": content,
+                "expire_time": datetime.fromisoformat(expire_time)
+            }
+            
+        except Exception as e:
+            logger.error("robots.txt取得エラー: %s", e)
+            return None
+    
+    @_timed_query
+    def get_cached_answer(self, content_hash, question_key):
+        """有効期限内のキャッシュされた回答を取得する（ない場合はNone）"""
+        cursor = self._get_connection().cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT id, question, answer FROM answer_cache
+            WHERE content_hash = ? AND question_key = ? AND expire_time > ?
+            ''', (content_hash, question_key, datetime.now()))
+            
+            result = cursor.fetchone()
+            
+            if not result:
+                return None
+            
+            return {"id": result[0], "question": result[1], "answer": result[2]}
+            
+        except Exception as e:
+            logger.error("回答キャッシュ取得エラー: %s", e)
+            return None
+    
+    @_timed_query
+    def get_cached_questions(self, content_hash, limit=500):
+        """サイトのキャッシュされた回答を、最後に使われた日時が新しい順に取得する"""
+        cursor = self._get_connection().cursor()
+        
+        try:
+            cursor.execute('''
+            SELECT id, question, answer FROM answer_cache
+            WHERE content_hash = ? AND expire_time > ?
+            ORDER BY last_used_at DESC
+            LIMIT ?
+            ''', (content_hash, datetime.now(), limit))
+            
+            return [
+                {"id": answer_id, "question": question, "answer": answer}
+                for answer_id, question, answer in cursor.fetchall()
+            ]
+            
+        except Exception as e:
+            logger.error("回答キャッシュ取得エラー: %s", e)
+            return []
+    
+    @_timed_query
+    def save_cached_answer(self, content_hash, question_key, question, answer, expire_seconds, max_entries=None):
+        """回答を保存し、件数の上限を超えた分を最後に使われた日時が古いものから削除する"""
+        now = datetime.now()
+        expire_time = now + timedelta(seconds=expire_seconds)
+        
+        def write(cursor):
+            cursor.execute('''
+            INSERT INTO answer_cache
+            (content_hash, question_key, question, answer, hits, created_at, last_used_at, expire_time)
+            VALUES (?, ?, ?, ?, 0, ?, ?, ?)
+            ON CONFLICT(content_hash, question_key) DO UPDATE SET
+                question = excluded.question,
+                answer = excluded.answer,
+                created_at = excluded.created_at,
+                last_used_at = excluded.last_used_at,
+                expire_time = excluded.expire_time
+            ''', (content_hash, question_key, question, answer, now, now, expire_time))
+            
+            if max_entries:
+                cursor.execute('''
+                DELETE FROM answer_cache WHERE id IN (
+                    SELECT id FROM answer_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                ''', (max_entries,))
+        
+        try:
+            self._write(write)
+            return True
+            
+        except Exception as e:
+            logger.error("回答キャッシュ保存エラー: %s", e)
+            return False
     
+    @_timed_query
+    def touch_cached_answer(self, answer_id):
+        """キャッシュされた回答の使用回数と最後に使われた日時を更新する"""
+        def write(cursor):
+            cursor.execute('''
+            UPDATE answer_cache SET hits = hits + 1, last_used_at = ? WHERE id = ?
+            ''', (datetime.now(), answer_id))
+        
+        try:
+            self._write(write)
+            
+        except Exception as e:
+            logger.error("回答キャッシュ更新エラー: %s", e)
+    
+    @_timed_query
     def is_data_fresh(self, url, max_age_days=7):
         """URLに対応するデータが新鮮かどうかを確認する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._get_connection().cursor()
         
         try:
             cursor.execute('''
@@ -146,49 +725,69 @@ class DBManager:
             return datetime.now() - last_scraped < max_age
             
         except Exception as e:
-            print(f"データベースチェックエラー: {e}")
+            logger.error("データベースチェックエラー: %s", e)
             return False
-            
-        finally:
-            conn.close()
     
+    @_timed_query
     def delete_expired_data(self):
         """有効期限が切れたデータを削除する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        now = datetime.now()
         
-        try:
-            now = datetime.now()
-            
-            # 有効期限切れのサイトIDを取得
+        def write(cursor):
+            # 有効期限切れのサイトを削除（訪問済みURLとページの関連付けは外部キー制約で削除される）
             cursor.execute('''
-            SELECT id FROM scraped_sites WHERE expire_time < ?
+            DELETE FROM scraped_sites WHERE expire_time < ?
             ''', (now,))
             
-            expired_ids = [row[0] for row in cursor.fetchall()]
+            deleted_count = cursor.rowcount
             
-            # 有効期限切れのサイトを削除
+            # どのサイトからも参照されていない期限切れのページを削除
             cursor.execute('''
-            DELETE FROM scraped_sites WHERE expire_time < ?
+            DELETE FROM pages
+            WHERE expire_time < ?
+            AND NOT EXISTS (SELECT 1 FROM site_pages WHERE site_pages.page_id = pages.id)
             ''', (now,))
             
-            deleted_count = cursor.rowcount
+            cursor.execute('DELETE FROM robots_txt WHERE expire_time < ?', (now,))
+            cursor.execute('DELETE FROM answer_cache WHERE expire_time < ?', (now,))
             
-            conn.commit()
             return deleted_count
+        
+        try:
+            return self._write(write)
             
         except Exception as e:
-            print(f"期限切れデータ削除エラー: {e}")
-            conn.rollback()
+            logger.error("期限切れデータ削除エラー: %s", e)
             return 0
+    
+    @_timed_query
+    def vacuum(self, min_free_ratio=0.2):
+        """削除で空いた領域が一定の割合を超えた場合に、データベースファイルを縮小する"""
+        conn = self._get_connection()
+        
+        try:
+            page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+            freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not page_count or freelist_count / page_count < min_free_ratio:
+                return False
             
-        finally:
-            conn.close()
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                # 空きページのみを解放する（データベース全体を書き直さない）
+                # executeでは1ページ分しか進まないため、executescriptで最後まで実行する
+                conn.executescript('PRAGMA incremental_vacuum;')
+            else:
+                conn.execute('VACUUM')
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            return True
+            
+        except Exception as e:
+            logger.error("データベース縮小エラー: %s", e)
+            return False
     
+    @_timed_query
     def get_all_urls(self):
         """保存されているすべてのURLを取得する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._get_connection().cursor()
         
         try:
             cursor.execute('SELECT url FROM scraped_sites')
@@ -196,16 +795,13 @@ class DBManager:
             return urls
             
         except Exception as e:
-            print(f"URL取得エラー: {e}")
+            logger.error("URL取得エラー: %s", e)
             return []
             
-        finally:
-            conn.close()
-            
+    @_timed_query
     def get_database_stats(self):
         """データベースの統計情報を取得する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._get_connection().cursor()
         
         try:
             # サイト数を取得
@@ -220,8 +816,12 @@ class DBManager:
             cursor.execute('SELECT MAX(last_scraped) FROM scraped_sites')
             last_scraped = cursor.fetchone()[0]
             
-            # DBファイルサイズを取得
-            db_size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+            # DBファイルサイズを取得（WALファイルに書き込まれた未チェックポイント分も含む）
+            db_size = sum(
+                os.path.getsize(path)
+                for path in (self.db_path, f"{self.db_path}-wal")
+                if os.path.exists(path)
+            )
             
             return {
                 "sites_count": sites_count,
@@ -231,7 +831,7 @@ class DBManager:
             }
             
         except Exception as e:
-            print(f"統計情報取得エラー: {e}")
+            logger.error("統計情報取得エラー: %s", e)
             return {
                 "sites_count": 0,
                 "urls_count": 0,
@@ -239,21 +839,18 @@ class DBManager:
                 "db_size_kb": 0
             }
             
-        finally:
-            conn.close()
-            
+    @_timed_query
     def get_all_sites_info(self):
         """保存されているすべてのサイト情報を取得する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._get_connection().cursor()
         
         try:
             cursor.execute('''
             SELECT id, url, title, pages_count, last_scraped 
             FROM scraped_sites
-            WHERE datetime('now') < expire_time
+            WHERE expire_time > ?
             ORDER BY last_scraped DESC
-            ''')
+            ''', (datetime.now(),))
             
             sites = []
             for row in cursor.fetchall():
@@ -269,23 +866,20 @@ class DBManager:
             return sites
             
         except Exception as e:
-            print(f"サイト情報取得エラー: {e}")
+            logger.error("サイト情報取得エラー: %s", e)
             return []
             
-        finally:
-            conn.close()
-            
+    @_timed_query
     def get_site_info_by_id(self, site_id):
         """サイトIDからサイト情報を取得する"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._get_connection().cursor()
         
         try:
             cursor.execute('''
             SELECT id, url, title, pages_count, last_scraped 
             FROM scraped_sites 
-            WHERE id = ? AND datetime('now') < expire_time
-            ''', (site_id,))
+            WHERE id = ? AND expire_time > ?
+            ''', (site_id, datetime.now()))
             
             result = cursor.fetchone()
             
@@ -303,14 +897,46 @@ class DBManager:
             }
             
         except Exception as e:
-            print(f"サイト情報取得エラー: {e}")
+            logger.error("サイト情報取得エラー: %s", e)
             return None
-            
-        finally:
-            conn.close()
+
+class CacheSweeper:
+    """一定間隔で期限切れのキャッシュを削除し、データベースを縮小するバックグラウンドスレッド"""
+    def __init__(self, db_manager, interval=3600, min_free_ratio=0.2):
+        self.db_manager = db_manager
+        self.interval = interval
+        self.min_free_ratio = min_free_ratio
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="cache-sweeper", daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def sweep(self):
+        """期限切れデータの削除とデータベースの縮小を一度実行する"""
+        deleted_count = self.db_manager.delete_expired_data()
+        vacuumed = self.db_manager.vacuum(self.min_free_ratio)
+        if deleted_count or vacuumed:
+            logger.info("キャッシュを掃除しました: %d件のサイトを削除%s", deleted_count, "、データベースを縮小" if vacuumed else "")
+        return deleted_count
+    
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sweep()
+        # スレッドの終了時に接続を閉じる
+        self.db_manager.close()
 
 # 使用例
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
+    
     db = DBManager()
     
     # データベースの統計情報を表示
@@ -323,4 +949,8 @@ if __name__ == "__main__":
     
     # 期限切れデータを削除
     deleted = db.delete_expired_data()
-    print(f"{deleted}件の期限切れデータを削除しました")
\ No newline at end of file
+    print(f"{deleted}件の期限切れデータを削除しました")
+    
+    # 空き領域が多ければデータベースを縮小
+    if db.vacuum():
+        print("データベースを縮小しました")
\ No newline at end of file
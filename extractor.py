@@ -0,0 +1,480 @@
+import re
+from bs4 import BeautifulSoup
+import html2text
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:  # lxmlがない環境では従来の抽出処理を使用する
+    lxml = None
+
+# 本文として扱わないタグ
+SKIP_TAGS = frozenset(['script', 'style', 'noscript', 'iframe', 'svg', 'template', 'object', 'embed', 'canvas'])
+
+# 前後を段落として区切るタグ
+BLOCK_TAGS = frozenset([
+    'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'nav', 'aside', 'blockquote',
+    'form', 'figure', 'figcaption', 'address', 'dl', 'dt', 'dd', 'table', 'fieldset', 'details', 'summary'
+])
+
+# 本文の段落としてスコアを親要素に加算するタグ
+PARAGRAPH_TAGS = frozenset(['p', 'pre', 'td', 'blockquote', 'li', 'dd'])
+
+# サイト共通のナビゲーションなど、本文から除外する領域
+BOILERPLATE_TAGS = frozenset(['nav', 'aside', 'footer'])
+
+HEADING_TAGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+
+# クラス名・IDから本文らしさを判断するパターン
+POSITIVE_PATTERN = re.compile(r'article|body|content|entry|main|page|post|text|blog|story', re.IGNORECASE)
+NEGATIVE_PATTERN = re.compile(
+    r'comment|footer|footnote|masthead|menu|nav|related|share|sidebar|sponsor|social|widget|banner|breadcrumb|'
+    r'header|popup|cookie|\bads?\b',
+    re.IGNORECASE
+)
+
+# 中身が空の場合は何も出力しないインライン要素
+INLINE_MARKUP_TAGS = frozenset(['a', 'strong', 'b', 'em', 'i', 'code'])
+
+# 段落のスコアに加算する句読点
+PUNCTUATION_PATTERN = re.compile(r'[,、。，．]')
+
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+CODE_BLOCK_PATTERN = re.compile(r'(\n```\n.*?\n```\n)', re.DOTALL)
+
+# 従来の抽出処理で使用するクラス名のパターン
+LEGACY_CONTENT_CLASS_PATTERN = re.compile('(content|main|article)')
+
+
+def build_page_content(title, meta_description, header_text, nav_text, content_text, page_url):
+    """抽出した各要素からページ情報を組み立てる（抽出方法によらず共通の形式）"""
+    final_content = ""
+    if meta_description:
+        final_content += f"サイト概要: {meta_description}\n\n"
+    
+    if header_text:
+        final_content += f"主要見出し:\n{header_text}\n\n"
+    
+    if nav_text:
+        final_content += f"ナビゲーションメニュー:\n{nav_text}\n\n"
+    
+    final_content += content_text
+    
+    # 重複する改行を削除
+    final_content = re.sub(r'\n{3,}', '\n\n', final_content)
+    
+    return {
+        "title": title,
+        "content": final_content,
+        "url": page_url
+    }
+
+
+def _create_converter():
+    converter = html2text.HTML2Text()
+    converter.ignore_links = False
+    converter.ignore_images = True
+    converter.body_width = 0  # 行の折り返しを無効化
+    return converter
+
+
+def extract_page_legacy(html_content, page_url, converter=None):
+    """BeautifulSoupとhtml2textによる従来の抽出処理（比較用に残している）
+    
+    候補となる要素ごとにhtml2textで変換するため、入れ子になった要素の内容は重複して含まれる
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    converter = converter or _create_converter()
+    
+    # 本文抽出でタグが削除される前にリンクを抽出する
+    hrefs = [a_tag['href'] for a_tag in soup.find_all('a', href=True)]
+    
+    # タイトルを取得
+    title = soup.title.text if soup.title else "タイトルなし"
+    
+    # メタデータの抽出
+    meta_description = ""
+    meta_tag = soup.find("meta", attrs={"name": "description"})
+    if meta_tag and meta_tag.get("content"):
+        meta_description = meta_tag.get("content")
+    
+    # 不要なタグを削除
+    for tag in soup.find_all(['script', 'style', 'noscript', 'iframe', 'svg']):
+        tag.decompose()
+    
+    # メインコンテンツの抽出（複数の方法を試す）
+    content_text = ""
+    
+    # 1. articleタグを探す
+    articles = soup.find_all('article')
+    if articles:
+        for article in articles:
+            content_text += converter.handle(str(article)) + "\n\n"
+    
+    # 2. mainタグを探す
+    main_content = soup.find('main')
+    if main_content:
+        content_text += converter.handle(str(main_content)) + "\n\n"
+    
+    # 3. contentクラスを持つ要素を探す
+    content_elements = soup.find_all(class_=LEGACY_CONTENT_CLASS_PATTERN)
+    if content_elements:
+        for element in content_elements:
+            content_text += converter.handle(str(element)) + "\n\n"
+    
+    # 4. セクションやdivを探す
+    sections = soup.find_all(['section', 'div'])
+    if sections and not content_text:
+        for section in sections:
+            # クラス名に基づいて重要なセクションを判断
+            class_name = section.get('class', [])
+            class_str = ' '.join(class_name).lower() if class_name else ''
+            if any(keyword in class_str for keyword in ['content', 'main', 'article', 'body', 'text']):
+                content_text += converter.handle(str(section)) + "\n\n"
+    
+    # 5. ヘッダー情報を取得
+    headers = soup.find_all(['h1', 'h2', 'h3'])
+    header_text = ""
+    for header in headers:
+        header_text += header.text + "\n"
+    
+    # 6. リンクテキストを収集（ナビゲーションなどの情報を取得するため）
+    nav = soup.find('nav')
+    nav_text = ""
+    if nav:
+        links = nav.find_all('a')
+        for link in links:
+            if link.text.strip():
+                nav_text += link.text.strip() + "\n"
+    
+    # 十分なコンテンツが取得できなかった場合は、bodyから直接取得
+    if not content_text:
+        # ヘッダーとフッターを除外
+        header_tag = soup.find('header')
+        if header_tag:
+            header_tag.extract()
+        
+        footer = soup.find('footer')
+        if footer:
+            footer.extract()
+        
+        nav = soup.find('nav')
+        if nav:
+            nav.extract()
+        
+        content_text = converter.handle(str(soup.body))
+    
+    page = build_page_content(title, meta_description, header_text, nav_text, content_text, page_url)
+    page["hrefs"] = hrefs
+    return page
+
+
+class _ExtractionState:
+    """一度の走査で集める本文の断片・スコア・リンクなど"""
+    def __init__(self):
+        self.pieces = []  # Markdownに変換した断片（要素ごとの範囲で本文を切り出す）
+        self.ranges = {}  # 要素 -> (断片の開始位置, 終了位置, テキスト長, リンクテキスト長)
+        self.scores = {}  # 要素 -> 子孫の段落から加算されたスコア
+        self.boilerplate_ranges = []  # 本文から除外する断片の範囲
+        self.hrefs = []
+        self.headings = []
+        self.nav_items = []
+        self.in_nav = False  # ページ内で最初のnav要素を走査中かどうか
+        self.nav_done = False
+        self.title = None
+        self.meta_description = ""
+
+
+def _normalize_text(text):
+    return WHITESPACE_PATTERN.sub(' ', text)
+
+
+def _class_weight(element):
+    """クラス名・IDから本文らしさの重みを計算する"""
+    weight = 0
+    for value in (element.get('class'), element.get('id')):
+        if value:
+            if NEGATIVE_PATTERN.search(value):
+                weight -= 25
+            if POSITIVE_PATTERN.search(value):
+                weight += 25
+    return weight
+
+
+def _tag_weight(tag):
+    if tag in ('article', 'main'):
+        return 10
+    if tag == 'div':
+        return 5
+    if tag in ('pre', 'td', 'blockquote'):
+        return 3
+    if tag in ('address', 'ol', 'ul', 'dl', 'dd', 'dt', 'li', 'form'):
+        return -3
+    if tag in HEADING_TAGS or tag == 'th':
+        return -5
+    return 0
+
+
+def _visit_head(head, state):
+    """head要素からタイトルと概要を取り出す"""
+    for child in head:
+        if child.tag == 'title' and state.title is None:
+            state.title = child.text or ""
+        elif child.tag == 'meta' and (child.get('name') or '').lower() == 'description':
+            state.meta_description = child.get('content') or ""
+
+
+def _visit(element, state, in_link=False, in_pre=False, in_boilerplate=False, in_article=False, list_marker=None):
+    """要素を一度だけ走査し、Markdownの断片を出力しながらテキスト長・リンクテキスト長を集計する
+    
+    (テキスト長, リンクテキスト長)を返す
+    """
+    tag = element.tag
+    pieces = state.pieces
+    start = len(pieces)
+    text_length = 0
+    link_length = 0
+    suffix = None
+    
+    is_boilerplate = tag in BOILERPLATE_TAGS or (tag == 'header' and not in_article)
+    if is_boilerplate:
+        in_boilerplate = True
+    if tag in ('article', 'main'):
+        in_article = True
+    
+    # 開始タグに対応するMarkdown
+    if tag in HEADING_TAGS:
+        pieces.append("\n\n" + "#" * HEADING_TAGS[tag] + " ")
+        suffix = "\n\n"
+        if HEADING_TAGS[tag] <= 3:
+            heading = _normalize_text(element.text_content()).strip()
+            if heading:
+                state.headings.append(heading)
+    elif tag == 'a':
+        href = element.get('href')
+        if href is not None:
+            state.hrefs.append(href)
+            if state.in_nav and not in_link:
+                item = _normalize_text(element.text_content()).strip()
+                if item:
+                    state.nav_items.append(item)
+        if href and not in_link and not in_pre:
+            pieces.append("[")
+            in_link = True
+            suffix = f"]({href})"
+    elif tag == 'br':
+        pieces.append("\n")
+    elif tag == 'hr':
+        pieces.append("\n\n* * *\n\n")
+    elif tag == 'li':
+        pieces.append(f"\n{list_marker or '*'} ")
+    elif tag in ('ul', 'ol'):
+        pieces.append("\n\n")
+        suffix = "\n\n"
+    elif tag in ('strong', 'b'):
+        pieces.append("**")
+        suffix = "**"
+    elif tag in ('em', 'i'):
+        pieces.append("_")
+        suffix = "_"
+    elif tag == 'code' and not in_pre:
+        pieces.append("`")
+        suffix = "`"
+    elif tag == 'pre':
+        pieces.append("\n\n```\n")
+        suffix = "\n```\n\n"
+        in_pre = True
+    elif tag == 'tr':
+        pieces.append("\n")
+    elif tag in ('td', 'th'):
+        suffix = " | "
+    elif tag in BLOCK_TAGS:
+        pieces.append("\n\n")
+        suffix = "\n\n"
+    
+    # ページ内で最初のnav要素のリンクをナビゲーションメニューとして集める
+    nav_started = tag == 'nav' and not state.nav_done
+    if nav_started:
+        state.in_nav = True
+        state.nav_done = True
+    
+    if element.text:
+        text = element.text if in_pre else _normalize_text(element.text)
+        pieces.append(text)
+        text_length += len(text.strip())
+    
+    item_number = 0
+    for child in element:
+        child_tag = child.tag
+        if isinstance(child_tag, str) and child_tag not in SKIP_TAGS:
+            if child_tag == 'head':
+                _visit_head(child, state)
+            else:
+                marker = None
+                if child_tag == 'li' and tag == 'ol':
+                    item_number += 1
+                    marker = f"{item_number}."
+                child_text, child_links = _visit(child, state, in_link, in_pre, in_boilerplate, in_article, marker)
+                text_length += child_text
+                link_length += child_links
+        
+        # コメントや除外したタグの後ろのテキストも本文に含める
+        if child.tail:
+            text = child.tail if in_pre else _normalize_text(child.tail)
+            pieces.append(text)
+            text_length += len(text.strip())
+    
+    if nav_started:
+        state.in_nav = False
+    
+    if suffix:
+        if text_length == 0 and (tag in HEADING_TAGS or tag in INLINE_MARKUP_TAGS):
+            # 空の見出しやリンク（画像のみのリンクなど）は出力しない
+            pieces[start:] = [""] * (len(pieces) - start)
+        else:
+            pieces.append(suffix)
+    if tag == 'a' and suffix:
+        link_length = text_length
+    
+    end = len(pieces)
+    state.ranges[element] = (start, end, text_length, link_length)
+    
+    # クラス名・IDがメニューや広告らしく、リンクばかりか短い要素も本文から除外する
+    if not is_boilerplate and tag in BLOCK_TAGS and _class_weight(element) < 0:
+        is_boilerplate = link_length > text_length * 0.5 or text_length < 25
+    if is_boilerplate:
+        state.boilerplate_ranges.append((start, end))
+    
+    # 段落（またはブロック要素を含まないdiv）のスコアを親に、半分を祖父母に加算する
+    is_paragraph = tag in PARAGRAPH_TAGS or (tag in ('div', 'section') and not _has_block_children(element))
+    if is_paragraph and not in_boilerplate and text_length >= 25:
+        text = "".join(pieces[start:end])
+        score = 1 + len(PUNCTUATION_PATTERN.findall(text)) + min(text_length // 100, 3)
+        parent = element.getparent()
+        if parent is not None:
+            state.scores[parent] = state.scores.get(parent, 0) + score
+            grandparent = parent.getparent()
+            if grandparent is not None:
+                state.scores[grandparent] = state.scores.get(grandparent, 0) + score / 2
+    
+    return text_length, link_length
+
+
+def _has_block_children(element):
+    """子要素にブロック要素を含むかどうか"""
+    for child in element:
+        if child.tag in BLOCK_TAGS or child.tag in PARAGRAPH_TAGS or child.tag in HEADING_TAGS:
+            return True
+    return False
+
+
+def _join_range(state, start, end):
+    """断片の範囲を本文として結合する（ナビゲーションなどの領域は除く）"""
+    parts = []
+    position = start
+    for skip_start, skip_end in sorted(state.boilerplate_ranges):
+        if skip_end <= position or skip_start >= end:
+            continue
+        parts.extend(state.pieces[position:skip_start])
+        position = max(position, skip_end)
+    parts.extend(state.pieces[position:end])
+    
+    # 整形済みテキスト（```で囲んだブロック）以外の余分な空白を削除する
+    blocks = CODE_BLOCK_PATTERN.split("".join(parts))
+    for index in range(0, len(blocks), 2):
+        text = re.sub(r'[ \t]*\n[ \t]*', '\n', blocks[index])
+        text = re.sub(r' \| *(?=\n|$)', '', text)  # 表の行末の区切り
+        blocks[index] = re.sub(r'(?<=\S) {2,}', ' ', text)
+    return "".join(blocks).strip() + "\n"
+
+
+def _candidate_score(element, state):
+    _, _, text_length, link_length = state.ranges[element]
+    link_density = link_length / text_length if text_length else 0
+    score = state.scores[element] + _class_weight(element) + _tag_weight(element.tag)
+    return score * (1 - link_density)
+
+
+def _parse_document(html_content):
+    try:
+        return lxml.html.document_fromstring(html_content)
+    except ValueError:
+        # エンコーディング宣言を含む文字列はバイト列として解析する
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        return lxml.html.document_fromstring(html_content.encode('utf-8'), parser=parser)
+
+
+def extract_page_fast(html_content, page_url):
+    """lxmlで解析したツリーを一度だけ走査して本文を抽出する
+    
+    各段落のスコアを親要素に集計し（readability方式）、最もスコアの高い要素とその兄弟要素のうち
+    スコアの高いものを本文とする。本文は走査中に出力したMarkdownの断片から切り出すため、
+    入れ子になった要素を重複して変換することはない
+    """
+    state = _ExtractionState()
+    try:
+        root = _parse_document(html_content)
+    except etree.ParserError:
+        root = None
+    
+    body = None
+    if root is not None:
+        _visit(root, state)
+        body = root.find('body')
+    
+    content_text = ""
+    if state.scores:
+        top = max(state.scores, key=lambda element: _candidate_score(element, state))
+        
+        # 親要素のテキストの大部分を占める場合は、見出しなども含めるため親要素まで広げる
+        while top is not body:
+            parent = top.getparent()
+            if parent is None or parent not in state.ranges:
+                break
+            if state.ranges[top][2] < state.ranges[parent][2] * 0.8:
+                break
+            top = parent
+        
+        top_score = _candidate_score(top, state) if top in state.scores else 0
+        threshold = max(10, top_score * 0.2)
+        
+        # スコアの高い兄弟要素（記事一覧の各記事など）も文書順に含める
+        parent = top.getparent()
+        candidates = [top]
+        if parent is not None:
+            candidates = [
+                sibling for sibling in parent
+                if sibling is top or (sibling in state.scores and _candidate_score(sibling, state) >= threshold)
+            ]
+        content_text = "\n\n".join(
+            _join_range(state, *state.ranges[candidate][:2]) for candidate in candidates
+        )
+    elif body is not None and body in state.ranges:
+        # 段落が見つからない場合は、ナビゲーションなどを除いたbody全体を使用する
+        content_text = _join_range(state, *state.ranges[body][:2])
+    
+    title = state.title if state.title is not None else "タイトルなし"
+    header_text = "".join(f"{heading}\n" for heading in state.headings)
+    nav_text = "".join(f"{item}\n" for item in state.nav_items)
+    
+    page = build_page_content(title, state.meta_description, header_text, nav_text, content_text, page_url)
+    page["hrefs"] = state.hrefs
+    return page
+
+
+def fast_extraction_available():
+    return lxml is not None
+
+
+def extract_page(html_content, page_url, extractor="fast"):
+    """HTMLからタイトル・本文（Markdown）・リンク先（hrefsにhref属性のまま）を抽出する
+    
+    extractorに"legacy"を指定するか、lxmlがない場合は従来の抽出処理を使用する
+    プロセスプールからも呼び出せるよう、モジュールの関数として定義している
+    """
+    if not html_content:
+        return None
+    if extractor == "legacy" or lxml is None:
+        return extract_page_legacy(html_content, page_url)
+    return extract_page_fast(html_content, page_url)
@@ -0,0 +1,141 @@
+import re
+from collections import deque
+
+from config import (
+    HISTORY_MAX_TURNS,
+    HISTORY_MAX_STORED_TURNS,
+    HISTORY_SUMMARY_MAX_CHARS,
+    HISTORY_TOKEN_BUDGET,
+)
+
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7f]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 要約に残す質問・回答の最大文字数
+SUMMARY_QUESTION_CHARS = 200
+SUMMARY_ANSWER_CHARS = 300
+
+
+def estimate_tokens(text):
+    """おおよそのトークン数を見積もる（ASCII文字は4文字で1トークン、それ以外の文字は1文字で1トークンとして数える）"""
+    if not text:
+        return 0
+    non_ascii = len(NON_ASCII_PATTERN.findall(text))
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def _shorten(text, limit):
+    text = WHITESPACE_PATTERN.sub(' ', text or '').strip()
+    return text if len(text) <= limit else text[:limit] + "…"
+
+
+def summarize_turn(question, answer):
+    """1回のやり取りを要約の1行にまとめる
+    
+    モデルによる要約ではなく、質問と回答をそれぞれ決まった文字数で切り詰めたもの
+    （切り詰めた部分に含まれる内容は会話の文脈から失われる）
+    """
+    return f"- 質問: {_shorten(question, SUMMARY_QUESTION_CHARS)} / 回答: {_shorten(answer, SUMMARY_ANSWER_CHARS)}"
+
+
+class ConversationHistory:
+    """セッションごとの上限付きの会話履歴
+    
+    直近のmax_turns回のやり取りはそのまま会話の文脈に残し、それより古いやり取りは
+    要約（最大summary_max_chars文字、超えた場合は古いものから削除）にまとめる。
+    要約は各やり取りの質問と回答の冒頭を切り詰めて残したもので、それ以降の内容は残らない。
+    /historyで返す会話履歴は直近のmax_stored_turns回のやり取りのみを保持する。
+    """
+    def __init__(self, max_turns=HISTORY_MAX_TURNS, max_stored_turns=HISTORY_MAX_STORED_TURNS,
+                 summary_max_chars=HISTORY_SUMMARY_MAX_CHARS, token_budget=HISTORY_TOKEN_BUDGET):
+        self.max_turns = max(0, max_turns)
+        self.summary_max_chars = summary_max_chars
+        self.token_budget = token_budget
+        self.turns = []  # 会話の文脈にそのまま残すやり取り [(質問, 回答)]
+        self.summary_lines = deque()
+        self.summary_chars = 0
+        self.messages = deque(maxlen=max(1, max_stored_turns) * 2)
+    
+    def add(self, question, answer):
+        """やり取りを記録し、max_turnsを超えた古いやり取りを要約に移す"""
+        self.turns.append((question, answer))
+        self.messages.append({"role": "user", "content": question})
+        self.messages.append({"role": "assistant", "content": answer})
+        
+        while len(self.turns) > self.max_turns:
+            self._compact_oldest_turn()
+    
+    def _compact_oldest_turn(self):
+        question, answer = self.turns.pop(0)
+        line = summarize_turn(question, answer)
+        self.summary_lines.append(line)
+        self.summary_chars += len(line) + 1
+        
+        while self.summary_lines and self.summary_chars > self.summary_max_chars:
+            self._drop_oldest_summary()
+    
+    def _drop_oldest_summary(self):
+        self.summary_chars -= len(self.summary_lines.popleft()) + 1
+    
+    def summary(self):
+        return "\n".join(self.summary_lines)
+    
+    def contents(self, system_prompt, acknowledgement):
+        """会話の文脈（システムプロンプトとこれまでの会話の要約、直近のやり取り）を作成する"""
+        prompt = system_prompt
+        summary = self.summary()
+        if summary:
+            prompt = f"{system_prompt}\nこれまでの会話の要約（古いやり取りの質問と回答の冒頭のみ）:\n{summary}\n"
+        
+        contents = [
+            {"role": "user", "parts": [prompt]},
+            {"role": "model", "parts": [acknowledgement]}
+        ]
+        for question, answer in self.turns:
+            contents.append({"role": "user", "parts": [question]})
+            contents.append({"role": "model", "parts": [answer]})
+        return contents
+    
+    def count_tokens(self, system_prompt, acknowledgement, prompt):
+        """会話の文脈に送信するプロンプトを加えたおおよそのトークン数"""
+        tokens = estimate_tokens(system_prompt) + estimate_tokens(acknowledgement) + estimate_tokens(prompt)
+        tokens += estimate_tokens(self.summary())
+        tokens += sum(estimate_tokens(question) + estimate_tokens(answer) for question, answer in self.turns)
+        return tokens
+    
+    def fit(self, system_prompt, acknowledgement, prompt):
+        """送信するプロンプトを加えてもtoken_budgetに収まるように会話の文脈を縮める
+        
+        古いやり取りから要約に移し、それでも超える場合は古い要約から削除する。
+        縮めた後のおおよそのトークン数を返す（システムプロンプトとプロンプトだけで超える場合は予算を超えたまま）。
+        """
+        tokens = self.count_tokens(system_prompt, acknowledgement, prompt)
+        while self.turns and tokens > self.token_budget:
+            self._compact_oldest_turn()
+            tokens = self.count_tokens(system_prompt, acknowledgement, prompt)
+        
+        while self.summary_lines and tokens > self.token_budget:
+            self._drop_oldest_summary()
+            tokens = self.count_tokens(system_prompt, acknowledgement, prompt)
+        return tokens
+    
+    def get_messages(self):
+        """/historyで返す会話履歴"""
+        return list(self.messages)
+    
+    def is_empty(self):
+        """会話の文脈に前のやり取り（要約を含む）がないかどうか"""
+        return not self.turns and not self.summary_lines
+    
+    def clear(self):
+        self.turns = []
+        self.summary_lines.clear()
+        self.summary_chars = 0
+        self.messages.clear()
+    
+    def estimate_bytes(self):
+        """おおよそのメモリ使用量（バイト）を見積もる"""
+        message_bytes = sum(len(message["content"].encode("utf-8")) for message in self.messages)
+        # 直近のやり取りはチャットインスタンス側の会話の文脈にも保持される
+        turn_bytes = sum(len(question.encode("utf-8")) + len(answer.encode("utf-8")) for question, answer in self.turns)
+        return message_bytes + turn_bytes + len(self.summary().encode("utf-8"))
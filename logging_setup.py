@@ -0,0 +1,41 @@
+import json
+import logging
+from datetime import datetime
+
+from config import LOG_LEVEL, LOG_FORMAT
+
+# LogRecordが標準で持つ属性（これ以外の属性はextraで渡された項目としてJSONに含める）
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """1行に1つのJSONオブジェクトとしてログを出力する（extraで渡した項目も含める）"""
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=LOG_LEVEL, log_format=LOG_FORMAT):
+    """ルートロガーにハンドラーを設定する（設定済みの場合はレベルのみ変更する）"""
+    root = logging.getLogger()
+    root.setLevel(level)
+    if any(getattr(handler, "_chatbot_handler", False) for handler in root.handlers):
+        return
+    
+    handler = logging.StreamHandler()
+    handler._chatbot_handler = True
+    if log_format == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root.addHandler(handler)
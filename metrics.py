@@ -0,0 +1,248 @@
+import bisect
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+# 秒単位のヒストグラムの既定のバケット
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTES_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 500 * 1024, 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    """メトリクスを保持し、Prometheusのテキスト形式で出力する"""
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+    
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+    
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    """ラベルの値ごとに値を持つメトリクスの基底クラス（ラベルはキーワード引数で指定する）"""
+    type = None
+    
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # ラベルの値のタプル -> 値
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+    
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _labels(self, key):
+        return list(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    type = "counter"
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+    
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield f"{self.name}_total", self._labels(key), value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+    
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+    
+    @contextlib.contextmanager
+    def track_inprogress(self, **labels):
+        """ブロックの実行中だけ値を1増やす"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+    
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            if index < len(self.buckets):
+                state["buckets"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+    
+    @contextlib.contextmanager
+    def time(self, stage=None, **labels):
+        """ブロックの実行時間（秒）を記録する（stageを指定した場合はリクエストの処理時間の内訳にも加える）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(elapsed, **labels)
+            if stage:
+                record_timing(stage, elapsed)
+    
+    def get_count(self, **labels):
+        state = self.values.get(self._key(labels))
+        return state["count"] if state else 0
+    
+    def samples(self):
+        with self.lock:
+            items = sorted((key, dict(state, buckets=list(state["buckets"]))) for key, state in self.values.items())
+        for key, state in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["buckets"]):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + [("le", _format_value(bound))], cumulative
+            yield f"{self.name}_bucket", labels + [("le", "+Inf")], state["count"]
+            yield f"{self.name}_sum", labels, state["sum"]
+            yield f"{self.name}_count", labels, state["count"]
+
+
+# リクエストごとの処理時間の内訳（段階名 -> 秒）
+# ワーカースレッドで実行する処理にはcontextvars.copy_contextで引き継ぐ
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_timings_lock = threading.Lock()
+
+
+def start_request_timings():
+    """このコンテキストで記録する処理時間の内訳を初期化して返す"""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def record_timing(stage, seconds):
+    """実行中のリクエストの処理時間の内訳に加える（並行して実行された処理は合計される）"""
+    timings = _request_timings.get()
+    if timings is None:
+        return
+    with _timings_lock:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def format_server_timing(timings, total=None):
+    """処理時間の内訳をServer-Timingヘッダーの形式（ミリ秒）にする"""
+    with _timings_lock:
+        items = sorted(timings.items())
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in items]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+# HTTPの取得
+FETCH_SECONDS = Histogram(
+    "chatbot_fetch_seconds", "ページの取得にかかった時間（秒）", ["host", "status"]
+)
+FETCH_RESPONSE_BYTES = Histogram(
+    "chatbot_fetch_response_bytes", "ダウンロードしたレスポンスのサイズ（バイト）", ["host"], buckets=BYTES_BUCKETS
+)
+FETCHES_IN_FLIGHT = Gauge("chatbot_fetches_in_flight", "取得中のリクエスト数")
+CRAWLS_IN_PROGRESS = Gauge("chatbot_crawls_in_progress", "実行中のクロール数", ["mode"])
+
+# 解析
+PARSE_SECONDS = Histogram("chatbot_parse_seconds", "HTMLの解析にかかった時間（秒）", ["pool"])
+
+# キャッシュ
+CACHE_REQUESTS = Counter(
+    "chatbot_cache_requests", "キャッシュの参照回数（result: hit / miss / revalidated）", ["cache", "result"]
+)
+
+# 同時の処理のまとめ
+SINGLEFLIGHT_REQUESTS = Counter(
+    "chatbot_singleflight_requests", "同じ処理をまとめた呼び出しの回数（role: leader / follower）", ["flight", "role"]
+)
+
+# データベース
+DB_QUERY_SECONDS = Histogram("chatbot_db_query_seconds", "データベースの操作にかかった時間（秒）", ["operation"])
+
+# モデル
+MODEL_SECONDS = Histogram("chatbot_model_seconds", "モデルの回答にかかった時間（秒）", ["mode"])
+MODEL_TOKENS = Counter("chatbot_model_tokens", "モデルとやり取りしたおおよそのトークン数", ["kind"])
+MODEL_PROMPT_TOKENS = Histogram(
+    "chatbot_model_prompt_tokens", "1回の送信でモデルに渡したおおよそのトークン数", buckets=TOKEN_BUCKETS
+)
+
+# APIリクエスト
+HTTP_REQUEST_SECONDS = Histogram(
+    "chatbot_http_request_seconds", "APIリクエストの処理時間（秒）", ["method", "path", "status"]
+)
@@ -0,0 +1,163 @@
+import math
+import re
+import hashlib
+from collections import Counter
+
+# ASCIIの単語と、日本語などスペースで区切られない文字の連続を分けて取り出す
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[^\sa-z0-9!-/:-@\[-`{-~、。，．・「」『』（）！？：；]+')
+
+
+def tokenize(text):
+    """テキストを検索用のトークンに分割する（日本語は文字バイグラムで扱う）"""
+    tokens = []
+    for match in TOKEN_PATTERN.findall(text.lower()):
+        if match.isascii():
+            tokens.append(match)
+        elif len(match) == 1:
+            tokens.append(match)
+        else:
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+def chunk_pages(pages, chunk_size=800, chunk_overlap=100):
+    """ページ単位のデータを段落の区切りで検索用のチャンクに分割する"""
+    chunks = []
+    for page in pages:
+        content = page.get("content") or ""
+        
+        # 段落ごとに分け、長すぎる段落はchunk_sizeごとに切り分ける
+        pieces = []
+        for paragraph in re.split(r'\n{2,}', content):
+            paragraph = paragraph.strip()
+            pieces.extend(paragraph[i:i + chunk_size] for i in range(0, len(paragraph), chunk_size))
+        
+        current = ""
+        has_new_text = False
+        for piece in pieces:
+            if has_new_text and len(current) + len(piece) + 2 > chunk_size:
+                chunks.append(_make_chunk(page, current))
+                # 前のチャンクの末尾を重ねて、境界をまたぐ文脈を残す
+                current = current[-chunk_overlap:] if chunk_overlap else ""
+                has_new_text = False
+            current = f"{current}\n\n{piece}" if current else piece
+            has_new_text = True
+        
+        if has_new_text:
+            chunks.append(_make_chunk(page, current))
+    
+    return chunks
+
+
+def _make_chunk(page, text):
+    return {
+        "url": page.get("url", ""),
+        "title": page.get("title", ""),
+        "text": text
+    }
+
+
+class BM25Index:
+    """ローカルで動作するBM25の転置インデックス"""
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # トークン -> [(文書番号, 出現回数)]
+        self.doc_lengths = []
+        self.total_length = 0
+    
+    def add(self, tokens):
+        """文書を追加し、その文書番号を返す"""
+        doc_id = len(self.doc_lengths)
+        for token, count in Counter(tokens).items():
+            self.postings.setdefault(token, []).append((doc_id, count))
+        self.doc_lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        return doc_id
+    
+    def search(self, tokens, k):
+        """クエリのトークンに対するスコア上位k件を(文書番号, スコア)で返す"""
+        doc_count = len(self.doc_lengths)
+        if not doc_count:
+            return []
+        
+        avg_length = self.total_length / doc_count or 1
+        scores = {}
+        for token in set(tokens):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, count in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * count * (self.k1 + 1) / (count + self.k1 * length_norm)
+        
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class HashingEmbedder:
+    """外部サービスを使わない埋め込みの代替（トークンの特徴ハッシュによるベクトル）"""
+    def __init__(self, dimensions=512):
+        self.dimensions = dimensions
+    
+    def embed(self, text):
+        vector = [0.0] * self.dimensions
+        for token in tokenize(text):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+
+class Retriever:
+    """スクレイピングしたページをチャンクに分割し、質問に関連するチャンクを検索する"""
+    def __init__(self, chunk_size=800, chunk_overlap=100, embedder=None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embedder = embedder
+        self.chunks = []
+        self.index = BM25Index()
+        self.vectors = []
+    
+    def build(self, pages):
+        """ページ単位のデータからインデックスを作成する"""
+        self.chunks = []
+        self.index = BM25Index()
+        self.vectors = []
+        self.add_pages(pages)
+        return self
+    
+    def add_pages(self, pages):
+        """インデックスにページを追加する"""
+        for chunk in chunk_pages(pages, self.chunk_size, self.chunk_overlap):
+            # タイトルも検索対象に含める
+            self.index.add(tokenize(f"{chunk['title']}\n{chunk['text']}"))
+            if self.embedder:
+                self.vectors.append(self.embedder.embed(chunk["text"]))
+            self.chunks.append(chunk)
+    
+    def search(self, query, k=5):
+        """クエリに関連するチャンクを上位k件まで返す"""
+        if not self.chunks:
+            return []
+        
+        lexical = self.index.search(tokenize(query), k * 2)
+        if not self.embedder:
+            return [self.chunks[doc_id] for doc_id, _ in lexical[:k]]
+        
+        # 語彙検索とベクトル検索の順位をReciprocal Rank Fusionで統合する
+        query_vector = self.embedder.embed(query)
+        similarities = sorted(
+            ((doc_id, sum(a * b for a, b in zip(query_vector, vector))) for doc_id, vector in enumerate(self.vectors)),
+            key=lambda item: item[1],
+            reverse=True
+        )[:k * 2]
+        
+        fused = {}
+        for ranking in (lexical, similarities):
+            for rank, (doc_id, _) in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (60 + rank)
+        
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [self.chunks[doc_id] for doc_id, _ in ranked]
@@ -0,0 +1,164 @@
+import logging
+import threading
+import time
+import urllib.robotparser
+from urllib.parse import urlsplit
+
+import requests
+
+from config import ROBOTS_CACHE_TTL, ROBOTS_ERROR_TTL, ROBOTS_TIMEOUT
+from metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+def robots_origin(url):
+    """robots.txtの単位となるオリジン（スキーム://ホスト）を返す"""
+    parts = urlsplit(url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+class RobotsEntry:
+    """オリジンごとのrobots.txtの解析結果
+    
+    status_codeがNoneの場合は取得に失敗したことを表し、すべてのURLへのアクセスを許可する
+    （期限が短いネガティブキャッシュとして扱う）。
+    """
+    def __init__(self, origin, status_code, content, expires_at):
+        self.origin = origin
+        self.status_code = status_code
+        self.content = content
+        self.expires_at = expires_at
+        
+        self.parser = urllib.robotparser.RobotFileParser(f"{origin}/robots.txt")
+        if status_code in (401, 403):
+            # 認証が必要なrobots.txtはサイト全体へのアクセス禁止として扱う（RobotFileParser.readと同じ）
+            self.parser.disallow_all = True
+        elif status_code is not None and 200 <= status_code < 300 and content:
+            self.parser.parse(content.splitlines())
+        else:
+            self.parser.allow_all = True
+    
+    def is_expired(self):
+        return time.time() >= self.expires_at
+    
+    def can_fetch(self, user_agent, url):
+        return self.parser.can_fetch(user_agent, url)
+    
+    def crawl_delay(self, user_agent):
+        """Crawl-delayの値（秒）を返す（指定がない場合は0）"""
+        try:
+            delay = self.parser.crawl_delay(user_agent)
+        except (TypeError, ValueError):
+            return 0
+        return float(delay) if delay else 0
+    
+    def sitemaps(self):
+        """robots.txtのSitemap行に記載されたURLのリスト"""
+        return list(self.parser.site_maps() or [])
+
+
+class RobotsCache:
+    """robots.txtをプロセス全体で共有するキャッシュ
+    
+    取得したrobots.txtは有効期限（ttl秒）まで再利用し、db_managerを渡した場合は
+    SQLiteにも保存して再起動後やほかのプロセスからも利用する。
+    取得に失敗した場合も、error_ttl秒の間は再取得せずにアクセスを許可する。
+    """
+    def __init__(self, ttl=ROBOTS_CACHE_TTL, error_ttl=ROBOTS_ERROR_TTL, timeout=ROBOTS_TIMEOUT):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.timeout = timeout
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.fetch_locks = {}  # 同じオリジンのrobots.txtを複数のスレッドから同時に取得しないためのロック
+    
+    def get_cached(self, url):
+        """URLのオリジンのrobots.txtがメモリにあれば返す（ない場合はNone。SQLiteやサイトからは取得しない）"""
+        entry = self._get_cached(robots_origin(url))
+        if entry:
+            CACHE_REQUESTS.inc(cache="robots", result="hit")
+        return entry
+    
+    def get(self, url, user_agent, session=None, db_manager=None):
+        """URLのオリジンのrobots.txtを取得する（メモリ、SQLite、サイトの順に参照する）"""
+        entry = self.get_cached(url)
+        if entry:
+            return entry
+        
+        origin = robots_origin(url)
+        with self.lock:
+            fetch_lock = self.fetch_locks.setdefault(origin, threading.Lock())
+        
+        with fetch_lock:
+            # 待機中にほかのスレッドが取得した場合はそれを使用する
+            entry = self._get_cached(origin)
+            if entry:
+                CACHE_REQUESTS.inc(cache="robots", result="hit")
+                return entry
+            
+            entry = self._load(origin, db_manager)
+            CACHE_REQUESTS.inc(cache="robots", result="hit" if entry else "miss")
+            if entry is None:
+                entry = self._fetch(origin, user_agent, session, db_manager)
+            with self.lock:
+                self.entries[origin] = entry
+            return entry
+    
+    def _get_cached(self, origin):
+        with self.lock:
+            entry = self.entries.get(origin)
+        if entry and not entry.is_expired():
+            return entry
+        return None
+    
+    def _load(self, origin, db_manager):
+        """SQLiteに保存された有効期限内のrobots.txtを読み込む"""
+        if db_manager is None:
+            return None
+        
+        row = db_manager.get_robots_txt(origin)
+        if not row:
+            return None
+        return RobotsEntry(origin, row["status_code"], row["content"], row["expire_time"].timestamp())
+    
+    def _fetch(self, origin, user_agent, session, db_manager):
+        """サイトからrobots.txtを取得する（失敗した場合はネガティブキャッシュとして扱う）"""
+        robots_url = f"{origin}/robots.txt"
+        try:
+            response = (session or requests).get(
+                robots_url,
+                headers={'User-Agent': user_agent},
+                timeout=self.timeout
+            )
+            status_code, content = response.status_code, response.text
+            # サーバーエラーは一時的な失敗として扱い、短い期間で再取得する
+            if status_code >= 500:
+                logger.warning("robots.txtの取得に失敗しました: %s (HTTP %s)", robots_url, status_code)
+                status_code, content = None, None
+        except requests.RequestException as e:
+            logger.warning("robots.txtの確認中にエラーが発生しました: %s (%s)", robots_url, e)
+            status_code, content = None, None
+        
+        ttl = self.error_ttl if status_code is None else self.ttl
+        if db_manager is not None:
+            db_manager.save_robots_txt(origin, status_code, content, ttl)
+        return RobotsEntry(origin, status_code, content, time.time() + ttl)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# プロセス全体で共有するrobots.txtのキャッシュ
+_robots_cache = None
+_robots_cache_lock = threading.Lock()
+
+
+def get_robots_cache():
+    """プロセス全体で共有するrobots.txtのキャッシュを取得する"""
+    global _robots_cache
+    with _robots_cache_lock:
+        if _robots_cache is None:
+            _robots_cache = RobotsCache()
+        return _robots_cache
@@ -1,21 +1,161 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-import html2text
-from config import TARGET_WEBSITE_URL
+from config import (
+    TARGET_WEBSITE_URL,
+    CRAWL_ASYNC,
+    CRAWL_CONCURRENCY,
+    CRAWL_PER_HOST_CONCURRENCY,
+    CRAWL_HOST_DELAY,
+    HTTP_POOL_SIZE,
+    HTTP_MAX_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    HTML_EXTRACTOR,
+    PARSE_PROCESSES,
+    PARSE_POOL_MIN_PAGES,
+    CRAWL_INCLUDE_PATTERNS,
+    CRAWL_EXCLUDE_PATTERNS,
+    CRAWL_USE_SITEMAP,
+    ROBOTS_MAX_CRAWL_DELAY,
+)
 import time
-import re
-from urllib.parse import urljoin, urlparse
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import multiprocessing
+import threading
+from urllib.parse import urlparse
 from db_manager import DBManager
-import urllib.robotparser
+from extractor import extract_page
+from url_filter import URLFilter, url_key
+from robots import get_robots_cache, robots_origin
+from sitemap import discover_sitemaps, fetch_sitemap_entries, parse_lastmod, prioritize_entries
+from metrics import (
+    FETCH_SECONDS,
+    FETCH_RESPONSE_BYTES,
+    FETCHES_IN_FLIGHT,
+    CRAWLS_IN_PROGRESS,
+    PARSE_SECONDS,
+    CACHE_REQUESTS,
+    record_timing,
+)
+
+try:
+    import httpx
+except ImportError:  # httpxがない環境では同期クロールのみ使用する
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+def _run_coroutine(coro):
+    """コルーチンを同期的に実行する（イベントループ内から呼ばれた場合は別スレッドで実行）"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    
+    # リクエストごとの処理時間の内訳を記録できるように、呼び出し元のコンテキストを引き継ぐ
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
+
+class _HostThrottle:
+    """ホストごとの同時接続数とリクエスト間隔を制限する"""
+    def __init__(self, per_host_concurrency, delay):
+        self.per_host_concurrency = per_host_concurrency
+        self.delay = delay
+        self.delays = {}  # robots.txtのCrawl-delayなど、ホストごとのリクエスト間隔
+        self.semaphores = {}
+        self.locks = {}
+        self.next_request_time = {}
+    
+    def semaphore(self, host):
+        if host not in self.semaphores:
+            self.semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self.semaphores[host]
+    
+    async def wait(self, host):
+        """同じホストへの前回のリクエストから一定時間が経過するまで待機する"""
+        delay = self.delays.get(host, self.delay)
+        if delay <= 0:
+            return
+        lock = self.locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            wait_time = self.next_request_time.get(host, 0) - now
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+                now = loop.time()
+            self.next_request_time[host] = now + delay
+
+
+# HTMLの解析を行うプロセスプール（プロセス全体で共有し、最初に使われたときに作成する）
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def get_parse_pool(processes):
+    """HTMLの解析用のプロセスプールを取得する"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # スレッドを使うサーバーのプロセスをforkしないよう、spawnで起動する
+            _parse_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _parse_pool
+
+
+def shutdown_parse_pool():
+    """HTMLの解析用のプロセスプールを停止する（次に使われたときに再作成される）"""
+    global _parse_pool
+    with _parse_pool_lock:
+        pool, _parse_pool = _parse_pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# 再試行の対象とするHTTPステータスコード
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def assemble_site_content(pages):
+    """ページ単位のデータからサイト全体のコンテンツを組み立てる（先頭がメインページ）"""
+    if not pages:
+        return ""
+    
+    all_content = pages[0]['content']
+    for page in pages[1:]:
+        all_content += f"\n\n--- サブページ: {page['title']} ({page['url']}) ---\n"
+        all_content += page['content']
+    return all_content
+
 
 class WebScraper:
-    def __init__(self, url=None, use_cache=True, cache_expire_days=7, respect_robots_txt=True):
+    def __init__(self, url=None, use_cache=True, cache_expire_days=7, respect_robots_txt=True,
+                 use_async=CRAWL_ASYNC, max_concurrency=CRAWL_CONCURRENCY,
+                 per_host_concurrency=CRAWL_PER_HOST_CONCURRENCY, host_delay=CRAWL_HOST_DELAY,
+                 pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES,
+                 backoff_factor=HTTP_BACKOFF_FACTOR, extractor=HTML_EXTRACTOR,
+                 parse_processes=PARSE_PROCESSES, parse_pool_min_pages=PARSE_POOL_MIN_PAGES,
+                 include_patterns=CRAWL_INCLUDE_PATTERNS, exclude_patterns=CRAWL_EXCLUDE_PATTERNS,
+                 use_sitemap=CRAWL_USE_SITEMAP):
         self.url = url or TARGET_WEBSITE_URL
-        self.converter = html2text.HTML2Text()
-        self.converter.ignore_links = False
-        self.converter.ignore_images = True
-        self.converter.body_width = 0  # 行の折り返しを無効化
-        self.visited_urls = set()  # 訪問済みURLを記録
+        self.extractor = extractor  # 本文の抽出方法（fast: lxmlによる一回の走査 / legacy: 従来の抽出処理）
+        self.visited_urls = set()  # 訪問済みURLを記録（正規化したURLをキーとする）
+        
+        # リンクの正規化とクロール対象の絞り込み（include/excludeはURLのパスに対するglobパターン）
+        self.url_filter = URLFilter(include_patterns, exclude_patterns)
+        self.from_cache = False  # 直近のスクレイピング結果がキャッシュから読み込まれたかどうか
+        
+        # クロールの進捗（バックグラウンドのクロールジョブから参照される）と中断要求
+        self.crawl_stats = self._new_crawl_stats()
+        self.cancel_event = None
         
         # キャッシュ設定
         self.use_cache = use_cache
@@ -24,192 +164,276 @@ class WebScraper:
         
         # robots.txt設定
         self.respect_robots_txt = respect_robots_txt
-        self.rp = urllib.robotparser.RobotFileParser()
-        self.robots_cache = {}  # ドメインごとのrobots.txtキャッシュ
+        self.robots_cache = get_robots_cache()  # プロセス全体で共有し、SQLiteにも保存するrobots.txtのキャッシュ
+        self.max_crawl_delay = ROBOTS_MAX_CRAWL_DELAY
+        self.use_sitemap = use_sitemap  # サイトマップのURLからクロールを始め、リンクをたどらない
         self.user_agent = 'Mozilla/5.0 (compatible; ChatBotAgent/1.0)'
         
+        # 非同期クロール設定（httpxがない場合は同期クロールにフォールバック）
+        self.use_async = use_async and httpx is not None
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.host_delay = host_delay
+        
+        # 非同期クロールでHTMLの解析をプロセスプールで行う設定（0の場合はこのプロセスで解析する）
+        # max_pagesがparse_pool_min_pages未満のクロールでは、プロセス間のやり取りを避けてこのプロセスで解析する
+        self.parse_processes = parse_processes
+        self.parse_pool_min_pages = parse_pool_min_pages
+        
+        # HTTP接続設定（Keep-Aliveで接続を再利用し、一時的なエラーは再試行する）
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = self._create_session()
+        
+    def _new_crawl_stats(self):
+        """クロールの進捗を記録する辞書を作成する"""
+        return {
+            "pages_fetched": 0,
+            "pages_skipped": 0,
+            "queue_depth": 0,
+            "bytes_downloaded": 0,
+            "errors": 0
+        }
+    
+    def is_cancelled(self):
+        """クロールの中断が要求されているかどうか"""
+        return self.cancel_event is not None and self.cancel_event.is_set()
+    
+    def _create_session(self):
+        """接続プールと再試行ポリシーを持つセッションを作成する"""
+        session = requests.Session()
+        session.headers.update({'User-Agent': self.user_agent})
+        
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=["GET", "HEAD"],
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            max_retries=retry
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
     def check_robots_txt(self, url):
         """robots.txtをチェックして、URLへのアクセスが許可されているかを確認する"""
         if not self.respect_robots_txt:
             return True
-            
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc
-        
-        # 同じドメインのrobots.txtを既に確認済みの場合はキャッシュを使用
-        if domain in self.robots_cache:
-            return self.robots_cache[domain].can_fetch(self.user_agent, url)
-            
-        # robots.txtのURLを構築
-        robots_url = f"{parsed_url.scheme}://{domain}/robots.txt"
-        
-        try:
-            # robots.txtを取得して解析
-            rp = urllib.robotparser.RobotFileParser()
-            rp.set_url(robots_url)
-            rp.read()
-            
-            # キャッシュに保存
-            self.robots_cache[domain] = rp
-            
-            # アクセスが許可されているかチェック
-            allowed = rp.can_fetch(self.user_agent, url)
-            if not allowed:
-                print(f"robots.txtによりアクセスが禁止されています: {url}")
-            return allowed
-            
-        except Exception as e:
-            print(f"robots.txtの確認中にエラーが発生しました: {e}")
-            # エラーが発生した場合は許可されていると仮定
-            return True
         
+        # robots.txtの取得に失敗した場合は許可されていると仮定する
+        return self._robots_entry(url).can_fetch(self.user_agent, url)
+    
+    def _robots_entry(self, url):
+        """URLのオリジンのrobots.txtを共有キャッシュから取得する"""
+        return self.robots_cache.get(url, self.user_agent, self.session, self.db_manager)
+    
+    async def _robots_entry_async(self, url):
+        """_robots_entryの非同期版（メモリにない場合は、イベントループを塞がないようにワーカースレッドで取得する）"""
+        entry = self.robots_cache.get_cached(url)
+        if entry is None:
+            loop = asyncio.get_running_loop()
+            entry = await loop.run_in_executor(None, contextvars.copy_context().run, self._robots_entry, url)
+        return entry
+    
+    def crawl_delay(self, url):
+        """robots.txtのCrawl-delayで指定されたリクエスト間隔（秒）を返す（上限はmax_crawl_delay）"""
+        if not self.respect_robots_txt:
+            return 0
+        return min(self._robots_entry(url).crawl_delay(self.user_agent), self.max_crawl_delay)
+    
+    def discover_sitemap_urls(self, url, max_urls=None):
+        """サイトマップに記載されたクロール対象のURLを取得する（サイトマップがない場合は空のリスト）"""
+        robots_entry = self._robots_entry(url) if self.respect_robots_txt else None
+        entries = fetch_sitemap_entries(
+            discover_sitemaps(url, robots_entry),
+            session=self.session,
+            max_urls=max_urls,
+            normalize=lambda loc: self.url_filter.normalize(loc, url)
+        )
+        return [entry["url"] for entry in entries]
+    
     def fetch_content(self, url=None):
         """指定されたURLからウェブページの内容を取得する"""
         target_url = url or self.url
         
+        response = self._send_request(target_url)
+        if response is None or response.status_code == 304:
+            return None
+        return response.text
+    
+    def _send_request(self, url, headers=None):
+        """プール済みのセッションでGETリクエストを送信する"""
         # robots.txtをチェック
-        if not self.check_robots_txt(target_url):
-            print(f"robots.txtによりアクセスが禁止されているため、コンテンツを取得しません: {target_url}")
+        if not self.check_robots_txt(url):
+            logger.info("robots.txtによりアクセスが禁止されているため、コンテンツを取得しません: %s", url)
             return None
         
+        started = time.perf_counter()
+        status = "error"
         try:
-            headers = {
-                'User-Agent': self.user_agent
-            }
-            response = requests.get(target_url, headers=headers, timeout=10)
+            with FETCHES_IN_FLIGHT.track_inprogress():
+                response = self.session.get(url, headers=headers, timeout=10)
+            status = response.status_code
             response.raise_for_status()
-            return response.text
+            return response
         except requests.RequestException as e:
-            print(f"エラー: コンテンツの取得に失敗しました: {e}")
+            logger.warning("コンテンツの取得に失敗しました: %s (%s)", url, e)
+            self.crawl_stats["errors"] += 1
             return None
+        finally:
+            self._observe_fetch(url, status, time.perf_counter() - started)
     
-    def parse_html(self, html_content):
-        """HTMLコンテンツをパースして必要な情報を抽出する"""
-        if not html_content:
+    async def _send_request_async(self, client, url, semaphore, throttle, headers=None):
+        """非同期クライアントでGETリクエストを送信する"""
+        if self.respect_robots_txt:
+            robots_entry = await self._robots_entry_async(url)
+            if not robots_entry.can_fetch(self.user_agent, url):
+                logger.info("robots.txtによりアクセスが禁止されているため、コンテンツを取得しません: %s", url)
+                return None
+        
+        host = urlparse(url).netloc
+        if host not in throttle.delays:
+            # robots.txtは取得済みのため、Crawl-delayの確認でイベントループを塞がない
+            throttle.delays[host] = max(throttle.delay, self.crawl_delay(url))
+        async with semaphore, throttle.semaphore(host):
+            for attempt in range(self.max_retries + 1):
+                # グローバルな待機の代わりにホスト単位でリクエスト間隔を空ける
+                await throttle.wait(host)
+                started = time.perf_counter()
+                status = "error"
+                try:
+                    with FETCHES_IN_FLIGHT.track_inprogress():
+                        response = await client.get(url, headers=headers)
+                    status = response.status_code
+                    if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                        self._observe_fetch(url, status, time.perf_counter() - started)
+                        await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+                        continue
+                    if response.status_code != 304:
+                        response.raise_for_status()
+                    self._observe_fetch(url, status, time.perf_counter() - started)
+                    return response
+                except httpx.HTTPError as e:
+                    self._observe_fetch(url, status, time.perf_counter() - started)
+                    logger.warning("コンテンツの取得に失敗しました: %s (%s)", url, e)
+                    self.crawl_stats["errors"] += 1
+                    return None
+    
+    def _observe_fetch(self, url, status, elapsed):
+        """リクエストの所要時間をホスト・ステータスコードごとに記録する"""
+        FETCH_SECONDS.observe(elapsed, host=urlparse(url).netloc, status=status)
+        record_timing("fetch", elapsed)
+    
+    def _count_download(self, url, response):
+        size = len(response.content)
+        self.crawl_stats["bytes_downloaded"] += size
+        FETCH_RESPONSE_BYTES.observe(size, host=urlparse(url).netloc)
+    
+    def _count_cache(self, cache, result):
+        """キャッシュの参照結果（hit / miss / revalidated）を記録する"""
+        if self.use_cache and self.db_manager:
+            CACHE_REQUESTS.inc(cache=cache, result=result)
+    
+    def _get_cached_page(self, url):
+        """条件付きGETのためにキャッシュ済みのページを取得する（コンテンツは再利用する時点で読み込む）"""
+        if not (self.use_cache and self.db_manager):
             return None
-            
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        # タイトルを取得
-        title = soup.title.text if soup.title else "タイトルなし"
-        
-        # メタデータの抽出
-        meta_description = ""
-        meta_tag = soup.find("meta", attrs={"name": "description"})
-        if meta_tag and meta_tag.get("content"):
-            meta_description = meta_tag.get("content")
-        
-        # 不要なタグを削除
-        for tag in soup.find_all(['script', 'style', 'noscript', 'iframe', 'svg']):
-            tag.decompose()
-        
-        # メインコンテンツの抽出（複数の方法を試す）
-        content_text = ""
-        
-        # 1. articleタグを探す
-        articles = soup.find_all('article')
-        if articles:
-            for article in articles:
-                content_text += self.converter.handle(str(article)) + "\n\n"
-        
-        # 2. mainタグを探す
-        main_content = soup.find('main')
-        if main_content:
-            content_text += self.converter.handle(str(main_content)) + "\n\n"
-        
-        # 3. contentクラスを持つ要素を探す
-        content_elements = soup.find_all(class_=re.compile('(content|main|article)'))
-        if content_elements:
-            for element in content_elements:
-                content_text += self.converter.handle(str(element)) + "\n\n"
-        
-        # 4. セクションやdivを探す
-        sections = soup.find_all(['section', 'div'])
-        if sections and not content_text:
-            for section in sections:
-                # クラス名に基づいて重要なセクションを判断
-                class_name = section.get('class', [])
-                class_str = ' '.join(class_name).lower() if class_name else ''
-                if any(keyword in class_str for keyword in ['content', 'main', 'article', 'body', 'text']):
-                    content_text += self.converter.handle(str(section)) + "\n\n"
-        
-        # 5. ヘッダー情報を取得
-        headers = soup.find_all(['h1', 'h2', 'h3'])
-        header_text = ""
-        for header in headers:
-            header_text += header.text + "\n"
-        
-        # 6. リンクテキストを収集（ナビゲーションなどの情報を取得するため）
-        nav = soup.find('nav')
-        nav_text = ""
-        if nav:
-            links = nav.find_all('a')
-            for link in links:
-                if link.text.strip():
-                    nav_text += link.text.strip() + "\n"
-        
-        # 十分なコンテンツが取得できなかった場合は、bodyから直接取得
-        if not content_text:
-            # ヘッダーとフッターを除外
-            header_tag = soup.find('header')
-            if header_tag:
-                header_tag.extract()
-                
-            footer = soup.find('footer')
-            if footer:
-                footer.extract()
-                
-            nav = soup.find('nav')
-            if nav:
-                nav.extract()
-                
-            content_text = self.converter.handle(str(soup.body))
-        
-        # 最終的なコンテンツを組み合わせる
-        final_content = ""
-        if meta_description:
-            final_content += f"サイト概要: {meta_description}\n\n"
-        
-        if header_text:
-            final_content += f"主要見出し:\n{header_text}\n\n"
-        
-        if nav_text:
-            final_content += f"ナビゲーションメニュー:\n{nav_text}\n\n"
-        
-        final_content += content_text
-        
-        # 重複する改行を削除
-        final_content = re.sub(r'\n{3,}', '\n\n', final_content)
-        
+        return self.db_manager.get_page(url, include_content=False)
+    
+    def _conditional_headers(self, cached_page):
+        """キャッシュ済みページのETag/Last-Modifiedから条件付きGETのヘッダーを作成する"""
+        headers = {}
+        if cached_page:
+            if cached_page.get("etag"):
+                headers["If-None-Match"] = cached_page["etag"]
+            if cached_page.get("last_modified"):
+                headers["If-Modified-Since"] = cached_page["last_modified"]
+        return headers
+    
+    def _page_from_cache(self, url, cached_page):
+        """キャッシュ済みのページ情報をクロール用のページ情報に変換する"""
+        content = cached_page.get("content")
+        if content is None:
+            content = self.db_manager.get_page_content(url)
         return {
-            "title": title,
-            "content": final_content,
-            "url": self.url
+            "title": cached_page["title"],
+            "content": content,
+            "url": url,
+            "links": cached_page["links"]
         }
     
-    def is_valid_url(self, url, base_url):
-        """URLが有効かどうかを判断する"""
-        # 完全なURLに変換
-        full_url = urljoin(base_url, url)
-        
-        # URLのパース
-        parsed = urlparse(full_url)
-        
-        # 同じドメインかどうか確認
-        base_domain = urlparse(base_url).netloc
-        url_domain = parsed.netloc
+    def _site_from_cache(self, cached_data):
+        """キャッシュ済みのサイトデータを返却用の形式に変換する"""
+        pages = cached_data.get("pages") or []
+        content = cached_data["content"]
+        if content is None:
+            content = assemble_site_content(pages)
+        return {
+            "title": cached_data["title"],
+            "content": content,
+            "url": cached_data["url"],
+            "pages": pages
+        }
+    
+    def _handle_response(self, url, response, cached_page):
+        """レスポンスをページ情報に変換し、キャッシュを更新する"""
+        if response is None:
+            return None
         
-        # 画像、PDF、CSSなどのリソースは除外
-        excluded_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.pdf', '.css', '.js', '.ico', '.svg', '.xml', '.json']
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
         
-        # 条件チェック
-        is_same_domain = url_domain == base_domain
-        is_not_resource = not any(full_url.lower().endswith(ext) for ext in excluded_extensions)
-        is_not_anchor = not (parsed.path == '' and parsed.fragment != '')
-        is_not_mailto = not full_url.startswith('mailto:')
-        is_not_tel = not full_url.startswith('tel:')
+        # 304の場合は再ダウンロード・再パースせずにキャッシュ済みの内容を使用
+        if response.status_code == 304:
+            if not cached_page:
+                return None
+            self.db_manager.touch_page(url, etag, last_modified, self.cache_expire_days)
+            return self._page_from_cache(url, cached_page)
         
-        return is_same_domain and is_not_resource and is_not_anchor and is_not_mailto and is_not_tel
+        self._count_download(url, response)
+        page = self.process_page(response.text, url)
+        self._save_page(url, response, page)
+        return page
+    
+    async def _handle_response_async(self, url, response, cached_page, parse_pool=None):
+        """レスポンスをページ情報に変換し、キャッシュを更新する（解析はプロセスプールで行う）"""
+        if response is None or response.status_code == 304 or parse_pool is None:
+            return self._handle_response(url, response, cached_page)
+        
+        self._count_download(url, response)
+        page = await self.process_page_async(response.text, url, parse_pool)
+        self._save_page(url, response, page)
+        return page
+    
+    def _save_page(self, url, response, page):
+        """取得したページを再検証用のヘッダー値とともにキャッシュに保存する"""
+        if page and self.use_cache and self.db_manager:
+            self.db_manager.save_page(
+                url,
+                page["title"],
+                page["content"],
+                page["links"],
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                self.cache_expire_days
+            )
+    
+    def parse_html(self, html_content):
+        """HTMLコンテンツをパースして必要な情報を抽出する"""
+        page = extract_page(html_content, self.url, self.extractor)
+        if page:
+            del page["hrefs"]
+        return page
+    
+    def is_valid_url(self, url, base_url):
+        """URLが有効かどうかを判断する"""
+        return self.url_filter.normalize(url, base_url) is not None
     
     def scrape(self, url=None):
         """ウェブページをスクレイピングして情報を返す"""
@@ -219,20 +443,19 @@ class WebScraper:
         # キャッシュを使用する場合、キャッシュをチェック
         if self.use_cache and self.db_manager:
             cached_data = self.db_manager.get_scraped_data(target_url)
+            self._count_cache("site", "hit" if cached_data else "miss")
             if cached_data:
-                print(f"キャッシュからデータを読み込みました: {target_url}")
-                return {
-                    "title": cached_data["title"],
-                    "content": cached_data["content"],
-                    "url": cached_data["url"]
-                }
+                logger.info("キャッシュからデータを読み込みました: %s", target_url)
+                self.from_cache = True
+                return self._site_from_cache(cached_data)
         
         # robots.txtをチェック
         if not self.check_robots_txt(target_url):
-            print(f"robots.txtによりアクセスが禁止されています: {target_url}")
+            logger.info("robots.txtによりアクセスが禁止されています: %s", target_url)
             return None
         
         # キャッシュにない場合は新たに取得
+        self.from_cache = False
         html_content = self.fetch_content(target_url)
         return self.parse_html(html_content)
     
@@ -242,53 +465,206 @@ class WebScraper:
             return []
         
         soup = BeautifulSoup(html_content, 'html.parser')
-        links = []
+        return self._filter_links([a_tag['href'] for a_tag in soup.find_all('a', href=True)], base_url)
+    
+    def _filter_links(self, hrefs, base_url):
+        """aタグのhref属性の値からクロール対象のリンクを選ぶ（正規化したURLで重複を削除し、ページ内での順序は保つ）"""
+        links = self.url_filter.filter_links(hrefs, base_url)
         
-        # aタグからリンクを抽出
-        for a_tag in soup.find_all('a', href=True):
-            href = a_tag['href']
-            if self.is_valid_url(href, base_url):
-                full_url = urljoin(base_url, href)
-                # robots.txtをチェック
-                if self.respect_robots_txt and not self.check_robots_txt(full_url):
-                    continue
-                links.append(full_url)
+        # robots.txtをチェック
+        if self.respect_robots_txt:
+            links = [link for link in links if self.check_robots_txt(link)]
+        return links
+    
+    def process_page(self, html_content, page_url):
+        """一つのパース結果からコンテンツとリンクの両方を取り出す"""
+        if not html_content:
+            return None
+        
+        with PARSE_SECONDS.time(stage="parse", pool="inline"):
+            return self._page_from_extracted(extract_page(html_content, page_url, self.extractor), page_url)
+    
+    async def process_page_async(self, html_content, page_url, parse_pool):
+        """プロセスプールでHTMLを解析し、コンテンツとリンクを取り出す
+        
+        解析の完了を待つ間もイベントループは他のページの取得を続ける
+        """
+        if not html_content:
+            return None
         
-        # 重複を削除
-        return list(set(links))
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            extracted = await loop.run_in_executor(parse_pool, extract_page, html_content, page_url, self.extractor)
+        except concurrent.futures.process.BrokenProcessPool:
+            logger.warning("解析用のプロセスが停止したため、このプロセスで解析します: %s", page_url)
+            shutdown_parse_pool()
+            return self.process_page(html_content, page_url)
+        
+        # プロセスプールでの待ち時間を含む
+        elapsed = time.perf_counter() - started
+        PARSE_SECONDS.observe(elapsed, pool="process")
+        record_timing("parse", elapsed)
+        
+        extracted["links"] = await self._filter_links_async(extracted.pop("hrefs"), page_url)
+        return extracted
     
-    def scrape_with_subpages(self, url=None, max_pages=10, max_depth=2):
-        """メインページとサブページをスクレイピングする"""
+    async def _filter_links_async(self, hrefs, base_url):
+        """_filter_linksの非同期版（リンク先のオリジンのrobots.txtを先に取得し、確認でイベントループを塞がない）"""
+        links = self.url_filter.filter_links(hrefs, base_url)
+        if self.respect_robots_txt:
+            for origin in {robots_origin(link) for link in links}:
+                await self._robots_entry_async(origin)
+            links = [link for link in links if self.check_robots_txt(link)]
+        return links
+    
+    def _page_from_extracted(self, page, page_url):
+        """抽出結果のリンクをクロール対象に絞り込む（robots.txtの確認はこのプロセスで行う）"""
+        page["links"] = self._filter_links(page.pop("hrefs"), page_url)
+        return page
+    
+    def fetch_page(self, url, revalidate=False):
+        """ページを一度だけ取得してコンテンツとリンクを返す
+
+        有効期限内のキャッシュはそのまま再利用し、期限切れ（またはrevalidate=True）の場合は
+        条件付きGETで再検証する
+        """
+        cached_page = self._get_cached_page(url)
+        if cached_page and not cached_page["expired"] and not revalidate:
+            self._count_cache("page", "hit")
+            page = self._page_from_cache(url, cached_page)
+        else:
+            response = self._send_request(url, self._conditional_headers(cached_page))
+            self._count_cache("page", self._revalidation_result(response, cached_page))
+            page = self._handle_response(url, response, cached_page)
+        
+        if page:
+            self.crawl_stats["pages_fetched"] += 1
+        return page
+    
+    async def fetch_page_async(self, client, url, semaphore, throttle, revalidate=False, parse_pool=None):
+        """非同期クライアントでページを一度だけ取得してコンテンツとリンクを返す"""
+        cached_page = self._get_cached_page(url)
+        if cached_page and not cached_page["expired"] and not revalidate:
+            self._count_cache("page", "hit")
+            page = self._page_from_cache(url, cached_page)
+        else:
+            response = await self._send_request_async(
+                client, url, semaphore, throttle, self._conditional_headers(cached_page)
+            )
+            self._count_cache("page", self._revalidation_result(response, cached_page))
+            page = await self._handle_response_async(url, response, cached_page, parse_pool)
+        
+        if page:
+            self.crawl_stats["pages_fetched"] += 1
+        return page
+    
+    def _revalidation_result(self, response, cached_page):
+        """条件付きGETでキャッシュ済みのページを再利用できた場合はrevalidated、それ以外はmiss"""
+        if cached_page and response is not None and response.status_code == 304:
+            return "revalidated"
+        return "miss"
+    
+    def scrape_with_subpages(self, url=None, max_pages=10, max_depth=2, use_async=None, force_refresh=False,
+                             cancel_event=None, use_sitemap=None, on_page=None):
+        """メインページとサブページをスクレイピングする
+
+        サイト単位のキャッシュが期限切れの場合は、有効期限内のページを再利用し、
+        期限切れのページのみを条件付きGETで再取得する。
+        force_refresh=Trueの場合はすべてのページを条件付きGETで再検証する。
+        cancel_event（threading.Event）がセットされるとクロールを中断し、Noneを返す
+        on_pageを指定した場合は、クロール中にページを取得するたびにページ情報を渡して呼び出す
+        （メインページが最初。キャッシュから読み込んだ場合は呼び出さない）
+        """
         target_url = url or self.url
+        self.crawl_stats = self._new_crawl_stats()
+        self.cancel_event = cancel_event
         
         # キャッシュを使用する場合、キャッシュをチェック
-        if self.use_cache and self.db_manager:
+        if self.use_cache and self.db_manager and not force_refresh:
             cached_data = self.db_manager.get_scraped_data(target_url)
+            self._count_cache("site", "hit" if cached_data else "miss")
             if cached_data:
-                print(f"キャッシュからデータを読み込みました: {target_url} ({cached_data['pages_count']}ページ)")
+                logger.info("キャッシュからデータを読み込みました: %s (%dページ)", target_url, cached_data['pages_count'])
                 self.visited_urls = set(cached_data["visited_urls"])
-                return {
-                    "title": cached_data["title"],
-                    "content": cached_data["content"],
-                    "url": cached_data["url"]
-                }
+                self.from_cache = True
+                return self._site_from_cache(cached_data)
         
         # robots.txtをチェック
         if not self.check_robots_txt(target_url):
-            print(f"robots.txtによりアクセスが禁止されています: {target_url}")
+            logger.info("robots.txtによりアクセスが禁止されています: %s", target_url)
             return None
         
         # キャッシュにない場合は新たに取得
+        self.from_cache = False
+        if use_async is None:
+            use_async = self.use_async
+        
+        # サイトマップがある場合は、そのURLをクロール対象としてリンクの探索を省略する
+        seed_urls = None
+        if use_sitemap is None:
+            use_sitemap = self.use_sitemap
+        if use_sitemap:
+            seed_urls = self.discover_sitemap_urls(target_url, max_pages) or None
+            if seed_urls:
+                logger.info("サイトマップから%d件のURLを取得しました: %s", len(seed_urls), target_url)
+        
+        with CRAWLS_IN_PROGRESS.track_inprogress(mode="links"):
+            if use_async and httpx is not None:
+                main_data = _run_coroutine(
+                    self._crawl_async(target_url, max_pages, max_depth, force_refresh, seed_urls, on_page)
+                )
+            else:
+                main_data = self._crawl_sync(target_url, max_pages, max_depth, force_refresh, seed_urls, on_page)
+        
+        self.crawl_stats["queue_depth"] = 0
+        
+        if self.is_cancelled():
+            logger.info("クロールが中断されました: %s", target_url)
+            return None
+        
+        if not main_data:
+            return None
+        
+        logger.info("合計 %d ページをスクレイピングしました: %s", len(self.visited_urls), target_url)
+        
+        # キャッシュに保存
+        if self.use_cache and self.db_manager:
+            self.db_manager.save_scraped_data(
+                target_url,
+                main_data['title'],
+                main_data['content'],
+                list(self.visited_urls),
+                self.cache_expire_days,
+                page_urls=[page['url'] for page in main_data['pages']]
+            )
+            logger.info("データをキャッシュに保存しました: %s", target_url)
+        
+        return main_data
+    
+    def _crawl_sync(self, target_url, max_pages, max_depth, revalidate=False, seed_urls=None, on_page=None):
+        """1ページずつ順番にクロールする（非同期クロールが使えない場合のフォールバック）"""
         self.visited_urls = set()  # 訪問済みURLをリセット
+        self.url = target_url
         
-        print(f"メインページをスクレイピング: {target_url}")
-        main_data = self.scrape(target_url)
-        self.visited_urls.add(target_url)
+        logger.info("メインページをスクレイピング: %s", target_url)
+        main_page = self.fetch_page(target_url, revalidate)
+        self.visited_urls.add(url_key(target_url))
         
-        if not main_data:
+        if not main_page:
             return None
         
-        all_content = main_data['content']
+        site_pages = [main_page]
+        if on_page:
+            on_page(main_page)
+        
+        # クロール中は取得済みページを保持し、リンク抽出のための再取得を避ける
+        pages = {target_url: main_page}
+        
+        # サイトマップのURLはメインページのリンクとして扱い、その先のリンクはたどらない
+        if seed_urls is not None:
+            pages[target_url] = dict(main_page, links=seed_urls)
+            max_depth = 1
         
         # 幅優先探索でサブページを探索
         queue = [(target_url, 0)]  # (URL, 深さ)
@@ -297,67 +673,314 @@ class WebScraper:
         while index < len(queue) and len(self.visited_urls) < max_pages:
             current_url, depth = queue[index]
             index += 1
+            self.crawl_stats["queue_depth"] = len(queue) - index
             
             # 最大深さに達したら探索を停止
             if depth >= max_depth:
                 continue
             
-            # 現在のページからリンクを抽出
-            if current_url not in self.visited_urls:
-                continue
-                
-            html_content = self.fetch_content(current_url)
-            if not html_content:
+            # 取得済みのページからリンクを参照
+            current_page = pages.get(current_url)
+            if not current_page:
                 continue
-                
-            links = self.extract_links(html_content, current_url)
             
             # 各リンクを処理
-            for link in links:
-                # 既に訪問済みならスキップ
-                if link in self.visited_urls:
+            for link in current_page['links']:
+                # 既に訪問済みならスキップ（末尾のスラッシュやスキームだけが異なるURLも同じページとして扱う）
+                key = url_key(link)
+                if key in self.visited_urls:
                     continue
                     
-                # 最大ページ数に達したら終了
-                if len(self.visited_urls) >= max_pages:
+                # 最大ページ数に達したか、中断が要求されたら終了
+                if len(self.visited_urls) >= max_pages or self.is_cancelled():
                     break
                 
                 # robots.txtをチェック
                 if not self.check_robots_txt(link):
                     continue
                 
-                print(f"サブページをスクレイピング中 ({len(self.visited_urls)}/{max_pages}): {link}")
-                sub_data = self.scrape(link)
-                self.visited_urls.add(link)
+                logger.debug("サブページをスクレイピング中 (%d/%d): %s", len(self.visited_urls), max_pages, link)
+                sub_page = self.fetch_page(link, revalidate)
+                self.visited_urls.add(key)
                 
-                if sub_data:
-                    all_content += f"\n\n--- サブページ: {sub_data['title']} ({link}) ---\n"
-                    all_content += sub_data['content']
+                if sub_page:
+                    pages[link] = sub_page
+                    site_pages.append(sub_page)
+                    if on_page:
+                        on_page(sub_page)
                 
                 # 次の深さのリンクをキューに追加
                 queue.append((link, depth + 1))
+                self.crawl_stats["queue_depth"] = len(queue) - index
                 
-                # 連続リクエストによるブロックを避けるため短い待機時間を設ける
-                time.sleep(0.5)
+                # 連続リクエストによるブロックを避けるため短い待機時間を設ける（Crawl-delayの指定があればそれに従う）
+                time.sleep(max(0.5, self.crawl_delay(link)))
         
-        main_data['content'] = all_content
-        print(f"合計 {len(self.visited_urls)} ページをスクレイピングしました")
+        return {
+            "title": main_page['title'],
+            "content": assemble_site_content(site_pages),
+            "url": target_url,
+            "pages": [
+                {"url": page['url'], "title": page['title'], "content": page['content']}
+                for page in site_pages
+            ]
+        }
+    
+    def _create_async_client(self):
+        """Keep-Alive接続を共有する非同期クライアントを作成する
+        
+        同期のセッションと同じく、保持する接続数はpool_size（HTTP_POOL_SIZE）とし、
+        同時に開く接続数は同時リクエスト数（max_concurrency）まで許可する
+        """
+        limits = httpx.Limits(
+            max_connections=max(self.max_concurrency, self.pool_size),
+            max_keepalive_connections=self.pool_size
+        )
+        
+        # 接続エラーはトランスポート層で再試行する
+        transport = httpx.AsyncHTTPTransport(retries=self.max_retries, limits=limits)
+        
+        return httpx.AsyncClient(
+            headers={'User-Agent': self.user_agent},
+            timeout=10,
+            follow_redirects=True,
+            transport=transport
+        )
+    
+    async def _crawl_async(self, target_url, max_pages, max_depth, revalidate=False, seed_urls=None, on_page=None):
+        """深さごとにサブページを並行取得する（幅優先・max_depth・max_pagesの扱いは同期版と同じ）"""
+        self.visited_urls = set()  # 訪問済みURLをリセット
+        self.url = target_url
         
-        # キャッシュに保存
-        if self.use_cache and self.db_manager:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        throttle = _HostThrottle(self.per_host_concurrency, self.host_delay)
+        
+        # 大きなクロールでは、HTMLの解析を複数のプロセスに分散する
+        parse_pool = None
+        if self.parse_processes > 0 and max_pages >= self.parse_pool_min_pages:
+            parse_pool = get_parse_pool(self.parse_processes)
+        
+        async with self._create_async_client() as client:
+            logger.info("メインページをスクレイピング: %s", target_url)
+            main_page = await self.fetch_page_async(client, target_url, semaphore, throttle, revalidate, parse_pool)
+            self.visited_urls.add(url_key(target_url))
+            
+            if not main_page:
+                return None
+            
+            site_pages = [main_page]
+            if on_page:
+                on_page(main_page)
+            
+            # 同じ深さのページをまとめて取得する（結合順は同期版の幅優先順と同じ）
+            level = [main_page]
+            
+            # サイトマップのURLはメインページのリンクとして扱い、その先のリンクはたどらない
+            if seed_urls is not None:
+                level = [dict(main_page, links=seed_urls)]
+                max_depth = 1
+            depth = 0
+            
+            async def fetch_queued(link):
+                # 中断が要求された場合、まだ取得していないページは取得しない
+                page = None
+                if not self.is_cancelled():
+                    page = await self.fetch_page_async(client, link, semaphore, throttle, revalidate, parse_pool)
+                self.crawl_stats["queue_depth"] -= 1
+                # 深さごとの取得の完了を待たずに、取得した順に渡す
+                if page and on_page:
+                    on_page(page)
+                return page
+            
+            while level and depth < max_depth and len(self.visited_urls) < max_pages and not self.is_cancelled():
+                next_urls = []
+                for current_page in level:
+                    for link in current_page['links']:
+                        key = url_key(link)
+                        if key in self.visited_urls:
+                            continue
+                        if len(self.visited_urls) >= max_pages:
+                            break
+                        self.visited_urls.add(key)
+                        next_urls.append(link)
+                
+                logger.info("深さ%dのサブページを並行取得中: %dページ (%d/%d)", depth + 1, len(next_urls), len(self.visited_urls), max_pages)
+                self.crawl_stats["queue_depth"] = len(next_urls)
+                
+                results = await asyncio.gather(*[fetch_queued(link) for link in next_urls])
+                
+                level = []
+                for link, sub_page in zip(next_urls, results):
+                    if sub_page:
+                        site_pages.append(sub_page)
+                        level.append(sub_page)
+                
+                depth += 1
+        
+        return {
+            "title": main_page['title'],
+            "content": assemble_site_content(site_pages),
+            "url": target_url,
+            "pages": [
+                {"url": page['url'], "title": page['title'], "content": page['content']}
+                for page in site_pages
+            ]
+        }
+
+    def ingest_sitemap(self, url=None, max_pages=None, force_refresh=False, cancel_event=None, use_async=None):
+        """サイトマップに記載されたページを取得してキャッシュに保存する（リンクはたどらない）
+        
+        ページはメインページを先頭に、priority・lastmodの順で最大max_pages件を取得する。
+        lastmodが前回の取得日時以前のページは変更されていないものとして取得せず、有効期限のみを延長する。
+        force_refresh=Trueの場合はすべてのページを条件付きGETで再検証する。
+        取得したページはサイトとしても保存され、scrape_with_subpagesでキャッシュから読み込める。
+        取得件数などの結果を返す（サイトマップがない場合・中断された場合はNone）
+        """
+        target_url = url or self.url
+        self.url = target_url
+        self.crawl_stats = self._new_crawl_stats()
+        self.cancel_event = cancel_event
+        self.from_cache = False
+        
+        # robots.txtをチェック
+        if not self.check_robots_txt(target_url):
+            logger.info("robots.txtによりアクセスが禁止されています: %s", target_url)
+            return None
+        
+        robots_entry = self._robots_entry(target_url) if self.respect_robots_txt else None
+        entries = fetch_sitemap_entries(
+            discover_sitemaps(target_url, robots_entry),
+            session=self.session,
+            normalize=lambda loc: self.url_filter.normalize(loc, target_url)
+        )
+        if not entries:
+            logger.info("サイトマップが見つかりませんでした: %s", target_url)
+            return None
+        
+        # メインページを先頭にし、robots.txtで禁止されたページを除く
+        main_key = url_key(target_url)
+        entries = [{"url": target_url, "lastmod": None, "priority": None}] + [
+            entry for entry in prioritize_entries(entries)
+            if url_key(entry["url"]) != main_key and self.check_robots_txt(entry["url"])
+        ]
+        if max_pages:
+            entries = entries[:max_pages]
+        urls = [entry["url"] for entry in entries]
+        
+        # lastmodが前回の取得日時以前のページは取得しない
+        unchanged = set()
+        if self.use_cache and self.db_manager and not force_refresh:
+            fetched_at = self.db_manager.get_pages_fetched_at(urls)
+            for entry in entries:
+                lastmod = parse_lastmod(entry["lastmod"])
+                if lastmod and entry["url"] in fetched_at and lastmod <= fetched_at[entry["url"]]:
+                    unchanged.add(entry["url"])
+            if unchanged:
+                self.db_manager.touch_pages(unchanged, self.cache_expire_days)
+        
+        to_fetch = [page_url for page_url in urls if page_url not in unchanged]
+        self.crawl_stats["pages_skipped"] = len(unchanged)
+        logger.info("サイトマップの%dページのうち、変更された可能性のある%dページを取得します: %s", len(urls), len(to_fetch), target_url)
+        
+        if use_async is None:
+            use_async = self.use_async
+        
+        with CRAWLS_IN_PROGRESS.track_inprogress(mode="sitemap"):
+            if use_async and httpx is not None:
+                titles = _run_coroutine(self._fetch_urls_async(to_fetch))
+            else:
+                titles = self._fetch_urls_sync(to_fetch)
+        
+        self.crawl_stats["queue_depth"] = 0
+        
+        if self.is_cancelled():
+            logger.info("サイトマップの取り込みが中断されました: %s", target_url)
+            return None
+        
+        page_urls = [page_url for page_url in urls if page_url in titles or page_url in unchanged]
+        self.visited_urls = {url_key(page_url) for page_url in page_urls}
+        
+        title = titles.get(target_url)
+        if title is None and self.use_cache and self.db_manager:
+            main_page = self.db_manager.get_page(target_url, include_content=False)
+            title = main_page["title"] if main_page else None
+        
+        # サイトとして保存し、チャットボットの初期化時にキャッシュから読み込めるようにする
+        if self.use_cache and self.db_manager and page_urls:
             self.db_manager.save_scraped_data(
                 target_url,
-                main_data['title'],
-                main_data['content'],
+                title or target_url,
+                None,
                 list(self.visited_urls),
-                self.cache_expire_days
+                self.cache_expire_days,
+                page_urls=page_urls
             )
-            print(f"データをキャッシュに保存しました: {target_url}")
         
-        return main_data
+        logger.info("サイトマップから %d ページを取得し、%d ページは変更がないため取得しませんでした: %s", len(titles), len(unchanged), target_url)
+        return {
+            "title": title or target_url,
+            "url": target_url,
+            "sitemap_pages": len(urls),
+            "pages_fetched": len(titles),
+            "pages_skipped": len(unchanged),
+            "pages_failed": len(to_fetch) - len(titles),
+            "pages_count": len(page_urls)
+        }
+    
+    def _fetch_urls_sync(self, urls):
+        """URLのリストを順番に取得してキャッシュに保存し、取得できたページの{URL: タイトル}を返す"""
+        titles = {}
+        self.crawl_stats["queue_depth"] = len(urls)
+        
+        for page_url in urls:
+            if self.is_cancelled():
+                break
+            
+            page = self.fetch_page(page_url, revalidate=True)
+            self.crawl_stats["queue_depth"] -= 1
+            if page:
+                titles[page_url] = page["title"]
+            
+            # 連続リクエストによるブロックを避けるため短い待機時間を設ける（Crawl-delayの指定があればそれに従う）
+            time.sleep(max(0.5, self.crawl_delay(page_url)))
+        
+        return titles
+    
+    async def _fetch_urls_async(self, urls):
+        """URLのリストを並行取得してキャッシュに保存し、取得できたページの{URL: タイトル}を返す"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        throttle = _HostThrottle(self.per_host_concurrency, self.host_delay)
+        
+        parse_pool = None
+        if self.parse_processes > 0 and len(urls) >= self.parse_pool_min_pages:
+            parse_pool = get_parse_pool(self.parse_processes)
+        
+        titles = {}
+        self.crawl_stats["queue_depth"] = len(urls)
+        
+        async def fetch(client, page_url):
+            page = None
+            if not self.is_cancelled():
+                page = await self.fetch_page_async(client, page_url, semaphore, throttle, True, parse_pool)
+            self.crawl_stats["queue_depth"] -= 1
+            if page:
+                titles[page_url] = page["title"]
+        
+        async with self._create_async_client() as client:
+            # 大量のページの内容をメモリに保持し続けないよう、一定数ずつ取得する
+            batch_size = self.max_concurrency * 10
+            for start in range(0, len(urls), batch_size):
+                if self.is_cancelled():
+                    break
+                await asyncio.gather(*[fetch(client, page_url) for page_url in urls[start:start + batch_size]])
+        
+        return titles
 
 # 使用例
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
+    
     scraper = WebScraper(use_cache=True, respect_robots_txt=True)
     url = input("スクレイピングするURLを入力してください: ")
     data = scraper.scrape_with_subpages(url, max_pages=10, max_depth=2)
@@ -0,0 +1,199 @@
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+# クライアントから受け取るセッションIDの形式
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+
+def is_valid_session_id(session_id):
+    """セッションIDとして受け付けられる形式かどうかを判断する"""
+    return bool(session_id) and bool(SESSION_ID_PATTERN.match(session_id))
+
+
+class SharedSite:
+    """複数のセッションから読み取り専用で共有される、読み込み済みのサイト情報
+    
+    段階的な初期化では、クロールが完了するまでバックグラウンドでページが追加される
+    （complete=Falseの間はmax_pagesを上限として読み込み中）
+    """
+    def __init__(self, url, title, pages_count, retriever, system_prompt, from_cache=False, content_hash=None,
+                 complete=True, max_pages=None):
+        self.url = url
+        self.title = title
+        self.pages_count = pages_count
+        self.retriever = retriever
+        self.system_prompt = system_prompt
+        self.from_cache = from_cache
+        self.content_hash = content_hash  # 回答キャッシュのキーに使うサイトの内容のハッシュ（読み込み中はNone）
+        self.max_pages = max_pages
+        self.completed = threading.Event()
+        if complete:
+            self.completed.set()
+        self.lock = threading.Lock()  # 読み込み中のページの追加と検索が同時に行われないようにする
+        self.memory_bytes = self._estimate_memory()
+    
+    def _estimate_memory(self):
+        """チャンクと検索インデックスのおおよそのメモリ使用量（バイト）を見積もる"""
+        chunks_bytes = sum(len(chunk["text"].encode("utf-8")) for chunk in self.retriever.chunks)
+        postings_bytes = sum(len(postings) for postings in self.retriever.index.postings.values()) * 64
+        return chunks_bytes + postings_bytes + len(self.system_prompt.encode("utf-8"))
+    
+    @property
+    def complete(self):
+        return self.completed.is_set()
+    
+    def search(self, query, k):
+        """質問に関連するチャンクを検索する"""
+        with self.lock:
+            return self.retriever.search(query, k)
+    
+    def add_pages(self, pages, pages_count):
+        """読み込み中のサイトにクロールで取得したページを追加する"""
+        with self.lock:
+            self.retriever.add_pages(pages)
+            self.pages_count = pages_count
+    
+    def finish(self, pages_count, system_prompt, content_hash, retriever=None):
+        """読み込みを完了する（以降は回答キャッシュを使用できる）
+        
+        retrieverを渡した場合は、読み込み中に作成した検索インデックスと置き換える
+        """
+        with self.lock:
+            if retriever is not None:
+                self.retriever = retriever
+            self.pages_count = pages_count
+            self.system_prompt = system_prompt
+            self.content_hash = content_hash
+            self.memory_bytes = self._estimate_memory()
+        self.completed.set()
+    
+    def coverage(self):
+        """質問に使えるサイトの範囲（取得済みのページ数・上限・読み込みが完了したかどうか）"""
+        complete = self.complete
+        ratio = 1.0
+        if not complete and self.max_pages:
+            ratio = min(self.pages_count / self.max_pages, 1.0)
+        return {
+            "pages_scraped": self.pages_count,
+            "max_pages": self.max_pages,
+            "complete": complete,
+            "ratio": round(ratio, 3)
+        }
+
+
+class SiteRegistry:
+    """読み込み済みのサイトをセッション間で共有するレジストリ
+    
+    いずれかのセッションが使用している間は弱参照で保持し、
+    使われなくなったサイトも直近のものは再初期化を避けるために一定数だけ保持する
+    """
+    def __init__(self, max_idle_sites=8):
+        self.max_idle_sites = max_idle_sites
+        self.sites = weakref.WeakValueDictionary()
+        self.recent = OrderedDict()  # 直近に使われたサイトへの強参照（LRU）
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            site = self.sites.get(key)
+            if site is not None:
+                self._remember(key, site)
+            return site
+    
+    def put(self, key, site):
+        with self.lock:
+            self.sites[key] = site
+            self._remember(key, site)
+    
+    def discard(self, key):
+        with self.lock:
+            self.sites.pop(key, None)
+            self.recent.pop(key, None)
+    
+    def _remember(self, key, site):
+        self.recent[key] = site
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.max_idle_sites:
+            self.recent.popitem(last=False)
+    
+    def memory_usage(self):
+        """共有中のサイトのメモリ使用量の合計（バイト）"""
+        with self.lock:
+            return sum(site.memory_bytes for site in list(self.sites.values()))
+    
+    def __len__(self):
+        return len(self.sites)
+
+
+class SessionManager:
+    """セッションごとのチャットボットを保持する上限付きのLRUレジストリ"""
+    def __init__(self, factory, max_sessions=100, idle_timeout=1800, max_memory_mb=512):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.sessions = OrderedDict()  # セッションID -> (チャットボット, 最終アクセス時刻)
+        self.lock = threading.Lock()
+    
+    def get(self, session_id):
+        """セッションのチャットボットを取得する（存在しない場合は作成する）"""
+        chatbot = self._touch(session_id)
+        if chatbot is not None:
+            return chatbot
+        
+        # チャットボットの作成中にほかのセッションの取得を待たせないように、ロックの外で作成する
+        created = self.factory()
+        with self.lock:
+            # 同じセッションが同時に作成された場合は、先に登録されたものを使う
+            entry = self.sessions.get(session_id)
+            chatbot = entry[0] if entry else created
+            return self._store(session_id, chatbot)
+    
+    def _touch(self, session_id):
+        """既存のセッションのチャットボットを取得し、最終アクセス時刻を更新する（存在しない場合はNone）"""
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            return self._store(session_id, entry[0]) if entry else None
+    
+    def _store(self, session_id, chatbot):
+        """チャットボットを最後にアクセスしたセッションとして登録する（ロックを保持して呼び出すこと）"""
+        now = time.monotonic()
+        self.sessions[session_id] = (chatbot, now)
+        self.sessions.move_to_end(session_id)
+        self._evict(now)
+        return chatbot
+    
+    def remove(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+    
+    def _evict(self, now):
+        """アイドル状態のセッションと、上限を超えた古いセッションを削除する"""
+        for session_id, (_, last_access) in list(self.sessions.items()):
+            if now - last_access > self.idle_timeout:
+                del self.sessions[session_id]
+        
+        # アクセス中のセッション（末尾）は削除しない
+        while len(self.sessions) > max(self.max_sessions, 1):
+            self.sessions.popitem(last=False)
+        
+        memory = self._sessions_memory()
+        while len(self.sessions) > 1 and memory > self.max_memory_bytes:
+            _, (chatbot, _) = self.sessions.popitem(last=False)
+            memory -= chatbot.estimate_memory()
+    
+    def _sessions_memory(self):
+        return sum(chatbot.estimate_memory() for chatbot, _ in self.sessions.values())
+    
+    def stats(self):
+        """セッション数とメモリ使用量の見積もりを返す"""
+        with self.lock:
+            return {
+                "sessions_count": len(self.sessions),
+                "max_sessions": self.max_sessions,
+                "sessions_memory_kb": self._sessions_memory() / 1024,
+                "max_memory_kb": self.max_memory_bytes / 1024
+            }
@@ -0,0 +1,86 @@
+import threading
+
+from metrics import SINGLEFLIGHT_REQUESTS
+
+
+class _Call:
+    """実行中の処理と、その完了を待つ呼び出しに共有する結果"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.interrupted = False
+
+
+class SingleFlight:
+    """同じキーに対して同時に呼ばれた処理を1回にまとめる
+    
+    最初の呼び出し（leader）だけが処理を実行し、実行中に同じキーで呼ばれた呼び出し（follower）は
+    その完了を待って同じ結果（または例外）を受け取る。処理が中断された場合（GeneratorExitなど）は、
+    待っていた呼び出しのうち1つが処理を引き継ぐ。完了した処理の結果は保持しない。
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}  # キー -> 実行中の処理
+        self.lock = threading.Lock()
+    
+    def join(self, key):
+        """同じキーの処理が実行中ならその完了を待つ
+        
+        自分が処理を実行する場合は(実行中の処理, None)を返す（完了後に必ずfinishを呼び出すこと）。
+        他の呼び出しの結果を共有した場合は(None, 結果)を返す（処理が失敗した場合は同じ例外を送出する）。
+        """
+        while True:
+            call, leader = self._begin(key)
+            if leader:
+                return call, None
+            
+            call.done.wait()
+            if call.interrupted:
+                continue
+            if call.error is not None:
+                raise call.error
+            return None, call.result
+    
+    def _begin(self, key):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+        SINGLEFLIGHT_REQUESTS.inc(flight=self.name, role="leader" if leader else "follower")
+        return call, leader
+    
+    def finish(self, key, call, result=None, error=None):
+        """処理の結果を待っている呼び出しに渡す"""
+        if error is not None and not isinstance(error, Exception):
+            call.interrupted = True
+        else:
+            call.result = result
+            call.error = error
+        with self.lock:
+            if self.calls.get(key) is call:
+                del self.calls[key]
+        call.done.set()
+    
+    def do(self, key, fn):
+        """同じキーの処理が実行中ならその結果を待ち、なければfnを実行する
+        
+        (結果, 他の呼び出しの結果を共有したかどうか)を返す
+        """
+        call, result = self.join(key)
+        if call is None:
+            return result, True
+        
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result, False
+    
+    def in_flight(self):
+        """実行中の処理の数"""
+        with self.lock:
+            return len(self.calls)
@@ -0,0 +1,150 @@
+import gzip
+import io
+import logging
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+
+import requests
+
+from robots import robots_origin
+
+logger = logging.getLogger(__name__)
+
+# サイトマップインデックスをたどる最大の深さ
+MAX_INDEX_DEPTH = 2
+
+# 展開後のサイトマップの最大サイズ（仕様上の上限は50MB）
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024
+
+# priorityが指定されていない項目の優先度（仕様上の既定値）
+DEFAULT_PRIORITY = 0.5
+
+
+def _local_name(tag):
+    """名前空間を除いたタグ名を返す"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return (child.text or '').strip() or None
+    return None
+
+
+def _decompress(content):
+    """gzipで圧縮されたサイトマップ（.xml.gz）を展開する"""
+    if content[:2] != b'\x1f\x8b':
+        return content
+    with gzip.GzipFile(fileobj=io.BytesIO(content)) as f:
+        data = f.read(MAX_SITEMAP_BYTES + 1)
+    if len(data) > MAX_SITEMAP_BYTES:
+        raise ValueError("展開後のサイトマップが大きすぎます")
+    return data
+
+
+def parse_lastmod(value):
+    """lastmod（W3C Datetime形式）をローカル時刻のdatetimeに変換する（解析できない場合はNone）"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def prioritize_entries(entries):
+    """priorityの高い順、同じ場合はlastmodの新しい順に並べる（lastmodがない項目は後ろに置く）"""
+    def sort_key(entry):
+        lastmod = parse_lastmod(entry["lastmod"])
+        priority = entry["priority"] if entry["priority"] is not None else DEFAULT_PRIORITY
+        return -priority, lastmod is None, -(lastmod.timestamp() if lastmod else 0)
+    return sorted(entries, key=sort_key)
+
+
+def parse_sitemap(content):
+    """サイトマップのXMLを解析し、(種類, 項目のリスト)を返す
+    
+    種類はurlset（ページのURL）またはsitemapindex（子サイトマップのURL）。
+    項目は url / lastmod / priority を持つ辞書。
+    """
+    root = ElementTree.fromstring(content)
+    kind = _local_name(root.tag)
+    item_tag = 'sitemap' if kind == 'sitemapindex' else 'url'
+    
+    entries = []
+    for element in root:
+        if _local_name(element.tag) != item_tag:
+            continue
+        loc = _child_text(element, 'loc')
+        if not loc:
+            continue
+        
+        priority = _child_text(element, 'priority')
+        try:
+            priority = float(priority) if priority else None
+        except ValueError:
+            priority = None
+        
+        entries.append({
+            "url": loc,
+            "lastmod": _child_text(element, 'lastmod'),
+            "priority": priority
+        })
+    return kind, entries
+
+
+def discover_sitemaps(url, robots_entry=None):
+    """サイトマップのURLを探す（robots.txtのSitemap行、なければ /sitemap.xml）"""
+    if robots_entry is not None:
+        sitemaps = robots_entry.sitemaps()
+        if sitemaps:
+            return sitemaps
+    return [f"{robots_origin(url)}/sitemap.xml"]
+
+
+def fetch_sitemap_entries(sitemap_urls, session=None, max_urls=None, normalize=None, timeout=10):
+    """サイトマップ（インデックス・gzipで圧縮されたものを含む）を取得し、ページの項目のリストを返す
+    
+    取得・解析に失敗したサイトマップは読み飛ばす。normalizeを渡した場合は、各URLを
+    normalize(url)の結果に置き換え、Noneになった項目を除外する。
+    同じURLの項目は最初のものだけを残す。
+    """
+    entries = {}
+    seen_sitemaps = set()
+    pending = [(sitemap_url, 0) for sitemap_url in sitemap_urls]
+    
+    while pending and (max_urls is None or len(entries) < max_urls):
+        sitemap_url, depth = pending.pop(0)
+        if sitemap_url in seen_sitemaps:
+            continue
+        seen_sitemaps.add(sitemap_url)
+        
+        try:
+            response = (session or requests).get(sitemap_url, timeout=timeout)
+            if response.status_code != 200:
+                continue
+            kind, items = parse_sitemap(_decompress(response.content))
+        except (requests.RequestException, ElementTree.ParseError, OSError, ValueError) as e:
+            logger.warning("サイトマップの取得に失敗しました: %s (%s)", sitemap_url, e)
+            continue
+        
+        if kind == 'sitemapindex':
+            if depth < MAX_INDEX_DEPTH:
+                pending.extend((item["url"], depth + 1) for item in items)
+            continue
+        
+        for item in items:
+            if normalize is not None:
+                url = normalize(item["url"])
+                if url is None:
+                    continue
+                item["url"] = url
+            entries.setdefault(item["url"], item)
+            if max_urls is not None and len(entries) >= max_urls:
+                break
+    
+    return list(entries.values())
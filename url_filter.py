@@ -0,0 +1,162 @@
+import posixpath
+import re
+from fnmatch import translate
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+# 画像、PDF、CSSなどクロール対象外のリソースの拡張子
+EXCLUDED_EXTENSIONS = (
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.ico', '.svg', '.pdf', '.css', '.js', '.xml', '.json',
+    '.zip', '.gz', '.tar', '.mp3', '.mp4', '.avi', '.mov', '.woff', '.woff2', '.ttf'
+)
+
+# クロール対象外のスキーム
+EXCLUDED_SCHEMES = frozenset(['mailto', 'tel', 'javascript', 'data', 'ftp'])
+
+# ページの内容に影響しないトラッキング用のクエリパラメータ
+TRACKING_PARAMS = frozenset(['gclid', 'fbclid', 'msclkid', 'yclid', '_ga', 'mc_cid', 'mc_eid'])
+TRACKING_PARAM_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+# 予約されていない文字のパーセントエンコーディング（デコードしても同じURLを表す）
+UNRESERVED_ESCAPE_PATTERN = re.compile(r'%(2[dDeE]|5[fF]|7[eE]|3[0-9]|[46][1-9a-fA-F]|[57][0-9aA])')
+ESCAPE_PATTERN = re.compile(r'%[0-9a-fA-F]{2}')
+DUPLICATE_SLASH_PATTERN = re.compile(r'/{2,}')
+
+
+def _compile_globs(patterns):
+    """globパターンのリストを一つの正規表現にまとめる（パターンがない場合はNone）"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{translate(pattern)})' for pattern in patterns))
+
+
+def _normalize_escapes(value):
+    """パーセントエンコーディングの表記を揃える（予約されていない文字はデコードし、それ以外は大文字にする）"""
+    if '%' not in value:
+        return value
+    value = UNRESERVED_ESCAPE_PATTERN.sub(lambda match: chr(int(match.group(1), 16)), value)
+    return ESCAPE_PATTERN.sub(lambda match: match.group(0).upper(), value)
+
+
+def _normalize_path(path):
+    """連続するスラッシュと「.」「..」を取り除いたパスを返す（末尾のスラッシュは保つ）"""
+    if not path:
+        return '/'
+    path = DUPLICATE_SLASH_PATTERN.sub('/', _normalize_escapes(path))
+    if '/.' in path:
+        trailing_slash = path.endswith(('/', '/.', '/..'))
+        path = posixpath.normpath(path)
+        if path.startswith('//'):
+            path = path[1:]
+        if trailing_slash and path != '/':
+            path += '/'
+    return path
+
+
+def _normalize_query(query):
+    """クエリパラメータをキー順に並べ、トラッキング用のパラメータを取り除く"""
+    if not query:
+        return ''
+    # 値はデコードせずに扱い、エンコードの違いでURLの意味が変わらないようにする
+    params = [
+        param for param in query.split('&')
+        if param and not _is_tracking_param(param.split('=', 1)[0])
+    ]
+    return '&'.join(sorted(params))
+
+
+def _is_tracking_param(key):
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PARAM_PREFIXES)
+
+
+def canonicalize_url(url):
+    """同じページを指すURLが同じ文字列になるよう正規化する
+    
+    スキームとホスト名を小文字にし、既定のポート番号・フラグメント・トラッキング用の
+    クエリパラメータを取り除く。パスの「.」「..」と連続するスラッシュを整理し、
+    クエリパラメータはキー順に並べる。
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if ':' in netloc and netloc.rsplit(':', 1)[1] == DEFAULT_PORTS.get(scheme):
+        netloc = netloc.rsplit(':', 1)[0]
+    return urlunsplit((scheme, netloc, _normalize_path(parts.path), _normalize_query(parts.query), ''))
+
+
+def url_key(url):
+    """訪問済みの判定に使うキーを返す（末尾のスラッシュの有無は同じページとして扱う）"""
+    url = canonicalize_url(url)
+    parts = urlsplit(url)
+    if len(parts.path) > 1 and parts.path.endswith('/'):
+        return urlunsplit(parts._replace(path=parts.path.rstrip('/')))
+    return url
+
+
+class URLFilter:
+    """リンクを正規化し、クロール対象とするかどうかを判断する
+    
+    除外する拡張子とinclude/excludeのglobパターンは作成時に一度だけコンパイルする。
+    globパターンはURLのパス（クエリがある場合は「?」以降を含む）に対して照合する。
+    includeパターンを指定した場合は、いずれかに一致するページのみをクロールする
+    （クロールの起点となるURLには適用しない）。
+    """
+    def __init__(self, include_patterns=None, exclude_patterns=None, excluded_extensions=EXCLUDED_EXTENSIONS):
+        self.include_patterns = list(include_patterns or [])
+        self.exclude_patterns = list(exclude_patterns or [])
+        self.excluded_extensions = tuple(ext.lower() for ext in excluded_extensions)
+        self._include = _compile_globs(self.include_patterns)
+        self._exclude = _compile_globs(self.exclude_patterns)
+    
+    def normalize(self, href, base_url):
+        """hrefを基準URLで解決し、クロール対象であれば正規化したURLを返す（対象外の場合はNone）"""
+        return self._normalize(href, base_url, urlsplit(canonicalize_url(base_url)))
+    
+    def _normalize(self, href, base_url, base):
+        href = href.strip()
+        if not href or href.startswith('#'):
+            return None
+        
+        scheme = href.split(':', 1)[0].lower() if ':' in href else ''
+        if scheme in EXCLUDED_SCHEMES:
+            return None
+        
+        url = canonicalize_url(urljoin(base_url, href))
+        parts = urlsplit(url)
+        
+        # 同じドメインのページのみを対象とする
+        if parts.netloc != base.netloc or parts.scheme not in DEFAULT_PORTS:
+            return None
+        
+        # 同じホストへのhttp/httpsのリンクは、クロール中のページと同じスキームに揃える
+        if parts.scheme != base.scheme and base.scheme in DEFAULT_PORTS:
+            url = urlunsplit(parts._replace(scheme=base.scheme))
+        
+        if parts.path.lower().endswith(self.excluded_extensions):
+            return None
+        
+        if not self.matches(parts):
+            return None
+        
+        return url
+    
+    def matches(self, parts):
+        """include/excludeパターンでURL（urlsplitの結果）を判定する"""
+        if self._include is None and self._exclude is None:
+            return True
+        
+        target = f'{parts.path}?{parts.query}' if parts.query else parts.path
+        if self._exclude is not None and self._exclude.match(target):
+            return False
+        return self._include is None or bool(self._include.match(target))
+    
+    def filter_links(self, hrefs, base_url):
+        """hrefのリストからクロール対象のURLを選ぶ（正規化後に重複するURLは最初のものだけを残す）"""
+        base = urlsplit(canonicalize_url(base_url))
+        links = {}
+        for href in hrefs:
+            url = self._normalize(href, base_url, base)
+            if url is not None:
+                links.setdefault(url_key(url), url)
+        return list(links.values())